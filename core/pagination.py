@@ -0,0 +1,211 @@
+# core/pagination.py
+"""
+Keyset (cursor) pagination.
+
+Pages are selected by position, not by OFFSET: a cursor holds the ordering
+key of the row at the edge of the current page, and the next page is the
+first ``page_size`` rows after that key, ``WHERE (date, id) > (d, i)`` in
+effect. With an index on the ordering columns every page costs the same
+index range scan, however deep it is, and rows inserted or deleted between
+requests never shift pages.
+
+The ordering comes from the view's ``keyset_ordering``, else the queryset's
+``order_by()``, else the model's Meta.ordering, and ``pk`` is appended when
+missing so the key is unique. Cursors are opaque URL-safe strings.
+"""
+import base64
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def resolve_ordering(queryset, ordering=None):
+    """[(field, descending)] for ``ordering`` (or the queryset's), ending with the primary key."""
+    opts = queryset.model._meta
+    ordering = list(ordering or queryset.query.order_by or opts.ordering or ())
+    fields = []
+    for item in ordering:
+        if not isinstance(item, str) or '__' in item or item.lstrip('-') == '?':
+            raise ImproperlyConfigured(f"Keyset pagination needs plain field names to order by, got {item!r}.")
+        name = item.lstrip('-')
+        field = opts.pk if name == 'pk' else opts.get_field(name)
+        fields.append((field, item.startswith('-')))
+    if not any(field == opts.pk for field, _ in fields):
+        fields.append((opts.pk, fields[-1][1] if fields else False))
+    return fields
+
+
+def _position_filter(fields, values, reverse):
+    """Rows strictly after ``values`` in the ordering (before it when ``reverse``)."""
+    (field, descending), value = fields[0], values[0]
+    descending ^= reverse
+    strictly = Q(**{f'{field.attname}__{"lt" if descending else "gt"}': value})
+    if len(fields) == 1:
+        return strictly
+    # The leading range condition lets the database seek on the index before the OR.
+    leading = Q(**{f'{field.attname}__{"lte" if descending else "gte"}': value})
+    return leading & (strictly | (Q(**{field.attname: value}) & _position_filter(fields[1:], values[1:], reverse)))
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder rounds datetimes to milliseconds; keys need them exact.
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values, reverse=False):
+    payload = json.dumps({'v': values, 'r': int(reverse)}, cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values, reverse = payload['v'], bool(payload['r'])
+        if len(values) != len(fields):
+            raise InvalidCursor("Cursor does not match the ordering.")
+        return [field.to_python(value) for (field, _), value in zip(fields, values)], reverse
+    except (TypeError, ValueError, KeyError, ValidationError) as exc:
+        raise InvalidCursor("Invalid cursor.") from exc
+
+
+class KeysetPage:
+    """One page of rows and the cursors to its neighbours (None at either end)."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def keyset_page(queryset, page_size, cursor=None, ordering=None):
+    """Fetch the page at ``cursor`` (the first page when None) with one query."""
+    fields = resolve_ordering(queryset, ordering)
+    order_by = [('-' if descending else '') + field.attname for field, descending in fields]
+    queryset = queryset.order_by(*order_by)
+    reverse = False
+    if cursor:
+        values, reverse = decode_cursor(cursor, fields)
+        queryset = queryset.filter(_position_filter(fields, values, reverse))
+        if reverse:
+            queryset = queryset.reverse()
+
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    def key(row):
+        return [getattr(row, field.attname) for field, _ in fields]
+
+    # Coming back from a later page means there is a next one, and vice versa.
+    has_next = has_more if not reverse else bool(cursor)
+    has_previous = bool(cursor) if not reverse else has_more
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(key(rows[-1])) if rows and has_next else None,
+        previous_cursor=encode_cursor(key(rows[0]), reverse=True) if rows and has_previous else None,
+    )
+
+
+class KeysetPagination(BasePagination):
+    """DRF pagination returning {'next', 'previous', 'results'} with opaque cursor links."""
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def get_page_size(self, request):
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(requested, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.request = request
+        try:
+            self.page = keyset_page(
+                queryset, page_size,
+                cursor=request.query_params.get(self.cursor_query_param),
+                ordering=getattr(view, 'keyset_ordering', None),
+            )
+        except InvalidCursor as exc:
+            raise NotFound(str(exc))
+        return self.page.object_list
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self._link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self._link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class KeysetPaginationMixin:
+    """
+    Keyset pagination for Django ListViews: ``?cursor=`` selects the page and
+    ``page_obj`` is a KeysetPage (``next_cursor`` / ``previous_cursor`` for links).
+    """
+    keyset_ordering = None
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = keyset_page(queryset, page_size, self.request.GET.get('cursor'), self.keyset_ordering)
+        except InvalidCursor as exc:
+            raise Http404(str(exc))
+        return None, page, page.object_list, page.has_next() or page.has_previous()
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class EventsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'events'
+
+    def ready(self):
+        from . import ratings, search, sentiment, terms, versions
+        ratings.connect_signals()
+        search.connect_signals()
+        sentiment.connect_signals()
+        terms.connect_signals()
+        versions.connect_signals()
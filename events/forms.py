@@ -15,6 +15,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import HttpResponse
 from django.shortcuts import render  
+from users.refdata import use_cached_country_choices
 
 
 class EventForm(forms.ModelForm):
@@ -56,6 +57,7 @@ class EventForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         Country = apps.get_model('users', 'Country')
         self.fields['country'].queryset = Country.objects.all()
+        use_cached_country_choices(self.fields['country'])
 
 
 class EventCategoryForm(forms.ModelForm):
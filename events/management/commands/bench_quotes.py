@@ -0,0 +1,73 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from events.models import Event
+from events.pricing import PriceTable
+
+CENT = Decimal('0.01')
+
+
+def random_events(count, rng):
+    """Unsaved events with random pricing, so the benchmark needs no data."""
+    now = timezone.now()
+    percent = lambda: Decimal(rng.choice([0, rng.randint(0, 5000)])).scaleb(-2)
+    return [
+        Event(
+            pk=pk,
+            base_price=Decimal(rng.randint(100, 50000000)).scaleb(-2),
+            date=now + timezone.timedelta(days=rng.randint(1, 90), seconds=rng.randint(0, 86399)),
+            early_bird_discount=percent(),
+            bulk_discount_threshold=rng.randint(2, 20),
+            bulk_discount_percentage=percent(),
+            discount_percentage=percent(),
+        )
+        for pk in range(1, count + 1)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Benchmark batch price quotes against Event.calculate_total_price."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=2000, help="Random events to price")
+        parser.add_argument('--sizes', default='1,2,4,10,20', help="Comma-separated party sizes")
+        parser.add_argument('--from-db', action='store_true', help="Price the events in the database instead")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        if options['from_db']:
+            events = list(Event.objects.order_by('pk'))
+        else:
+            events = random_events(options['events'], random.Random(options['seed']))
+        if not events:
+            self.stdout.write(self.style.WARNING("No events to price"))
+            return
+        cells = len(events) * len(sizes)
+
+        started = time.perf_counter()
+        expected = [[event.calculate_total_price(size).quantize(CENT) for size in sizes] for event in events]
+        decimal_us = (time.perf_counter() - started) / cells * 1e6
+
+        PriceTable.from_events(events[:1]).quote(sizes)  # import NumPy outside the timing
+        started = time.perf_counter()
+        table = PriceTable.from_events(events)
+        quotes = table.quote(sizes)
+        batch_us = (time.perf_counter() - started) / cells * 1e6
+
+        mismatches = sum(
+            Decimal(int(cents)).scaleb(-2) != price
+            for row, prices in zip(quotes.tolist(), expected)
+            for cents, price in zip(row, prices)
+        )
+        self.stdout.write(f"calculate_total_price: {decimal_us:.2f} us/quote over {cells} quotes")
+        self.stdout.write(f"PriceTable.quote:      {batch_us:.2f} us/quote over {cells} quotes")
+        self.stdout.write(f"Speedup:               {decimal_us / batch_us:.0f}x")
+        if mismatches:
+            self.stdout.write(self.style.WARNING(f"{mismatches} quotes disagreed between the two methods"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Both methods returned the same prices"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from events.terms import rebuild_terms
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-event term frequencies (EventTerm) from every EventComment."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', dest='events', help="Only this event id (repeatable)")
+
+    def handle(self, *args, **options):
+        total = rebuild_terms(options['events'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} event terms"))
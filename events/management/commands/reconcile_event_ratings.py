@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from events.ratings import reconcile_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute rating count, sum, histogram and average from EventRating "
+        "and report (or fix with --fix) events whose aggregates drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Write the recomputed values for drifted events")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--show', type=int, default=20, help="Number of drifted events to print")
+
+    def handle(self, *args, **options):
+        drifted = reconcile_ratings(fix=options['fix'], batch_size=options['batch_size'])
+        for pk, stored, expected in drifted[:options['show']]:
+            self.stdout.write(f"event {pk}: {stored} -> {expected}")
+
+        summary = f"{len(drifted)} events drifted"
+        if options['fix']:
+            summary += ", all fixed"
+        self.stdout.write(self.style.SUCCESS(summary) if not drifted or options['fix'] else self.style.WARNING(summary))
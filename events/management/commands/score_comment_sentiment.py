@@ -0,0 +1,49 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+
+from events.models import EventComment
+from events.sentiment import score_texts, store_polarities
+
+
+class Command(BaseCommand):
+    help = "Score every comment without a stored polarity, in parallel batches, and update the event counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=None, help="Scoring processes (defaults to the CPU count)")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        workers = options['workers'] or os.cpu_count() or 1
+        stored = 0
+
+        def batches():
+            # Keyset over unscored comments; texts are read here so workers never touch the database.
+            last_pk = 0
+            while True:
+                rows = list(
+                    EventComment.objects.filter(polarity__isnull=True, pk__gt=last_pk)
+                    .order_by('pk').values_list('pk', 'comment')[:batch_size]
+                )
+                if not rows:
+                    return
+                last_pk = rows[-1][0]
+                yield rows
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            running = {}
+            for rows in batches():
+                running[pool.submit(score_texts, [text for _, text in rows])] = rows
+                if len(running) >= workers * 2:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    stored += sum(self.store(future, running.pop(future)) for future in done)
+            for future in list(running):
+                stored += self.store(future, running.pop(future))
+
+        self.stdout.write(self.style.SUCCESS(f"Scored {stored} comments"))
+
+    def store(self, future, rows):
+        polarities = future.result()
+        return store_polarities({pk: (text, polarity) for (pk, text), polarity in zip(rows, polarities)})
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from events.search import update_search_vectors, uses_full_text
+
+
+class Command(BaseCommand):
+    help = "Recompute Event.search_vector for every event (after bulk imports or a search config change)."
+
+    def handle(self, *args, **options):
+        if not uses_full_text():
+            self.stdout.write(self.style.WARNING("Full-text search vectors are only used on PostgreSQL"))
+            return
+        count = update_search_vectors()
+        self.stdout.write(self.style.SUCCESS(f"Updated search vectors for {count} events"))
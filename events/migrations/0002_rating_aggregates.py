@@ -0,0 +1,59 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:15
+
+from django.db import migrations, models
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Event = apps.get_model('events', 'Event')
+    EventRating = apps.get_model('events', 'EventRating')
+    histogram = {
+        f'rating_{score}_count': models.Count('pk', filter=models.Q(rating=score)) for score in range(1, 6)
+    }
+    rows = EventRating.objects.values('event_id').annotate(
+        rating_count=models.Count('pk'), rating_sum=models.Sum('rating'), **histogram
+    ).order_by()
+    for row in rows:
+        event_id = row.pop('event_id')
+        row['average_rating'] = round(row['rating_sum'] / row['rating_count'], 2)
+        Event.objects.filter(pk=event_id).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
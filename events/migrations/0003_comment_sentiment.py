@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='negative_comments',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='neutral_comments',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='positive_comments',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='eventcomment',
+            name='polarity',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0003_comment_sentiment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='events.event')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['event', '-count', 'term'], name='eventterm_event_rank_idx')],
+                'unique_together': {('event', 'term')},
+            },
+        ),
+    ]
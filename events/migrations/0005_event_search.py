@@ -0,0 +1,44 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:20
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+INDEX_NAME = 'events_event_search_vector_gin'
+
+
+def create_search_index(apps, schema_editor):
+    # tsvector and GIN are PostgreSQL features; other backends search without them.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.search import SearchVector
+
+    config = getattr(settings, 'EVENT_SEARCH_CONFIG', 'english')
+    schema_editor.execute(f'CREATE INDEX {INDEX_NAME} ON events_event USING gin (search_vector)')
+    Event = apps.get_model('events', 'Event')
+    Event.objects.update(search_vector=(
+        SearchVector('title', weight='A', config=config)
+        + SearchVector('location', weight='B', config=config)
+        + SearchVector('description', weight='C', config=config)
+    ))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0004_event_terms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 import uuid
@@ -43,9 +44,29 @@ class Event(models.Model):
     bulk_discount_threshold = models.PositiveIntegerField(default=10, help_text="Number of attendees needed for bulk discount")
     bulk_discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0.0, help_text="Discount percentage for bulk booking")
 
-    # Rating
+    # Rating (kept current by events.ratings on every rating change)
     average_rating = models.FloatField(default=0.0)
     rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
+    # Comment sentiment (kept current by events.sentiment as comments are scored)
+    positive_comments = models.PositiveIntegerField(default=0)
+    negative_comments = models.PositiveIntegerField(default=0)
+    neutral_comments = models.PositiveIntegerField(default=0)
+
+    # Weighted tsvector of title, location and description (PostgreSQL; see events.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination key for event listings.
+            models.Index(fields=['date', 'id'], name='event_date_id_idx'),
+        ]
 
     
     def __str__(self):
@@ -92,29 +113,19 @@ class Event(models.Model):
             self.unique_id = f"{self.vendor.vendor_unique_id}-{uuid.uuid4()}"
             self.save(update_fields=['unique_id'])
 
+    @property
+    def rating_histogram(self):
+        return {score: getattr(self, f'rating_{score}_count') for score in range(1, 6)}
+
     def update_average_rating(self):
-        ratings = self.ratings.all()
-        if ratings:
-            avg = ratings.aggregate(models.Avg('rating'))['rating__avg']
-            self.average_rating = round(avg, 2)
-            self.rating_count = ratings.count()
-        else:
-            self.average_rating = 0.0
-            self.rating_count = 0
-        self.save()
+        """Recompute the rating aggregates from scratch (see events.ratings for the incremental path)."""
+        from .ratings import AGGREGATE_FIELDS, reconcile_ratings
+        reconcile_ratings(fix=True, event_ids=[self.pk])
+        self.refresh_from_db(fields=AGGREGATE_FIELDS)
 
     def sentiment_analysis(self):
-        from textblob import TextBlob
-        comments = self.comments.all()
-        positive = negative = neutral = 0
-        for comment in comments:
-            analysis = TextBlob(comment.comment)
-            if analysis.sentiment.polarity > 0:
-                positive += 1
-            elif analysis.sentiment.polarity < 0:
-                negative += 1
-            else:
-                neutral += 1
+        """Share of scored comments per sentiment, from the counters kept by events.sentiment."""
+        positive, negative, neutral = self.positive_comments, self.negative_comments, self.neutral_comments
         total = positive + negative + neutral
         return {
             'positive': round((positive / total) * 100, 2) if total else 0,
@@ -123,11 +134,9 @@ class Event(models.Model):
         } if total else {'positive': 0, 'negative': 0, 'neutral': 0}
 
     def common_words(self, count=10):
-        from collections import Counter
-        words = []
-        for comment in self.comments.all():
-            words.extend([word.lower() for word in comment.comment.split() if word.isalnum()])
-        return Counter(words).most_common(count)
+        """The ``count`` most frequent non-stop-words in this event's comments, as (word, occurrences)."""
+        from .terms import top_terms
+        return top_terms(self.pk, count)
     
 
 class Booking(models.Model):
@@ -173,8 +182,21 @@ class EventRating(models.Model):
         unique_together = ('event', 'user')
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.event.update_average_rating()
+        from .ratings import apply_rating_change
+        with transaction.atomic(using=kwargs.get('using')):
+            previous = None
+            if self.pk and not self._state.adding:
+                # Lock the row so concurrent edits of one rating each see the value they replace.
+                previous = EventRating.objects.select_for_update().filter(pk=self.pk).values_list('event_id', 'rating').first()
+            super().save(*args, **kwargs)
+            if previous is None:
+                apply_rating_change(self.event_id, added=[self.rating])
+            elif previous[0] == self.event_id:
+                if previous[1] != self.rating:
+                    apply_rating_change(self.event_id, added=[self.rating], removed=[previous[1]])
+            else:
+                apply_rating_change(previous[0], removed=[previous[1]])
+                apply_rating_change(self.event_id, added=[self.rating])
 
 class EventComment(models.Model):
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='comments')
@@ -182,11 +204,50 @@ class EventComment(models.Model):
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE)
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # TextBlob polarity in [-1, 1]; NULL until the background scorer has seen this text.
+    polarity = models.FloatField(null=True, blank=True, editable=False)
 
     class Meta:
         unique_together = ('event', 'user', 'booking')
 
+    def save(self, *args, **kwargs):
+        from .sentiment import adjust_counters, label, sentiment_queue
+        from .terms import apply_terms, tokenize
+        with transaction.atomic(using=kwargs.get('using')):
+            previous = None
+            if self.pk and not self._state.adding:
+                previous = EventComment.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'event_id', 'comment', 'polarity'
+                ).first()
+            changed = previous is None or previous[:2] != (self.event_id, self.comment)
+            if changed and previous is not None:
+                if previous[2] is not None:
+                    adjust_counters({previous[0]: {label(previous[2]): -1}})
+                apply_terms(previous[0], tokenize(previous[1]), sign=-1)
+            if changed:
+                self.polarity = None
+            else:
+                # This instance may predate the scorer; keep the stored (and counted) score.
+                self.polarity = previous[2]
+            super().save(*args, **kwargs)
+            if changed:
+                apply_terms(self.event_id, tokenize(self.comment))
+                pk = self.pk
+                transaction.on_commit(lambda: sentiment_queue.enqueue(pk), using=kwargs.get('using'))
+
+
+class EventTerm(models.Model):
+    """How often a word occurs across an event's comments (maintained by events.terms)."""
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='terms')
+    term = models.CharField(max_length=100)
+    count = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        unique_together = ('event', 'term')
+        indexes = [models.Index(fields=['event', '-count', 'term'], name='eventterm_event_rank_idx')]
+
+    def __str__(self):
+        return f"{self.term} ({self.count})"
 
 class Ticket(models.Model):
     booking = models.OneToOneField(Booking, on_delete=models.CASCADE, related_name='ticket')
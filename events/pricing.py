@@ -0,0 +1,132 @@
+# events/pricing.py
+"""
+Batch price quotes.
+
+``Event.calculate_total_price`` prices one event for one party size with
+Decimal arithmetic. ``quote_matrix`` prices many events for many party sizes
+at once: the pricing columns become NumPy arrays and the early-bird, bulk and
+standard discount rules are applied to the whole events x sizes matrix.
+
+Everything stays in integers. Prices are cents and each discount is the
+factor ``(10000 - percent * 100) / 10000``; after each factor the value is
+kept as an integer part plus an exact remainder, so the result is the exact
+Decimal total rounded half-even to the cent, which is what
+``calculate_total_price(n).quantize(Decimal('0.01'))`` gives.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+EARLY_BIRD_WINDOW = timedelta(days=30)
+
+PRICING_FIELDS = (
+    'pk', 'base_price', 'date', 'early_bird_discount',
+    'bulk_discount_threshold', 'bulk_discount_percentage', 'discount_percentage',
+)
+
+# Percentages have two decimal places, so each discount factor is an integer over 10000.
+_FACTOR_SCALE = 10000
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+# Above this bound intermediate values could overflow int64; such batches use Python ints.
+_INT64_BOUND = 2 ** 62
+
+
+def _scaled(values, places):
+    """Fixed-point Decimals (at most 15 significant digits) as int64 minor units."""
+    import numpy as np
+
+    return np.rint(np.array(values, dtype=np.float64) * 10 ** places).astype(np.int64)
+
+
+def _microseconds(value):
+    return (value - _EPOCH) // _MICROSECOND
+
+
+class PriceTable:
+    """The pricing columns of a set of events, as arrays indexed like ``ids``."""
+
+    def __init__(self, rows):
+        import numpy as np
+
+        columns = list(zip(*rows)) or [()] * len(PRICING_FIELDS)
+        self.ids = list(columns[0])
+        self.cents = _scaled(columns[1], 2)
+        self.dates = np.array([_microseconds(date) for date in columns[2]], dtype=np.int64)
+        self.early_bird = _scaled(columns[3], 2)
+        self.thresholds = np.array(columns[4], dtype=np.int64)
+        self.bulk = _scaled(columns[5], 2)
+        self.standard = _scaled(columns[6], 2)
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        """One query for the pricing columns, no model instances."""
+        return cls(queryset.order_by('pk').values_list(*PRICING_FIELDS))
+
+    @classmethod
+    def from_events(cls, events):
+        return cls([
+            (event.pk, event.base_price, event.date, event.early_bird_discount,
+             event.bulk_discount_threshold, event.bulk_discount_percentage, event.discount_percentage)
+            for event in events
+        ])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def quote(self, party_sizes, now=None):
+        """
+        Prices in cents, shape (len(self), len(party_sizes)).
+
+        The array is int64 unless the inputs are large enough to overflow it,
+        in which case it holds Python ints.
+        """
+        import numpy as np
+
+        sizes = [int(size) for size in party_sizes]
+        if any(size < 0 for size in sizes):
+            raise ValueError("Party sizes must not be negative.")
+        now = now or timezone.now()
+        if not len(self) or not sizes:
+            return np.zeros((len(self), len(sizes)), dtype=np.int64)
+
+        early = self.dates > _microseconds(now + EARLY_BIRD_WINDOW)
+        factors = [
+            np.where(early, _FACTOR_SCALE - self.early_bird, _FACTOR_SCALE)[:, None],
+            None,  # bulk: depends on the party size, filled in below
+            (_FACTOR_SCALE - self.standard)[:, None],
+        ]
+        bulk_applies = np.array(sizes, dtype=np.int64)[None, :] >= self.thresholds[:, None]
+        factors[1] = np.where(bulk_applies, (_FACTOR_SCALE - self.bulk)[:, None], _FACTOR_SCALE)
+
+        largest_factor = max(_FACTOR_SCALE, *(int(np.abs(factor).max()) for factor in factors))
+        bound = int(self.cents.max()) * max(sizes) * largest_factor ** 3 // _FACTOR_SCALE ** 3
+        dtype = np.int64 if bound < _INT64_BOUND else object
+
+        cents = self.cents.astype(dtype)[:, None]
+        whole = cents * np.array(sizes, dtype=dtype)[None, :]
+        remainder = np.zeros_like(whole)
+        scale = 1
+        for factor in factors:
+            # value = whole + remainder / scale; multiply it by factor / 10000 exactly.
+            factor = factor.astype(dtype)
+            numerator = (whole % _FACTOR_SCALE * scale + remainder) * factor
+            scale *= _FACTOR_SCALE
+            whole = whole // _FACTOR_SCALE * factor + numerator // scale
+            remainder = numerator % scale
+
+        # Round half to even, then clamp at zero like calculate_total_price.
+        twice = remainder * 2
+        rounded = whole + (twice > scale) + ((twice == scale) & (whole % 2 == 1))
+        return np.maximum(rounded, 0)
+
+
+def quote_matrix(queryset, party_sizes, now=None):
+    """(event ids, cents matrix) for every event in ``queryset`` and every party size."""
+    table = PriceTable.from_queryset(queryset)
+    return table.ids, table.quote(party_sizes, now=now)
+
+
+def format_cents(cents):
+    """'1234.50' for 123450 cents."""
+    return f"{cents // 100}.{cents % 100:02d}"
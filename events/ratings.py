@@ -0,0 +1,111 @@
+# events/ratings.py
+"""
+Incremental rating aggregates.
+
+Each Event keeps ``rating_count``, ``rating_sum``, a 1-5 histogram
+(``rating_1_count`` .. ``rating_5_count``) and the derived ``average_rating``.
+Saving or deleting an EventRating adjusts them with a single UPDATE of F()
+expressions, so concurrent ratings never read-modify-write the event row and
+the cost does not grow with the number of ratings. ``reconcile_ratings``
+recomputes everything from the ratings table to repair drift.
+"""
+from collections import Counter
+
+from django.apps import apps
+from django.db.models import Count, DecimalField, F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, NullIf, Round
+from django.db.models.signals import post_delete
+
+from .versions import schedule_version_bump
+
+SCORES = range(1, 6)
+HISTOGRAM_FIELDS = {score: f'rating_{score}_count' for score in SCORES}
+AGGREGATE_FIELDS = ('rating_count', 'rating_sum', *HISTOGRAM_FIELDS.values(), 'average_rating')
+
+
+def _average(total, count):
+    # Rounded as numeric: PostgreSQL has no two-argument round() for floats.
+    average = Cast(Cast(total, FloatField()) / NullIf(count, 0), DecimalField(max_digits=12, decimal_places=6))
+    return Coalesce(Cast(Round(average, 2), FloatField()), Value(0.0))
+
+
+def apply_rating_change(event_id, added=(), removed=()):
+    """Add the ``added`` scores to an event's aggregates and take the ``removed`` ones out, in one UPDATE."""
+    Event = apps.get_model('events', 'Event')
+    histogram = Counter(added)
+    histogram.subtract(removed)
+    # Counters never go below zero, even if they drifted before reconciliation caught it.
+    count = Greatest(F('rating_count') + (len(added) - len(removed)), 0)
+    total = Greatest(F('rating_sum') + (sum(added) - sum(removed)), 0)
+    updates = {
+        HISTOGRAM_FIELDS[score]: Greatest(F(HISTOGRAM_FIELDS[score]) + delta, 0)
+        for score, delta in histogram.items()
+        if delta and score in HISTOGRAM_FIELDS
+    }
+    Event.objects.filter(pk=event_id).update(
+        rating_count=count, rating_sum=total, average_rating=_average(total, count), **updates
+    )
+    # The API shows the average and count, so cached event pages are stale now.
+    schedule_version_bump(event_ids=[event_id])
+
+
+def rating_totals(event_ids=None):
+    """{event_id: (count, sum, [1-5 histogram])} from the ratings table, one GROUP BY."""
+    EventRating = apps.get_model('events', 'EventRating')
+    ratings = EventRating.objects.all()
+    if event_ids is not None:
+        ratings = ratings.filter(event_id__in=event_ids)
+    rows = (
+        ratings.values('event_id')
+        .annotate(count=Count('pk'), total=Sum('rating'), **{
+            field: Count('pk', filter=Q(rating=score)) for score, field in HISTOGRAM_FIELDS.items()
+        })
+        .order_by()
+    )
+    return {
+        row['event_id']: (row['count'], row['total'] or 0, [row[field] for field in HISTOGRAM_FIELDS.values()])
+        for row in rows
+    }
+
+
+def reconcile_ratings(fix=False, event_ids=None, batch_size=1000):
+    """
+    Compare every event's stored aggregates with the ratings table.
+
+    Returns a list of (event_id, stored values, expected values) for the
+    events that drifted; with ``fix`` their aggregates are rewritten.
+    """
+    Event = apps.get_model('events', 'Event')
+    totals = rating_totals(event_ids)
+    events = Event.objects.order_by('pk')
+    if event_ids is not None:
+        events = events.filter(pk__in=event_ids)
+
+    drifted, pending = [], []
+    for pk, *stored in events.values_list('pk', *AGGREGATE_FIELDS).iterator(chunk_size=batch_size):
+        count, total, histogram = totals.get(pk, (0, 0, [0] * len(HISTOGRAM_FIELDS)))
+        expected = [count, total, *histogram, round(total / count, 2) if count else 0.0]
+        # The database may round the average's last digit differently; only a real difference counts.
+        if stored[:-1] == expected[:-1] and abs(stored[-1] - expected[-1]) < 0.01:
+            continue
+        drifted.append((pk, stored, expected))
+        if fix:
+            pending.append(Event(pk=pk, **dict(zip(AGGREGATE_FIELDS, expected))))
+            if len(pending) >= batch_size:
+                Event.objects.bulk_update(pending, AGGREGATE_FIELDS)
+                pending = []
+    if pending:
+        Event.objects.bulk_update(pending, AGGREGATE_FIELDS)
+    if fix and drifted:
+        schedule_version_bump(event_ids=[pk for pk, _, _ in drifted])
+    return drifted
+
+
+def _rating_deleted(sender, instance, **kwargs):
+    apply_rating_change(instance.event_id, removed=[instance.rating])
+
+
+def connect_signals():
+    # post_delete also covers queryset and cascade deletes, which skip Model.delete().
+    EventRating = apps.get_model('events', 'EventRating')
+    post_delete.connect(_rating_deleted, sender=EventRating, dispatch_uid='events_ratings_delete')
@@ -0,0 +1,231 @@
+# events/search.py
+"""
+Event search with facets.
+
+On PostgreSQL, title, location and description are matched through
+``Event.search_vector``, a weighted tsvector kept current on save and indexed
+with GIN (see migration 0005), and results are ordered by ``ts_rank``. Other
+backends fall back to a portable engine: every search word must occur in one
+of the three fields (case-insensitive), and matches in the title count most.
+
+Only active, approved events are searchable. Facets (categories, country,
+price band, date range) are computed with one grouped query each, over the
+results filtered by every other facet's selection, so a client can show the
+alternatives to what is already selected.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Count, Exists, F, IntegerField, OuterRef, Q, Value, When
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+# Upper bounds of the price bands; the last band is open-ended.
+DEFAULT_PRICE_BANDS = (25, 50, 100, 250)
+
+# Date range facet, in order: name -> events before now + days (None: no upper bound).
+DATE_RANGES = (
+    ('past', 0),
+    ('next_7_days', 7),
+    ('next_30_days', 30),
+    ('later', None),
+)
+
+def search_config():
+    return getattr(settings, 'EVENT_SEARCH_CONFIG', 'english')
+
+
+def uses_full_text():
+    return connection.vendor == 'postgresql'
+
+
+def search_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    config = search_config()
+    return (
+        SearchVector('title', weight='A', config=config)
+        + SearchVector('location', weight='B', config=config)
+        + SearchVector('description', weight='C', config=config)
+    )
+
+
+def update_search_vectors(queryset=None):
+    """Recompute ``search_vector`` for ``queryset`` (all events by default). PostgreSQL only."""
+    Event = apps.get_model('events', 'Event')
+    if not uses_full_text():
+        return 0
+    queryset = Event.objects.all() if queryset is None else queryset
+    return queryset.update(search_vector=search_vector())
+
+
+def price_bands():
+    bounds = getattr(settings, 'EVENT_SEARCH_PRICE_BANDS', DEFAULT_PRICE_BANDS)
+    bands, lower = [], Decimal(0)
+    for upper in bounds:
+        bands.append((f'{lower}-{upper}', lower, Decimal(upper)))
+        lower = Decimal(upper)
+    bands.append((f'{lower}+', lower, None))
+    return bands
+
+
+def _price_band_case():
+    whens = [When(base_price__lt=upper, then=Value(name)) for name, _, upper in price_bands() if upper is not None]
+    return Case(*whens, default=Value(price_bands()[-1][0]))
+
+
+def _date_range_case(now):
+    whens = [
+        When(date__lt=now + timedelta(days=days), then=Value(name))
+        for name, days in DATE_RANGES if days is not None
+    ]
+    return Case(*whens, default=Value(DATE_RANGES[-1][0]))
+
+
+class EventSearch:
+    """
+    One search request: ``query`` text plus facet selections.
+
+    ``categories`` are tag slugs, ``countries`` country ids, ``prices`` and
+    ``dates`` band / range names as returned in the facets.
+    """
+
+    def __init__(self, query='', categories=(), countries=(), prices=(), dates=(), now=None):
+        self.query = (query or '').strip()
+        self.categories = list(categories)
+        self.countries = list(countries)
+        self.prices = list(prices)
+        self.dates = list(dates)
+        self.now = now or timezone.now()
+        unknown = set(self.prices) - {name for name, _, _ in price_bands()}
+        unknown |= set(self.dates) - {name for name, _ in DATE_RANGES}
+        if unknown:
+            raise ValueError(f"Unknown price bands or date ranges: {', '.join(sorted(unknown))}")
+
+    def _search_query(self):
+        from django.contrib.postgres.search import SearchQuery
+        return SearchQuery(self.query, search_type='websearch', config=search_config())
+
+    def base_queryset(self):
+        """Searchable events matching the text query, without facet selections."""
+        Event = apps.get_model('events', 'Event')
+        events = Event.objects.filter(is_active=True, is_approved=True)
+        if not self.query:
+            return events
+        if uses_full_text():
+            return events.filter(search_vector=self._search_query())
+        for word in self.query.split():
+            events = events.filter(Q(title__icontains=word) | Q(location__icontains=word) | Q(description__icontains=word))
+        return events
+
+    def _rank(self):
+        if uses_full_text():
+            from django.contrib.postgres.search import SearchRank
+            return SearchRank(F('search_vector'), self._search_query())
+        rank = Value(0)
+        for word in self.query.split():
+            rank = rank + Case(
+                When(title__icontains=word, then=Value(3)),
+                When(location__icontains=word, then=Value(2)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        return rank
+
+    def _filters(self):
+        """Facet name -> Q for that facet's selection."""
+        TaggedItem = apps.get_model('taggit', 'TaggedItem')
+        ContentType = apps.get_model('contenttypes', 'ContentType')
+        filters = {}
+        if self.categories:
+            tagged = TaggedItem.objects.filter(
+                content_type=ContentType.objects.get_for_model(apps.get_model('events', 'Event')),
+                object_id=OuterRef('pk'),
+                tag__slug__in=self.categories,
+            )
+            filters['categories'] = Q(Exists(tagged))
+        if self.countries:
+            filters['country'] = Q(country_id__in=self.countries)
+        if self.prices:
+            q = Q()
+            for name, lower, upper in price_bands():
+                if name in self.prices:
+                    q |= Q(base_price__gte=lower, base_price__lt=upper) if upper is not None else Q(base_price__gte=lower)
+            filters['price'] = q
+        if self.dates:
+            q, lower = Q(), None
+            for name, days in DATE_RANGES:
+                upper = self.now + timedelta(days=days) if days is not None else None
+                if name in self.dates:
+                    bounds = {}
+                    if lower is not None:
+                        bounds['date__gte'] = lower
+                    if upper is not None:
+                        bounds['date__lt'] = upper
+                    q |= Q(**bounds)
+                lower = upper
+            filters['date'] = q
+        return filters
+
+    def _filtered(self, exclude=None):
+        events = self.base_queryset()
+        for name, q in self._filters().items():
+            if name != exclude:
+                events = events.filter(q)
+        return events
+
+    def results(self):
+        events = self._filtered().select_related('country', 'vendor').prefetch_related('categories')
+        if self.query:
+            return events.annotate(rank=self._rank()).order_by('-rank', 'date', 'pk')
+        return events.order_by('date', 'pk')
+
+    def facets(self):
+        """{facet: [{'value', 'label', 'count'}]}, one grouped query per facet."""
+        categories = (
+            self._filtered('categories').filter(categories__isnull=False)
+            .values('categories__slug', 'categories__name')
+            .annotate(count=Count('pk', distinct=True)).order_by('-count', 'categories__name')
+        )
+        countries = (
+            self._filtered('country').values('country_id', 'country__name')
+            .annotate(count=Count('pk')).order_by('-count', 'country__name')
+        )
+        prices = dict(
+            self._filtered('price').annotate(band=_price_band_case())
+            .values('band').annotate(count=Count('pk')).order_by().values_list('band', 'count')
+        )
+        dates = dict(
+            self._filtered('date').annotate(range=_date_range_case(self.now))
+            .values('range').annotate(count=Count('pk')).order_by().values_list('range', 'count')
+        )
+        return {
+            'categories': [
+                {'value': row['categories__slug'], 'label': row['categories__name'], 'count': row['count']}
+                for row in categories
+            ],
+            'country': [
+                {'value': row['country_id'], 'label': row['country__name'], 'count': row['count']}
+                for row in countries
+            ],
+            'price': [{'value': name, 'label': name, 'count': prices.get(name, 0)} for name, _, _ in price_bands()],
+            'date': [{'value': name, 'label': name, 'count': dates.get(name, 0)} for name, _ in DATE_RANGES],
+        }
+
+
+_TEXT_FIELDS = {'title', 'description', 'location'}
+
+
+def _event_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not _TEXT_FIELDS & set(update_fields):
+        return
+    update_search_vectors(sender.objects.filter(pk=instance.pk))
+
+
+def connect_signals():
+    if uses_full_text():
+        Event = apps.get_model('events', 'Event')
+        post_save.connect(_event_saved, sender=Event, dispatch_uid='events_search_vector')
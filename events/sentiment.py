@@ -0,0 +1,170 @@
+# events/sentiment.py
+"""
+Persisted comment sentiment.
+
+Every EventComment stores its TextBlob polarity, and every Event keeps
+positive / negative / neutral comment counters, so
+``Event.sentiment_analysis`` is a read of three columns.
+
+Comments are not scored on the request path: saving a comment queues its id
+once the transaction commits, and a background thread hands the queue to a
+pool of ``SENTIMENT_WORKERS`` scoring processes every
+``SENTIMENT_FLUSH_INTERVAL`` seconds. TextBlob is pure Python and holds the
+GIL, so scoring in a thread would compete with the request threads; the
+flusher only waits on the pool (``SENTIMENT_WORKERS = 0`` scores in-thread,
+for tests and one-off scripts). ``store_polarities`` writes the scores
+and moves the event counters in the same transaction, so live scoring and
+the ``score_comment_sentiment`` backfill can run side by side without
+counting a comment twice.
+"""
+import logging
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import pre_delete
+
+from users.activity import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+# Event counter for each sentiment label.
+COUNTER_FIELDS = {
+    'positive': 'positive_comments',
+    'negative': 'negative_comments',
+    'neutral': 'neutral_comments',
+}
+
+
+def label(polarity):
+    if polarity > 0:
+        return 'positive'
+    if polarity < 0:
+        return 'negative'
+    return 'neutral'
+
+
+def score_texts(texts):
+    """TextBlob polarity of each text. Module-level so process pools can run it."""
+    from textblob import TextBlob
+    return [TextBlob(text).sentiment.polarity for text in texts]
+
+
+def adjust_counters(deltas):
+    """Apply {event_id: {label: delta}} with one F() UPDATE per event."""
+    Event = apps.get_model('events', 'Event')
+    for event_id, by_label in deltas.items():
+        updates = {
+            COUNTER_FIELDS[name]: Greatest(F(COUNTER_FIELDS[name]) + delta, 0)
+            for name, delta in by_label.items() if delta
+        }
+        if updates:
+            Event.objects.filter(pk=event_id).update(**updates)
+
+
+def store_polarities(scored):
+    """
+    Save {comment_id: (text, polarity)} for comments that are still unscored
+    and still have that text, and count them on their events. Returns the number stored.
+    """
+    EventComment = apps.get_model('events', 'EventComment')
+    if not scored:
+        return 0
+    with transaction.atomic():
+        # Locking the rows makes a concurrent writer wait, then see them as already scored.
+        rows = (
+            EventComment.objects.select_for_update()
+            .filter(pk__in=list(scored), polarity__isnull=True)
+            .values_list('pk', 'event_id', 'comment')
+        )
+        comments, deltas = [], defaultdict(lambda: defaultdict(int))
+        for pk, event_id, text in rows:
+            scored_text, polarity = scored[pk]
+            if text != scored_text:
+                continue  # edited since it was scored; the edit queued it again
+            comments.append(EventComment(pk=pk, polarity=polarity))
+            deltas[event_id][label(polarity)] += 1
+        EventComment.objects.bulk_update(comments, ['polarity'], batch_size=1000)
+        adjust_counters(deltas)
+    return len(comments)
+
+
+class SentimentQueue(BackgroundFlusher):
+    def __init__(self, flush_interval=None, batch_size=None, workers=None):
+        super().__init__()
+        self.flush_interval = flush_interval or getattr(settings, 'SENTIMENT_FLUSH_INTERVAL', 5)
+        self.batch_size = batch_size or getattr(settings, 'SENTIMENT_BATCH_SIZE', 500)
+        self.workers = workers if workers is not None else getattr(settings, 'SENTIMENT_WORKERS', 1)
+        self.stats = {'queued': 0, 'scored': 0, 'failed': 0}
+        self._pending = set()
+        self._pool = None
+
+    def _score(self, texts):
+        if not self.workers:
+            return score_texts(texts)
+        if self._pool is None:
+            # Spawned, not forked: forking a process that runs request threads is unsafe.
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool.submit(score_texts, texts).result()
+
+    def enqueue(self, comment_id):
+        self._ensure_worker()
+        with self._lock:
+            self._pending.add(comment_id)
+            self.stats['queued'] += 1
+
+    def flush(self):
+        """Score and store every queued comment. Returns the number stored."""
+        stored = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._pending.pop() for _ in range(min(self.batch_size, len(self._pending)))]
+                if not batch:
+                    return stored
+                EventComment = apps.get_model('events', 'EventComment')
+                rows = list(
+                    EventComment.objects.filter(pk__in=batch, polarity__isnull=True).values_list('pk', 'comment')
+                )
+                if not rows:
+                    continue
+                try:
+                    polarities = self._score([text for _, text in rows])
+                except Exception:
+                    # Left unscored; score_comment_sentiment picks them up.
+                    logger.exception("Failed to score %d comments", len(rows))
+                    self.stats['failed'] += len(rows)
+                    continue
+                count = store_polarities({pk: (text, polarity) for (pk, text), polarity in zip(rows, polarities)})
+                stored += count
+                self.stats['scored'] += count
+
+    def reset_after_fork(self):
+        self._pending = set()
+        self._pool = None  # owned by the parent
+
+    def shutdown(self):
+        super().shutdown()
+        if self._pool is not None:
+            self._pool.shutdown()
+
+
+sentiment_queue = SentimentQueue()
+
+
+def _comment_deleting(sender, instance, using, **kwargs):
+    # The instance may predate its scoring, so read the stored polarity. pre_delete runs inside
+    # the delete's transaction; the lock keeps a concurrent store_polarities from scoring it meanwhile.
+    polarity = sender.objects.using(using).select_for_update().filter(pk=instance.pk).values_list('polarity', flat=True).first()
+    if polarity is not None:
+        adjust_counters({instance.event_id: {label(polarity): -1}})
+
+
+def connect_signals():
+    EventComment = apps.get_model('events', 'EventComment')
+    pre_delete.connect(_comment_deleting, sender=EventComment, dispatch_uid='events_sentiment_delete')
@@ -32,6 +32,29 @@ class EventSerializer(serializers.ModelSerializer):
         event.update_unique_id()
         return event
 
+class EventSearchResultSerializer(serializers.ModelSerializer):
+    """Compact event card for search results."""
+    categories = serializers.StringRelatedField(many=True, read_only=True)
+    vendor = serializers.SlugRelatedField(slug_field='username', read_only=True)
+    country = serializers.StringRelatedField(read_only=True)
+
+    class Meta:
+        model = Event
+        fields = [
+            'id', 'title', 'slug', 'date', 'location', 'country', 'vendor', 'base_price',
+            'categories', 'is_featured', 'event_image', 'average_rating', 'rating_count',
+        ]
+        read_only_fields = fields
+
+class EventSearchParamsSerializer(serializers.Serializer):
+    """Query parameters of the event search endpoint; list parameters repeat (?category=a&category=b)."""
+    q = serializers.CharField(required=False, allow_blank=True, max_length=200)
+    category = serializers.ListField(child=serializers.SlugField(), required=False)
+    country = serializers.ListField(child=serializers.IntegerField(), required=False)
+    price = serializers.ListField(child=serializers.CharField(), required=False)
+    date = serializers.ListField(child=serializers.CharField(), required=False)
+    facets = serializers.BooleanField(required=False, default=True)
+
 class EventRatingSerializer(serializers.ModelSerializer):
     user = serializers.SlugRelatedField(slug_field='username', read_only=True)
     
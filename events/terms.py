@@ -0,0 +1,170 @@
+# events/terms.py
+"""
+Incremental term frequencies for event comments.
+
+EventTerm holds one row per (event, word) with the number of times the word
+occurs in the event's comments. Writing or deleting a comment adjusts only the
+rows of the words it contains, with one UPDATE per distinct delta, and
+``top_terms`` reads the ranking from the (event, -count, term) index.
+
+The top ``EVENT_TERMS_CACHED`` words of each event are also cached, under a
+key holding a per-event version. Once a write commits, the version is bumped
+unless the cached entry provably still holds: none of its words changed and
+no uncached word reached the cut-off. Entries are never rewritten in place,
+so concurrent writers cannot lose each other's deltas, and a reader that
+raced a write only ever fills a version nobody reads any more.
+"""
+import time
+from collections import Counter, defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+
+VERSION_KEY = 'events:terms:version:{event_id}'
+CACHE_KEY = 'events:terms:{event_id}:{version}'
+
+STOP_WORDS = frozenset('''
+    a about above after again against all am an and any are as at be because been before being below between
+    both but by can could did do does doing down during each few for from further had has have having he her
+    here hers herself him himself his how i if in into is it its itself just me more most my myself no nor not
+    now of off on once only or other our ours ourselves out over own same she should so some such than that the
+    their theirs them themselves then there these they this those through to too under until up very was we
+    were what when where which while who whom why will with would you your yours yourself yourselves
+'''.split())
+
+MAX_TERM_LENGTH = 100
+
+
+def _stop_words():
+    return getattr(settings, 'EVENT_TERMS_STOP_WORDS', STOP_WORDS)
+
+
+def tokenize(text):
+    """Word counts of a comment: alphanumeric tokens, lowercased, without stop words."""
+    stop_words = _stop_words()
+    words = (word.lower() for word in text.split() if word.isalnum() and len(word) <= MAX_TERM_LENGTH)
+    return Counter(word for word in words if word not in stop_words)
+
+
+def _cache_size():
+    return getattr(settings, 'EVENT_TERMS_CACHED', 50)
+
+
+def _query_top(event_id, count):
+    EventTerm = apps.get_model('events', 'EventTerm')
+    return list(
+        EventTerm.objects.filter(event_id=event_id, count__gt=0)
+        .order_by('-count', 'term')
+        .values_list('term', 'count')[:count]
+    )
+
+
+def _version(event_id):
+    key = VERSION_KEY.format(event_id=event_id)
+    version = cache.get(key)
+    if version is None:
+        # Restart from the clock, so an evicted counter never repeats an old version.
+        cache.add(key, int(time.time() * 1_000_000), timeout=None)
+        version = cache.get(key, 0)
+    return version
+
+
+def invalidate_terms(event_ids):
+    """Make the cached top terms of ``event_ids`` unreachable."""
+    for event_id in event_ids:
+        key = VERSION_KEY.format(event_id=event_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, int(time.time() * 1_000_000), timeout=None):
+                cache.incr(key)
+
+
+def top_terms(event_id, count=10):
+    """[(term, occurrences)] for the ``count`` most frequent terms, most frequent first."""
+    size = _cache_size()
+    if count > size:
+        return _query_top(event_id, count)
+    key = CACHE_KEY.format(event_id=event_id, version=_version(event_id))
+    entries = cache.get(key)
+    if entries is None:
+        entries = _query_top(event_id, size)
+        cache.set(key, entries, getattr(settings, 'EVENT_TERMS_CACHE_TIMEOUT', 3600))
+    return [tuple(entry) for entry in entries[:count]]
+
+
+def _invalidate_if_ranking_changed(event_id, deltas):
+    """After a committed write of ``deltas`` ({term: change}), drop the cached top terms it affects."""
+    EventTerm = apps.get_model('events', 'EventTerm')
+    entries = cache.get(CACHE_KEY.format(event_id=event_id, version=_version(event_id)))
+    # Nothing cached may still mean a reader is about to cache what it read before the commit.
+    if entries is None or any(term in dict(entries) for term in deltas):
+        invalidate_terms([event_id])
+        return
+    # A short list holds every term; otherwise uncached terms occur at most `floor` times.
+    floor = entries[-1][1] if len(entries) >= _cache_size() else 0
+    risen = [term for term, delta in deltas.items() if delta > 0]
+    if risen and EventTerm.objects.filter(event_id=event_id, term__in=risen, count__gte=max(floor, 1)).exists():
+        invalidate_terms([event_id])
+
+
+def apply_terms(event_id, counts, sign=1):
+    """Add (``sign=1``) or remove (``sign=-1``) a comment's word counts from the event's term table."""
+    EventTerm = apps.get_model('events', 'EventTerm')
+    if not counts:
+        return
+    by_delta = defaultdict(list)
+    for term, occurrences in counts.items():
+        by_delta[occurrences * sign].append(term)
+
+    with transaction.atomic():
+        if sign > 0:
+            EventTerm.objects.bulk_create(
+                [EventTerm(event_id=event_id, term=term, count=0) for term in counts],
+                ignore_conflicts=True,
+            )
+        for delta, terms in by_delta.items():
+            EventTerm.objects.filter(event_id=event_id, term__in=terms).update(count=F('count') + delta)
+        if sign < 0:
+            EventTerm.objects.filter(event_id=event_id, term__in=list(counts), count__lte=0).delete()
+    deltas = {term: occurrences * sign for term, occurrences in counts.items()}
+    transaction.on_commit(lambda: _invalidate_if_ranking_changed(event_id, deltas))
+
+
+def rebuild_terms(event_ids=None):
+    """Recount every comment of ``event_ids`` (all events when None) from scratch."""
+    EventTerm = apps.get_model('events', 'EventTerm')
+    EventComment = apps.get_model('events', 'EventComment')
+    comments = EventComment.objects.order_by('event_id')
+    terms = EventTerm.objects.all()
+    if event_ids is not None:
+        comments = comments.filter(event_id__in=event_ids)
+        terms = terms.filter(event_id__in=event_ids)
+
+    stale = set(terms.values_list('event_id', flat=True).distinct())
+    totals = defaultdict(Counter)
+    for event_id, text in comments.values_list('event_id', 'comment').iterator(chunk_size=2000):
+        totals[event_id].update(tokenize(text))
+    with transaction.atomic():
+        terms.delete()
+        EventTerm.objects.bulk_create(
+            (EventTerm(event_id=event_id, term=term, count=count)
+             for event_id, counts in totals.items() for term, count in counts.items()),
+            batch_size=2000,
+        )
+    transaction.on_commit(lambda: invalidate_terms(stale | totals.keys()))
+    return sum(len(counts) for counts in totals.values())
+
+
+def _comment_deleted(sender, instance, **kwargs):
+    # The text is written synchronously on save, so the instance's copy is the stored one.
+    apply_terms(instance.event_id, tokenize(instance.comment), sign=-1)
+
+
+def connect_signals():
+    EventComment = apps.get_model('events', 'EventComment')
+    post_delete.connect(_comment_deleted, sender=EventComment, dispatch_uid='events_terms_delete')
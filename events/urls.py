@@ -1,6 +1,6 @@
 from django.urls import path
 from . import views
-from .views import EventListView, EventListAPIView, EventDetailAPIView, CustomAuthToken, EventCategoryListView, EventCategoryCreateView, EventCategoryUpdateView, EventCategoryDeleteView, BookingCreateView, BookingDetailView
+from .views import EventListView, EventListAPIView, EventDetailAPIView, EventQuoteAPIView, EventSearchAPIView, CustomAuthToken, EventCategoryListView, EventCategoryCreateView, EventCategoryUpdateView, EventCategoryDeleteView, BookingCreateView, BookingDetailView
 
 app_name = 'events'
 
@@ -43,6 +43,8 @@ urlpatterns = [
 
     # API Routes
     path('api/events/', EventListAPIView.as_view(), name='api_event_list'),
+    path('api/events/search/', EventSearchAPIView.as_view(), name='api_event_search'),
+    path('api/events/quotes/', EventQuoteAPIView.as_view(), name='api_event_quotes'),
     path('api/events/<int:pk>/', EventDetailAPIView.as_view(), name='api_event_detail'),
     path('api-token-auth/', CustomAuthToken.as_view(), name='custom_auth_token'),
 ]
\ No newline at end of file
@@ -0,0 +1,201 @@
+# events/versions.py
+"""
+Events version stamps, conditional GET and a versioned response cache.
+
+Every country has a stamp in the shared cache: a counter bumped whenever one
+of its events is saved, deleted, re-tagged or re-rated, and the time of that
+change. A stamp for all events is bumped along with every country's. Bumps
+run once the transaction commits. Stamps never expire, so the default cache
+must be shared by every worker (see shared/checks.py); otherwise the others
+would answer 304 to the old ETag indefinitely.
+
+Views using ``VersionedPageMixin`` (Django) or ``VersionedAPIMixin`` (DRF)
+derive their ETag from the stamp of the events they show and their
+Last-Modified from its time, answer matching conditional requests with 304
+without building the response, and keep rendered pages / serialized data under
+a key that contains the version. A bump therefore invalidates every cached
+page of a country in O(1); stale entries are never read again and expire
+after ``EVENT_PAGE_CACHE_TIMEOUT`` seconds.
+"""
+import hashlib
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+VERSION_KEY = 'events:version:{scope}'
+MODIFIED_KEY = 'events:modified:{scope}'
+PAGE_KEY = 'events:page:{scope}:{version}:{digest}'
+
+# Scope of the stamp covering every event.
+ALL = 'all'
+
+
+def _scopes(country_ids):
+    return [ALL, *sorted(set(country_ids))]
+
+
+def _fresh_stamp():
+    # A missing counter restarts from the clock, so it never repeats a version some page was cached under.
+    now = time.time()
+    return int(now * 1_000_000), now
+
+
+def bump_versions(country_ids=()):
+    """Invalidate the cached event pages of ``country_ids`` and of all events, in every process."""
+    now = time.time()
+    for scope in _scopes(country_ids):
+        key = VERSION_KEY.format(scope=scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, _fresh_stamp()[0], timeout=None):
+                cache.incr(key)
+    cache.set_many({MODIFIED_KEY.format(scope=scope): now for scope in _scopes(country_ids)}, timeout=None)
+
+
+def current_version(country_id=None):
+    """(version, last modified timestamp) of the events of ``country_id``, or of every event when None."""
+    scope = ALL if country_id is None else country_id
+    version_key, modified_key = VERSION_KEY.format(scope=scope), MODIFIED_KEY.format(scope=scope)
+    values = cache.get_many([version_key, modified_key])
+    if len(values) < 2:
+        version, modified = _fresh_stamp()
+        cache.add(version_key, version, timeout=None)
+        cache.add(modified_key, modified, timeout=None)
+        values = cache.get_many([version_key, modified_key])
+    return values.get(version_key, 0), values.get(modified_key, time.time())
+
+
+def _bump_for(country_ids, event_ids):
+    country_ids = set(country_ids)
+    if event_ids:
+        Event = apps.get_model('events', 'Event')
+        country_ids.update(Event.objects.filter(pk__in=event_ids).values_list('country_id', flat=True).distinct())
+    bump_versions(country_ids)
+
+
+def schedule_version_bump(country_ids=(), event_ids=(), using=None):
+    """
+    Bump the stamps of ``country_ids`` and of the countries of ``event_ids``
+    once the current transaction commits (at once in autocommit mode).
+    """
+    country_ids, event_ids = list(country_ids), list(event_ids)
+    transaction.on_commit(lambda: _bump_for(country_ids, event_ids), using=using)
+
+
+def _event_saving(sender, instance, update_fields=None, using=None, **kwargs):
+    # An event moving to another country leaves that country's pages stale too.
+    instance._previous_country_id = None
+    if instance.pk and not instance._state.adding and (update_fields is None or 'country' in update_fields):
+        instance._previous_country_id = (
+            sender.objects.using(using).filter(pk=instance.pk).values_list('country_id', flat=True).first()
+        )
+
+
+def _event_saved(sender, instance, using=None, **kwargs):
+    previous = getattr(instance, '_previous_country_id', None)
+    schedule_version_bump([instance.country_id] + ([previous] if previous is not None else []), using=using)
+
+
+def _event_deleted(sender, instance, using=None, **kwargs):
+    schedule_version_bump([instance.country_id], using=using)
+
+
+def _event_tagged(sender, instance, action, using=None, **kwargs):
+    Event = apps.get_model('events', 'Event')
+    if isinstance(instance, Event) and action in ('post_add', 'post_remove', 'post_clear'):
+        schedule_version_bump([instance.country_id], using=using)
+
+
+def connect_signals():
+    Event = apps.get_model('events', 'Event')
+    pre_save.connect(_event_saving, sender=Event, dispatch_uid='events_versions_pre_save')
+    post_save.connect(_event_saved, sender=Event, dispatch_uid='events_versions_save')
+    post_delete.connect(_event_deleted, sender=Event, dispatch_uid='events_versions_delete')
+    m2m_changed.connect(_event_tagged, sender=Event.categories.through, dispatch_uid='events_versions_tags')
+
+
+class _VersionedMixin:
+    """GET handling shared by the Django and DRF mixins below."""
+    version_cache_timeout = None
+
+    def get_version_country(self):
+        """The country whose stamp covers this response: ``?country=`` by default, None for all events."""
+        value = self.request.GET.get('country', '')
+        return int(value) if value.isdigit() else None
+
+    def get_cache_variant(self):
+        """Anything besides the URL the response depends on."""
+        return ''
+
+    def get(self, request, *args, **kwargs):
+        country_id = self.get_version_country()
+        scope = ALL if country_id is None else country_id
+        version, modified = current_version(country_id)
+        digest = hashlib.md5(
+            f'{scope}:{version}:{request.get_full_path()}:{self.get_cache_variant()}'.encode()
+        ).hexdigest()
+        etag = quote_etag(digest)
+
+        response = get_conditional_response(request, etag=etag, last_modified=int(modified))
+        if response is None:
+            key = PAGE_KEY.format(scope=scope, version=version, digest=digest)
+            response = self.cached_response(cache.get(key))
+            if response is None:
+                response = super().get(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                timeout = self.version_cache_timeout or getattr(settings, 'EVENT_PAGE_CACHE_TIMEOUT', 600)
+                cache.set(key, self.cache_entry(response), timeout)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        self.patch_response_headers(response)
+        return response
+
+
+class VersionedPageMixin(_VersionedMixin):
+    """Conditional GET and versioned page caching for Django views; pages are cached per user."""
+
+    def get_cache_variant(self):
+        return str(self.request.user.pk) if self.request.user.is_authenticated else 'anonymous'
+
+    def cache_entry(self, response):
+        if hasattr(response, 'render'):
+            response.render()
+        return response.content, response['Content-Type']
+
+    def cached_response(self, entry):
+        if entry is None:
+            return None
+        content, content_type = entry
+        return HttpResponse(content, content_type=content_type)
+
+    def patch_response_headers(self, response):
+        patch_vary_headers(response, ['Cookie'])
+        patch_cache_control(response, private=True, no_cache=True)
+
+
+class VersionedAPIMixin(_VersionedMixin):
+    """Conditional GET and versioned caching of serialized data for DRF views; the data is shared by all users."""
+
+    def get_cache_variant(self):
+        # The same data renders differently per media type, so each gets its own ETag.
+        return self.request.accepted_media_type
+
+    def cache_entry(self, response):
+        return response.data
+
+    def cached_response(self, entry):
+        return None if entry is None else Response(entry)
+
+    def patch_response_headers(self, response):
+        patch_vary_headers(response, ['Accept'])
+        patch_cache_control(response, no_cache=True)
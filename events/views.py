@@ -1,9 +1,15 @@
-from rest_framework import generics, permissions
+from django.conf import settings
+from core.pagination import KeysetPaginationMixin
+from rest_framework import generics, permissions, status
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 from .models import Event, EventCategory, EventRating, EventComment, Booking, Ticket  # Added Ticket model
-from .serializers import EventSerializer
+from rest_framework.pagination import PageNumberPagination
+from .serializers import EventSerializer, EventSearchParamsSerializer, EventSearchResultSerializer
+from .search import EventSearch
+from .pricing import PriceTable, format_cents
+from .versions import VersionedAPIMixin, VersionedPageMixin
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
 from .forms import EventForm, EventCategoryForm, EventRatingForm, EventCommentForm, BookingForm
 from django.urls import reverse_lazy
@@ -51,11 +57,16 @@ class EventCategoryDeleteView(DeleteView):
     success_url = reverse_lazy('events:event_category_list')
 
 # Class-based view for listing events via traditional Django views
-class EventListView(ListView):
-    model = Event
+class EventListView(VersionedPageMixin, KeysetPaginationMixin, ListView):
+    queryset = Event.objects.order_by('date', 'pk')
     template_name = 'events/event_list.html'
     context_object_name = 'events'
-    paginate_by = 10  # Example pagination
+    paginate_by = 10  # ?cursor= pages; page_obj.next_cursor / previous_cursor for links
+
+    def get_queryset(self):
+        country_id = self.get_version_country()
+        queryset = super().get_queryset()
+        return queryset if country_id is None else queryset.filter(country_id=country_id)
 
 # Class-based view for showing event details
 class EventDetailView(DetailView):
@@ -222,17 +233,99 @@ def scan_barcode(request):
     return render(request, 'events/scan_barcode.html')
 
 # API view for listing and creating events
-class EventListAPIView(generics.ListCreateAPIView):
-    queryset = Event.objects.all()
+class EventListAPIView(VersionedAPIMixin, generics.ListCreateAPIView):
+    queryset = Event.objects.order_by('date', 'pk')
     serializer_class = EventSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        country_id = self.get_version_country()
+        queryset = super().get_queryset()
+        return queryset if country_id is None else queryset.filter(country_id=country_id)
+
 # API view for retrieving, updating, or deleting an event
-class EventDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
+class EventDetailAPIView(VersionedAPIMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def get_version_country(self):
+        # One primary-key lookup, so even a 304 costs a query here.
+        return Event.objects.filter(pk=self.kwargs['pk']).values_list('country_id', flat=True).first()
+
+# API view quoting many events for many party sizes in one request
+class EventQuoteAPIView(generics.GenericAPIView):
+    """?events=1,2,3&sizes=1,2,10 -> the total price of every event for every party size."""
+    queryset = Event.objects.all()
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+
+    def _int_list(self, name):
+        values = [value for value in self.request.query_params.get(name, '').split(',') if value.strip()]
+        return [int(value) for value in values]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            event_ids = self._int_list('events')
+            sizes = self._int_list('sizes') or [1]
+        except ValueError:
+            return Response({'detail': 'events and sizes must be comma-separated integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        max_events = getattr(settings, 'EVENT_QUOTE_MAX_EVENTS', 500)
+        max_sizes = getattr(settings, 'EVENT_QUOTE_MAX_SIZES', 50)
+        max_party_size = getattr(settings, 'EVENT_QUOTE_MAX_PARTY_SIZE', 10000)
+        if not event_ids or len(event_ids) > max_events:
+            return Response({'detail': f'Pass between 1 and {max_events} event ids.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(sizes) > max_sizes or not all(1 <= size <= max_party_size for size in sizes):
+            return Response(
+                {'detail': f'Pass at most {max_sizes} party sizes between 1 and {max_party_size}.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        table = PriceTable.from_queryset(self.get_queryset().filter(pk__in=event_ids))
+        prices = table.quote(sizes).tolist()
+        return Response({
+            'sizes': sizes,
+            'quotes': [
+                {'event': event_id, 'prices': [format_cents(cents) for cents in row]}
+                for event_id, row in zip(table.ids, prices)
+            ],
+        })
+
+class EventSearchPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+# API view for full-text event search with facet counts
+class EventSearchAPIView(generics.ListAPIView):
+    """
+    ?q=jazz&category=music&country=1&price=25-50&date=next_7_days -> matching
+    active, approved events (best matches first) plus facet counts.
+    """
+    serializer_class = EventSearchResultSerializer
+    pagination_class = EventSearchPagination
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+
+    def list(self, request, *args, **kwargs):
+        params = EventSearchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        try:
+            search = EventSearch(
+                query=data.get('q', ''),
+                categories=data.get('category', ()),
+                countries=data.get('country', ()),
+                prices=data.get('price', ()),
+                dates=data.get('date', ()),
+            )
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        page = self.paginate_queryset(search.results())
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        if data['facets']:
+            response.data['facets'] = search.facets()
+        return response
+
 # Custom view for obtaining and returning authentication token
 class CustomAuthToken(ObtainAuthToken):
     def post(self, request, *args, **kwargs):
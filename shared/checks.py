@@ -0,0 +1,28 @@
+# shared/checks.py
+"""
+System checks for settings the apps rely on.
+
+Permission, reference-data, audience and event-page version stamps are bumped
+in the default cache by whichever worker handled the change and read by all
+the others. A cache private to one process would leave every other worker
+serving revoked permissions and stale pages until it restarts.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f'The default cache ({backend}) is not shared between processes.',
+            hint='Use Redis, Memcached or the database cache (django.core.cache.backends.db.DatabaseCache).',
+            id='shared.E001',
+        )]
+    return []
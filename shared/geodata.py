@@ -1,11 +1,21 @@
 # shared/geodata.py
 import csv
+import ipaddress
+import json
+import mmap
 import os
+import struct
+import threading
+from array import array
+from bisect import bisect_right
 from django.conf import settings
 
 def get_city_data(geoname_id):
     """
-    Retrieve city data by geoname_id from the CSV file.
+    Retrieve city data by geoname_id.
+
+    Reads the compiled city database (see the ``compile_citydb`` command)
+    through mmap when it exists, and falls back to scanning the CSV file.
 
     Args:
     geoname_id (str): The geoname_id for which to fetch city data.
@@ -13,12 +23,274 @@ def get_city_data(geoname_id):
     Returns:
     dict: A dictionary containing city data or an empty dict if not found.
     """
-    csv_path = os.path.join(settings.BASE_DIR, 'shared', 'Geocity', 'city.csv')
-    with open(csv_path, 'r', encoding='utf-8') as csvfile:
+    database = get_city_database()
+    if database is not None:
+        return database.get(geoname_id)
+
+    with open(get_city_csv_path(), 'r', encoding='utf-8') as csvfile:
         reader = csv.DictReader(csvfile)
         for row in reader:
             if row['geoname_id'] == geoname_id:
                 return row
     return {}
 
-# If you need to perform multiple lookups, consider caching results or using database for speed.
\ No newline at end of file
+
+def get_city_csv_path():
+    return os.path.join(settings.BASE_DIR, 'shared', 'Geocity', 'city.csv')
+
+
+def get_city_db_path():
+    return os.path.join(settings.BASE_DIR, 'shared', 'Geocity', 'city.db')
+
+
+# Compiled city database layout:
+#   magic (8 bytes) | header length (uint32) | JSON header | padding to 8 bytes
+#   hash index: ``slots`` entries of (geoname_id uint64, record number uint64),
+#               open addressing with linear probing, geoname_id 0 = empty slot
+#   records:    ``count`` fixed-size records, one null-padded column per field
+CITYDB_MAGIC = b'CITYDB01'
+_CITYDB_PREFIX = struct.Struct('<8sI')
+_CITYDB_SLOT = struct.Struct('<QQ')
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+def _hash_slot(key, bits):
+    return ((key * _HASH_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> (64 - bits)
+
+
+def compile_city_database(csv_path, db_path):
+    """
+    Compile city.csv into the fixed-record binary format read by CityDatabase.
+
+    The file is written next to ``db_path`` and moved into place atomically,
+    so running workers never see a half-written database.
+
+    Rows without a geoname_id are skipped; a geoname_id that is not a positive
+    integer raises ValueError.
+
+    Returns:
+    int: The number of records written.
+    """
+    with open(csv_path, 'r', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+        fields = list(reader.fieldnames)
+        rows = []
+        for row in reader:
+            geoname_id = row.get('geoname_id')
+            if not geoname_id:
+                continue
+            # 0 marks an empty slot in the index, so only positive integer ids can be stored.
+            if not geoname_id.isdigit() or int(geoname_id) == 0:
+                raise ValueError(f"{csv_path}, line {reader.line_num}: geoname_id {geoname_id!r} is not a positive integer")
+            rows.append([(row[field] or '').encode('utf-8') for field in fields])
+
+    key_column = fields.index('geoname_id')
+    widths = [max([len(row[column]) for row in rows] or [0]) or 1 for column in range(len(fields))]
+    record_size = sum(widths)
+
+    bits = max(1, (len(rows) * 2 - 1).bit_length())
+    slots = 1 << bits
+    index = bytearray(slots * _CITYDB_SLOT.size)
+    for record_number, row in enumerate(rows):
+        key = int(row[key_column])
+        slot = _hash_slot(key, bits)
+        while True:
+            existing, _ = _CITYDB_SLOT.unpack_from(index, slot * _CITYDB_SLOT.size)
+            if existing == 0 or existing == key:
+                break
+            slot = (slot + 1) & (slots - 1)
+        # On duplicate ids the first row wins, same as the CSV scan in get_city_data.
+        if existing == 0:
+            _CITYDB_SLOT.pack_into(index, slot * _CITYDB_SLOT.size, key, record_number)
+
+    header = {
+        'fields': fields,
+        'widths': widths,
+        'record_size': record_size,
+        'count': len(rows),
+        'slots': slots,
+        'bits': bits,
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    padding = -(_CITYDB_PREFIX.size + len(header_bytes)) % 8
+
+    tmp_path = f"{db_path}.tmp"
+    with open(tmp_path, 'wb') as dbfile:
+        dbfile.write(_CITYDB_PREFIX.pack(CITYDB_MAGIC, len(header_bytes)))
+        dbfile.write(header_bytes)
+        dbfile.write(b'\0' * padding)
+        dbfile.write(index)
+        for row in rows:
+            dbfile.write(b''.join(value.ljust(width, b'\0') for value, width in zip(row, widths)))
+    os.replace(tmp_path, db_path)
+    return len(rows)
+
+
+class CityDatabase:
+    """
+    Read-only view of a compiled city database.
+
+    The file is memory-mapped, so lookups are a hash probe plus one record
+    decode, and every worker process shares the same pages of the OS page cache.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as dbfile:
+            self._mmap = mmap.mmap(dbfile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = _CITYDB_PREFIX.unpack_from(self._mmap, 0)
+        if magic != CITYDB_MAGIC:
+            raise ValueError(f"{path} is not a compiled city database")
+        header_start = _CITYDB_PREFIX.size
+        header = json.loads(self._mmap[header_start:header_start + header_length])
+        self.fields = header['fields']
+        self.count = header['count']
+        self._widths = header['widths']
+        self._record_size = header['record_size']
+        self._slots = header['slots']
+        self._bits = header['bits']
+        self._index_offset = header_start + header_length
+        self._index_offset += -self._index_offset % 8
+        self._records_offset = self._index_offset + self._slots * _CITYDB_SLOT.size
+
+    def __len__(self):
+        return self.count
+
+    def _find(self, key):
+        slot = _hash_slot(key, self._bits)
+        for _ in range(self._slots):
+            existing, record_number = _CITYDB_SLOT.unpack_from(self._mmap, self._index_offset + slot * _CITYDB_SLOT.size)
+            if existing == key:
+                return record_number
+            if existing == 0:
+                return None
+            slot = (slot + 1) & (self._slots - 1)
+        return None
+
+    def get(self, geoname_id):
+        """Return the city row for ``geoname_id`` as a dict of strings, or {}."""
+        try:
+            key = int(geoname_id)
+        except (TypeError, ValueError):
+            return {}
+        if key <= 0:
+            return {}
+        record_number = self._find(key)
+        if record_number is None:
+            return {}
+        offset = self._records_offset + record_number * self._record_size
+        row = {}
+        for field, width in zip(self.fields, self._widths):
+            row[field] = self._mmap[offset:offset + width].rstrip(b'\0').decode('utf-8')
+            offset += width
+        return row
+
+    def close(self):
+        self._mmap.close()
+
+
+_city_database = None
+_city_database_lock = threading.Lock()
+
+
+def get_city_database():
+    """
+    Open the compiled city database once per process.
+
+    Returns None when it has not been compiled yet. Workers keep the mapping
+    they opened, so restart them after recompiling.
+    """
+    global _city_database
+    if _city_database is None:
+        path = get_city_db_path()
+        if not os.path.exists(path):
+            return None
+        with _city_database_lock:
+            if _city_database is None:
+                _city_database = CityDatabase(path)
+    return _city_database
+
+
+def get_blocks_csv_path():
+    return os.path.join(settings.BASE_DIR, 'shared', 'Geocity', 'blocks.csv')
+
+
+class IPRangeIndex:
+    """
+    Sorted, non-overlapping IP ranges parsed once from the GeoLite blocks CSV.
+
+    Each address family keeps three parallel arrays (range start, range end and
+    geoname_id) ordered by start, so a lookup is a single binary search instead
+    of a scan over every network in the file. Networks without a geoname_id are
+    left out, so their addresses resolve to None where the scan returned ''.
+    """
+
+    def __init__(self):
+        # IPv4 fits in unsigned 32-bit arrays; IPv6 needs Python ints (128-bit).
+        self._v4 = (array('L'), array('L'), array('q'))
+        self._v6 = ([], [], array('q'))
+
+    def __len__(self):
+        return len(self._v4[0]) + len(self._v6[0])
+
+    @classmethod
+    def from_csv(cls, path):
+        index = cls()
+        v4_rows = []
+        v6_rows = []
+        with open(path, 'r', encoding='utf-8') as csvfile:
+            reader = csv.DictReader(csvfile)
+            for row in reader:
+                geoname_id = row.get('geoname_id')
+                if not geoname_id:
+                    continue
+                network = ipaddress.ip_network(row['network'], strict=False)
+                entry = (int(network.network_address), int(network.broadcast_address), int(geoname_id))
+                if network.version == 4:
+                    v4_rows.append(entry)
+                else:
+                    v6_rows.append(entry)
+
+        for rows, (starts, ends, geoname_ids) in ((v4_rows, index._v4), (v6_rows, index._v6)):
+            rows.sort()
+            for start, end, geoname_id in rows:
+                starts.append(start)
+                ends.append(end)
+                geoname_ids.append(geoname_id)
+        return index
+
+    def lookup(self, ip):
+        """Return the geoname_id (as a string, like the CSV) for ``ip`` or None."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        starts, ends, geoname_ids = self._v4 if address.version == 4 else self._v6
+        value = int(address)
+        position = bisect_right(starts, value) - 1
+        if position >= 0 and value <= ends[position]:
+            return str(geoname_ids[position])
+        return None
+
+
+_ip_index = None
+_ip_index_lock = threading.Lock()
+
+
+def get_ip_index():
+    """Load the blocks CSV into an IPRangeIndex once per process."""
+    global _ip_index
+    if _ip_index is None:
+        with _ip_index_lock:
+            if _ip_index is None:
+                _ip_index = IPRangeIndex.from_csv(get_blocks_csv_path())
+    return _ip_index
+
+
+def get_geoname_id_for_ip(ip):
+    """
+    Resolve an IP address to a GeoLite geoname_id.
+
+    Returns:
+    str: The geoname_id or None if the address is not covered by any block.
+    """
+    return get_ip_index().lookup(ip)
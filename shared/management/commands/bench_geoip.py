@@ -0,0 +1,64 @@
+import csv
+import ipaddress
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shared.geodata import IPRangeIndex, get_blocks_csv_path
+
+
+def scan_blocks_csv(path, ip):
+    """The original lookup: walk blocks.csv until a network contains ``ip``."""
+    address = ipaddress.ip_address(ip)
+    with open(path, 'r', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            if address in ipaddress.ip_network(row['network']):
+                return row['geoname_id']
+    return None
+
+
+class Command(BaseCommand):
+    help = "Benchmark IP-to-geoname lookups: in-memory range index vs. CSV scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help="Blocks CSV (defaults to shared/Geocity/blocks.csv)")
+        parser.add_argument('--lookups', type=int, default=10000, help="Lookups to run against the index")
+        parser.add_argument('--scan-lookups', type=int, default=20, help="Lookups to run against the CSV scan")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        for name in ('lookups', 'scan_lookups'):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be a positive number")
+        path = options['path'] or get_blocks_csv_path()
+        rng = random.Random(options['seed'])
+
+        started = time.perf_counter()
+        index = IPRangeIndex.from_csv(path)
+        load_seconds = time.perf_counter() - started
+        self.stdout.write(f"Loaded {len(index)} ranges in {load_seconds:.2f}s")
+
+        ips = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(options['lookups'])]
+
+        started = time.perf_counter()
+        for ip in ips:
+            index.lookup(ip)
+        index_us = (time.perf_counter() - started) / len(ips) * 1e6
+
+        scan_ips = ips[:options['scan_lookups']]
+        mismatches = 0
+        started = time.perf_counter()
+        for ip in scan_ips:
+            if (scan_blocks_csv(path, ip) or None) != index.lookup(ip):
+                mismatches += 1
+        scan_us = (time.perf_counter() - started) / len(scan_ips) * 1e6
+
+        self.stdout.write(f"Range index: {index_us:.2f} us/lookup over {len(ips)} lookups")
+        self.stdout.write(f"CSV scan:    {scan_us:.2f} us/lookup over {len(scan_ips)} lookups")
+        self.stdout.write(f"Speedup:     {scan_us / index_us:.0f}x")
+        if mismatches:
+            self.stdout.write(self.style.WARNING(f"{mismatches} lookups disagreed between the two methods"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Both methods returned the same geoname_ids"))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shared.geodata import compile_city_database, get_city_csv_path, get_city_db_path
+
+
+class Command(BaseCommand):
+    help = "Compile shared/Geocity/city.csv into the memory-mapped city database used by get_city_data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--csv', default=None, help="Source CSV (defaults to shared/Geocity/city.csv)")
+        parser.add_argument('--output', default=None, help="Target file (defaults to shared/Geocity/city.db)")
+
+    def handle(self, *args, **options):
+        csv_path = options['csv'] or get_city_csv_path()
+        db_path = options['output'] or get_city_db_path()
+
+        started = time.perf_counter()
+        try:
+            count = compile_city_database(csv_path, db_path)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Compiled {count} cities into {db_path} in {elapsed:.2f}s"))
+        self.stdout.write("Restart application workers to pick up the new file.")
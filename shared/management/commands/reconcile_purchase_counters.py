@@ -0,0 +1,72 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, Sum
+
+from shared.models import Order
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute purchase_count, total_spent and last_purchase_date from completed orders "
+        "and report (or fix with --fix) users whose counters drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Write the recomputed values for drifted users")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--show', type=int, default=20, help="Number of drifted users to print")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        # One GROUP BY over orders, merged with the users table in user id order.
+        totals = (
+            Order.objects.filter(status='COMPLETED')
+            .values('user_id')
+            .annotate(count=Count('id'), total=Sum('total_amount'), last=Max('created_at'))
+            .order_by('user_id')
+            .values_list('user_id', 'count', 'total', 'last')
+            .iterator(chunk_size=chunk_size)
+        )
+        users = (
+            CustomUser.objects.order_by('pk')
+            .values_list('pk', 'purchase_count', 'total_spent', 'last_purchase_date')
+            .iterator(chunk_size=chunk_size)
+        )
+
+        checked = drifted = 0
+        pending = []
+        expected = next(totals, None)
+        for pk, purchase_count, total_spent, last_purchase_date in users:
+            checked += 1
+            while expected is not None and expected[0] < pk:
+                expected = next(totals, None)
+            if expected is not None and expected[0] == pk:
+                _, count, total, last = expected
+            else:
+                count, total, last = 0, Decimal('0.00'), None
+
+            if (purchase_count, total_spent or Decimal('0'), last_purchase_date) == (count, total or Decimal('0'), last):
+                continue
+            drifted += 1
+            if drifted <= options['show']:
+                self.stdout.write(
+                    f"user {pk}: count {purchase_count} -> {count}, total {total_spent} -> {total}, "
+                    f"last {last_purchase_date} -> {last}"
+                )
+            if options['fix']:
+                pending.append(CustomUser(pk=pk, purchase_count=count, total_spent=total or 0, last_purchase_date=last))
+                if len(pending) >= chunk_size:
+                    self.write(pending)
+                    pending = []
+        if pending:
+            self.write(pending)
+
+        summary = f"Checked {checked} users, {drifted} drifted"
+        if options['fix']:
+            summary += ", all fixed"
+        self.stdout.write(self.style.SUCCESS(summary) if not drifted or options['fix'] else self.style.WARNING(summary))
+
+    def write(self, users):
+        CustomUser.objects.bulk_update(users, ['purchase_count', 'total_spent', 'last_purchase_date'], batch_size=1000)
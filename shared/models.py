@@ -1,9 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.text import slugify
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from users.models import Vendor, CustomUser as User
+from users.purchases import record_purchases, split_amount
 from django.contrib.auth.models import Permission
 import random
 
@@ -253,9 +256,59 @@ class Order(models.Model):
     ], default='PENDING')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Status as last read from / written to the database, used to detect the move to COMPLETED.
+    _loaded_status = None
+
     def __str__(self):
         return f"Order {self.id} by {self.user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        completing = self.status == 'COMPLETED' and self._loaded_status != 'COMPLETED'
+        with transaction.atomic(using=kwargs.get('using')):
+            if completing and self.pk and not self._state.adding:
+                # Claim the transition so concurrent saves of the same order count it only once.
+                completing = Order.objects.filter(pk=self.pk).exclude(status='COMPLETED').update(status='COMPLETED') == 1
+            super().save(*args, **kwargs)
+            if completing:
+                self.update_user_purchase_counters()
+                self.record_purchase_history()
+        self._loaded_status = self.status
+
+    def update_user_purchase_counters(self):
+        """Add this order to the user's RFM counters in a single UPDATE, without reading the row."""
+        purchased_at = Value(self.created_at or timezone.now(), output_field=models.DateTimeField())
+        User.objects.filter(pk=self.user_id).update(
+            purchase_count=F('purchase_count') + 1,
+            total_spent=F('total_spent') + self.total_amount,
+            last_purchase_date=Greatest(Coalesce(F('last_purchase_date'), purchased_at), purchased_at),
+        )
+
+    def record_purchase_history(self):
+        """
+        Append this order to the user's purchase history, one record per item category.
+
+        The records carry the order's total_amount (tax and commission included, like
+        total_spent), split across the categories in proportion to their item subtotals.
+        """
+        line_total = models.ExpressionWrapper(F('price') * F('quantity'), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+        by_category = list(self.items.values_list('menu_item__category').annotate(subtotal=models.Sum(line_total)).order_by())
+        subtotals = [subtotal or 0 for _, subtotal in by_category]
+        if subtotals and min(subtotals) >= 0 and sum(subtotals) > 0:
+            amounts = split_amount(self.total_amount, subtotals)
+            purchases = [
+                {'amount': amount, 'category': category, 'purchased_at': self.created_at}
+                for (category, _), amount in zip(by_category, amounts)
+            ]
+        else:
+            purchases = [{'amount': self.total_amount, 'purchased_at': self.created_at}]
+        record_purchases(self.user_id, purchases, order=self)
+
     def calculate_total_amount(self, tax_rate=0.1, commission_rate=0.05):
         """Calculate the total amount including tax and commission."""
         subtotal = self.cart.total_price()
@@ -1,30 +1,114 @@
 # shared/services.py
 
+from collections import defaultdict
+
 from django.contrib.auth.models import Permission
+from django.db import transaction
 from .models import Notification
 from users.models import Role, RolePermission, AppModule
+from users.permissions import schedule_version_bump
+
+TEMPLATE_MODES = ('replace', 'add', 'remove')
+
+
+def resolve_permission_ids(permissions):
+    """Map permission ids and/or 'app_label.codename' strings to ids with one query."""
+    ids = {int(perm) for perm in permissions if isinstance(perm, int) or str(perm).isdigit()}
+    names = {str(perm) for perm in permissions if not (isinstance(perm, int) or str(perm).isdigit())}
+    if names:
+        wanted = [name.split('.', 1) for name in names if '.' in name]
+        found = {
+            f'{app_label}.{codename}': pk
+            for pk, app_label, codename in Permission.objects.filter(
+                codename__in=[codename for _, codename in wanted],
+                content_type__app_label__in=[app_label for app_label, _ in wanted],
+            ).values_list('pk', 'content_type__app_label', 'codename')
+        }
+        missing = names - found.keys()
+        if missing:
+            raise Permission.DoesNotExist(f"Unknown permissions: {', '.join(sorted(missing))}")
+        ids.update(found[name] for name in names)
+    return ids
+
+
+def sync_role_permissions(desired, app_module=None, mode='replace'):
+    """
+    Bring the RolePermission rows of many roles in line with ``desired`` ({role_id: permission ids}).
+
+    Only rows granted through ``app_module`` (direct grants when None) are
+    considered. ``mode`` is 'replace' (add missing, drop extra), 'add' or
+    'remove'. The current rows are read in one query, and only the differences
+    are written: one bulk_create and one DELETE, in a single transaction.
+    Returns {'created': n, 'deleted': n}.
+    """
+    if mode not in TEMPLATE_MODES:
+        raise ValueError(f"mode must be one of {', '.join(TEMPLATE_MODES)}")
+    desired = {role_id: set(permission_ids) for role_id, permission_ids in desired.items()}
+    wanted_ids = set().union(*desired.values()) if desired else set()
+    known = set(Permission.objects.filter(pk__in=wanted_ids).values_list('pk', flat=True))
+    if wanted_ids - known:
+        raise Permission.DoesNotExist(f"Unknown permission ids: {sorted(wanted_ids - known)}")
+
+    with transaction.atomic():
+        current = defaultdict(lambda: defaultdict(list))
+        rows = RolePermission.objects.filter(role_id__in=list(desired), app_module=app_module)
+        for pk, role_id, permission_id in rows.values_list('pk', 'role_id', 'permission_id'):
+            current[role_id][permission_id].append(pk)
+
+        to_create, to_delete = [], []
+        for role_id, wanted in desired.items():
+            have = current.get(role_id, {})
+            for permission_id, pks in have.items():
+                to_delete.extend(pks[1:])  # duplicate grants
+                if (mode == 'replace' and permission_id not in wanted) or (mode == 'remove' and permission_id in wanted):
+                    to_delete.append(pks[0])
+            if mode != 'remove':
+                to_create.extend(
+                    RolePermission(role_id=role_id, permission_id=permission_id, app_module=app_module)
+                    for permission_id in wanted - have.keys()
+                )
+
+        if to_delete:
+            RolePermission.objects.filter(pk__in=to_delete).delete()
+        RolePermission.objects.bulk_create(to_create, batch_size=1000)
+        if to_create or to_delete:
+            # bulk_create sends no signals, so invalidate compiled permissions explicitly.
+            schedule_version_bump()
+    return {'created': len(to_create), 'deleted': len(to_delete)}
+
 
 def update_role_permissions(role, permission_ids):
-    """Update the permissions for a role."""
-    role.permissions.clear()
-    for perm_id in permission_ids:
-        permission = Permission.objects.get(id=perm_id)
-        RolePermission.objects.create(role=role, permission=permission)
+    """Set the permissions granted directly (not through an app module) to a role."""
+    return sync_role_permissions({role.pk: permission_ids})
+
 
 def assign_full_app_access(role, app_module):
     """Assign all permissions of an app module to a role."""
-    permissions = app_module.get_permissions()
-    RolePermission.objects.filter(role=role, app_module=app_module).delete()
-    for perm in permissions:
-        RolePermission.objects.get_or_create(role=role, permission=perm, app_module=app_module)
+    permission_ids = app_module.get_permissions().values_list('pk', flat=True)
+    return sync_role_permissions({role.pk: permission_ids}, app_module=app_module)
+
 
 def assign_partial_app_access(role, app_module, formset):
     """Assign selected permissions of an app module to a role."""
-    RolePermission.objects.filter(role=role, app_module=app_module).delete()
-    for form in formset:
-        if form.cleaned_data.get('assigned'):
-            perm = form.cleaned_data['permission']
-            RolePermission.objects.get_or_create(role=role, permission=perm, app_module=app_module)
+    permission_ids = [
+        form.cleaned_data['permission'].pk for form in formset if form.cleaned_data.get('assigned')
+    ]
+    return sync_role_permissions({role.pk: permission_ids}, app_module=app_module)
+
+
+def apply_permission_template(roles, permissions, mode='replace', app_module=None):
+    """
+    Apply one permission template to many roles (across vendors) in one transaction.
+
+    ``roles`` are Role instances or ids; ``permissions`` are permission ids or
+    'app_label.codename' strings.
+    """
+    permission_ids = resolve_permission_ids(permissions)
+    role_ids = {role.pk if isinstance(role, Role) else int(role) for role in roles}
+    result = sync_role_permissions({role_id: permission_ids for role_id in role_ids}, app_module=app_module, mode=mode)
+    result['roles'] = len(role_ids)
+    return result
+
 
 def create_notification(user, message, notification_type='info'):
     """Create a notification for the user."""
@@ -38,4 +122,4 @@ def save_app_module(app_module, permissions_data=None):
         for perm_data in permissions_data:
             if perm_data.get('assigned'):
                 permission = perm_data['permission']
-                app_module.permissions.add(permission)
\ No newline at end of file
+                app_module.permissions.add(permission)
@@ -1,3 +1,380 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import tempfile
+import threading
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Permission
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.models import CustomUser, PurchaseRecord, Role, RolePermission, Vendor
+
+from . import geodata
+from .checks import check_shared_cache
+from .management.commands.bench_geoip import scan_blocks_csv
+from .models import Cart, Menu, MenuItem, Order, OrderItem
+from .services import apply_permission_template, resolve_permission_ids, sync_role_permissions
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    """Version stamps need a default cache every worker can see."""
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_refused(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['shared.E001'])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache'}})
+    def test_shared_cache_passes(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+
+class PermissionTemplateTests(TestCase):
+    """Permission templates write only the differences and invalidate compiled permissions once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = Vendor.objects.create(username='vendor', email='vendor@example.com', company_name='V', user_type='vendor')
+        cls.roles = [Role.objects.create(name=name, vendor=cls.vendor) for name in ('Editor', 'Viewer')]
+        cls.add, cls.change, cls.delete = (
+            Permission.objects.get(content_type__app_label='admin', codename=f'{action}_logentry')
+            for action in ('add', 'change', 'delete')
+        )
+        for role in cls.roles:
+            RolePermission.objects.create(role=role, permission=cls.add)
+            RolePermission.objects.create(role=role, permission=cls.change)
+        cls.admin = CustomUser.objects.create(username='admin', email='admin@example.com', is_staff=True)
+
+    def granted(self):
+        return {
+            role.name: set(RolePermission.objects.filter(role=role).values_list('permission__codename', flat=True))
+            for role in self.roles
+        }
+
+    def apply(self, permissions, mode='replace'):
+        with mock.patch('users.permissions.bump_version') as bump, \
+                CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            result = apply_permission_template(self.roles, permissions, mode=mode)
+        writes = [query['sql'] for query in queries if query['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')]
+        return result, writes, bump.call_count
+
+    def test_replace_adds_missing_and_drops_extra(self):
+        result, writes, bumps = self.apply(['admin.change_logentry', self.delete.pk])
+        self.assertEqual(result, {'created': 2, 'deleted': 2, 'roles': 2})
+        self.assertEqual(self.granted(), {name: {'change_logentry', 'delete_logentry'} for name in ('Editor', 'Viewer')})
+        self.assertEqual(len(writes), 2)  # one DELETE, one INSERT
+        self.assertEqual(bumps, 1)
+
+    def test_add_and_remove(self):
+        self.assertEqual(self.apply(['admin.delete_logentry'], mode='add')[0], {'created': 2, 'deleted': 0, 'roles': 2})
+        self.assertEqual(self.apply(['admin.add_logentry'], mode='remove')[0], {'created': 0, 'deleted': 2, 'roles': 2})
+        self.assertEqual(self.granted(), {name: {'change_logentry', 'delete_logentry'} for name in ('Editor', 'Viewer')})
+
+    def test_unchanged_set_makes_no_writes(self):
+        result, writes, bumps = self.apply(['admin.add_logentry', 'admin.change_logentry'])
+        self.assertEqual(result, {'created': 0, 'deleted': 0, 'roles': 2})
+        self.assertEqual((writes, bumps), ([], 0))
+
+    def test_duplicate_grants_are_removed(self):
+        RolePermission.objects.create(role=self.roles[0], permission=self.add)
+        result, _, bumps = self.apply(['admin.add_logentry', 'admin.change_logentry'])
+        self.assertEqual((result['deleted'], bumps), (1, 1))
+        self.assertEqual(RolePermission.objects.filter(role=self.roles[0]).count(), 2)
+
+    def test_unknown_permissions_are_rejected(self):
+        with self.assertRaises(Permission.DoesNotExist):
+            resolve_permission_ids(['admin.add_logentry', 'admin.fly_logentry'])
+        with self.assertRaises(Permission.DoesNotExist):
+            sync_role_permissions({self.roles[0].pk: {10 ** 9}})
+        with self.assertRaises(ValueError):
+            sync_role_permissions({self.roles[0].pk: set()}, mode='merge')
+        self.assertEqual(self.granted()['Editor'], {'add_logentry', 'change_logentry'})
+
+    def post(self, body, user=None):
+        client = APIClient()
+        client.force_authenticate(user or self.admin)
+        return client.post(reverse('users:role-apply-template'), body, format='json')
+
+    def test_view_applies_a_template_role_to_a_vendor(self):
+        RolePermission.objects.filter(role=self.roles[1], permission=self.change).delete()
+        response = self.post({'vendors': [self.vendor.pk], 'template_role': self.roles[1].pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'created': 0, 'deleted': 1, 'roles': 2})
+        self.assertEqual(self.granted(), {'Editor': {'add_logentry'}, 'Viewer': {'add_logentry'}})
+
+    def test_view_rejects_bad_requests(self):
+        self.assertEqual(self.post({'roles': [self.roles[0].pk], 'permissions': ['admin.fly_logentry']}).status_code, 400)
+        self.assertEqual(self.post({'permissions': ['admin.add_logentry']}).status_code, 400)
+        member = CustomUser.objects.create(username='member', email='member@example.com')
+        self.assertEqual(self.post({'roles': [self.roles[0].pk], 'permissions': []}, user=member).status_code, 403)
+
+
+class OrderCompletionTests(TestCase):
+    """Completing an order updates the buyer's counters and purchase history once, on one amount basis."""
+
+    @classmethod
+    def setUpTestData(cls):
+        vendor = Vendor.objects.create(username='bistro', email='bistro@example.com', company_name='Bistro', user_type='vendor')
+        menu = Menu.objects.create(vendor=vendor, name='Dinner')
+        cls.food = MenuItem.objects.create(menu=menu, name='Curry', price=Decimal('20.00'), category='Food')
+        cls.drink = MenuItem.objects.create(menu=menu, name='Lassi', price=Decimal('20.00'), category='Drinks')
+        cls.buyer = CustomUser.objects.create(username='buyer', email='buyer@example.com')
+
+    def make_order(self, total='69.00'):
+        order = Order.objects.create(user=self.buyer, cart=Cart.objects.create(user=self.buyer), total_amount=Decimal(total))
+        OrderItem.objects.create(order=order, menu_item=self.food, quantity=2, price=self.food.price)
+        OrderItem.objects.create(order=order, menu_item=self.drink, quantity=1, price=self.drink.price)
+        return order
+
+    def counters(self):
+        return CustomUser.objects.filter(pk=self.buyer.pk).values_list('purchase_count', 'total_spent').get()
+
+    def test_history_adds_up_to_total_spent(self):
+        order = self.make_order()  # items 60.00, plus tax and commission
+        order.status = 'COMPLETED'
+        order.save()
+        records = dict(PurchaseRecord.objects.filter(order=order).values_list('category', 'amount'))
+        self.assertEqual(records, {'Food': Decimal('46.00'), 'Drinks': Decimal('23.00')})
+        self.assertEqual(self.counters(), (1, Decimal('69.00')))
+        summary = CustomUser.objects.get(pk=self.buyer.pk).purchase_summary
+        self.assertEqual(sum(Decimal(total) for total in summary['category_totals'].values()), Decimal('69.00'))
+
+    def complete(self, order):
+        order.status = 'COMPLETED'
+        order.save()
+
+    def test_saving_a_completed_order_again_counts_it_once(self):
+        order = self.make_order()
+        self.complete(order)
+        order.save()
+        reloaded = Order.objects.get(pk=order.pk)
+        reloaded.total_amount = Decimal('70.00')
+        reloaded.save()
+        self.assertEqual(self.counters(), (1, Decimal('69.00')))
+        self.assertEqual(PurchaseRecord.objects.filter(order=order).count(), 2)
+
+    def test_stale_copy_does_not_count_the_order_again(self):
+        order = self.make_order()
+        stale = Order.objects.get(pk=order.pk)
+        self.complete(order)
+        self.complete(stale)
+        self.assertEqual(self.counters(), (1, Decimal('69.00')))
+
+    def test_order_created_completed_is_counted(self):
+        Order.objects.create(
+            user=self.buyer, cart=Cart.objects.create(user=self.buyer), total_amount=Decimal('12.50'), status='COMPLETED',
+        )
+        self.assertEqual(self.counters(), (1, Decimal('12.50')))
+
+    def test_pending_and_cancelled_orders_are_not_counted(self):
+        order = self.make_order()
+        order.status = 'CANCELLED'
+        order.save()
+        self.assertEqual(self.counters(), (0, Decimal('0.00')))
+
+    def test_failed_history_rolls_back_the_completion(self):
+        order = self.make_order()
+        with mock.patch.object(Order, 'record_purchase_history', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            self.complete(order)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'PENDING')
+        self.assertEqual(self.counters(), (0, Decimal('0.00')))
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        call_command('reconcile_purchase_counters', *args, stdout=out)
+        return out.getvalue()
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        self.complete(self.make_order())
+        self.complete(self.make_order('31.00'))
+        Order.objects.filter(user=self.buyer).update(created_at=timezone.now())  # one last_purchase_date to compare
+        last = Order.objects.filter(user=self.buyer).latest('created_at').created_at
+        CustomUser.objects.filter(pk=self.buyer.pk).update(purchase_count=5, total_spent=Decimal('1.00'), last_purchase_date=last)
+        idle = CustomUser.objects.create(username='idle', email='idle@example.com')
+        CustomUser.objects.filter(pk=idle.pk).update(purchase_count=1)
+
+        output = self.reconcile()
+        self.assertIn(f'user {self.buyer.pk}: count 5 -> 2, total 1.00 -> 100', output)
+        self.assertIn(f'user {idle.pk}: count 1 -> 0', output)
+        self.assertIn('2 drifted', output)
+        self.assertEqual(self.counters(), (5, Decimal('1.00')))
+
+        self.assertIn('2 drifted, all fixed', self.reconcile('--fix', '--chunk-size', '1'))
+        self.assertEqual(self.counters(), (2, Decimal('100.00')))
+        self.assertIn('0 drifted', self.reconcile())
+
+
+class OrderCompletionRaceTests(TransactionTestCase):
+    """The conditional UPDATE lets only one of several saves claim the move to COMPLETED."""
+
+    def setUp(self):
+        self.buyer = CustomUser.objects.create(username='racer', email='racer@example.com')
+        self.order = Order.objects.create(user=self.buyer, cart=Cart.objects.create(user=self.buyer), total_amount=Decimal('10.00'))
+
+    def counters(self):
+        return CustomUser.objects.filter(pk=self.buyer.pk).values_list('purchase_count', 'total_spent').get()
+
+    def complete_copies(self, copies, concurrently):
+        def complete(order):
+            order.status = 'COMPLETED'
+            try:
+                order.save()
+            finally:
+                if concurrently:
+                    connections.close_all()
+
+        if not concurrently:
+            for order in copies:
+                complete(order)
+            return
+        threads = [threading.Thread(target=complete, args=(order,)) for order in copies]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_stale_copies_saved_in_autocommit_count_once(self):
+        self.complete_copies([Order.objects.get(pk=self.order.pk) for _ in range(3)], concurrently=False)
+        self.assertEqual(self.counters(), (1, Decimal('10.00')))
+        self.assertEqual(PurchaseRecord.objects.filter(order=self.order).count(), 1)
+
+    def test_concurrent_saves_count_once(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('needs a database that allows concurrent writers')
+        self.complete_copies([Order.objects.get(pk=self.order.pk) for _ in range(4)], concurrently=True)
+        self.assertEqual(self.counters(), (1, Decimal('10.00')))
+        self.assertEqual(PurchaseRecord.objects.filter(order=self.order).count(), 1)
+
+
+class CityDatabaseTests(SimpleTestCase):
+    """The compiled city database answers exactly like the CSV scan it replaces."""
+
+    FIELDS = ['geoname_id', 'city_name', 'country_iso_code', 'time_zone']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.csv_path = os.path.join(directory.name, 'city.csv')
+        self.db_path = os.path.join(directory.name, 'city.db')
+
+    def compile(self, rows):
+        with open(self.csv_path, 'w', encoding='utf-8', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(self.FIELDS)
+            writer.writerows(rows)
+        count = geodata.compile_city_database(self.csv_path, self.db_path)
+        database = geodata.CityDatabase(self.db_path)
+        self.addCleanup(database.close)
+        return count, database
+
+    def scan(self, geoname_id):
+        with mock.patch.object(geodata, 'get_city_database', return_value=None), \
+                mock.patch.object(geodata, 'get_city_csv_path', return_value=self.csv_path):
+            return geodata.get_city_data(geoname_id)
+
+    def test_round_trip(self):
+        rows = [['1275339', 'Mumbai', 'IN', 'Asia/Kolkata'], ['2988507', 'Paris', 'FR', 'Europe/Paris'],
+                ['3117735', 'Málaga', 'ES', ''], ['', 'Nowhere', '', '']]
+        count, database = self.compile(rows)
+        self.assertEqual((count, len(database)), (3, 3))
+        for row in rows[:3]:
+            with self.subTest(geoname_id=row[0]):
+                self.assertEqual(database.get(row[0]), dict(zip(self.FIELDS, row)))
+                self.assertEqual(database.get(row[0]), self.scan(row[0]))
+        self.assertEqual(database.get(2988507)['city_name'], 'Paris')
+        for missing in ('42', 'abc', None, '0', -1, ''):
+            with self.subTest(geoname_id=missing):
+                self.assertEqual(database.get(missing), {})
+
+    def test_every_id_survives_collisions(self):
+        rows = [[str(geoname_id), f'City {geoname_id}', 'XX', ''] for geoname_id in range(1, 3000, 3)]
+        _, database = self.compile(rows)
+        self.assertTrue(all(database.get(row[0])['city_name'] == row[1] for row in rows))
+        self.assertEqual(database.get('2'), {})
+
+    def test_first_row_wins_for_duplicate_ids(self):
+        # Regression: the compiled index used to return the last duplicate.
+        _, database = self.compile([['7', 'First', 'AA', ''], ['8', 'Other', 'BB', ''], ['7', 'Second', 'CC', '']])
+        self.assertEqual(database.get('7')['city_name'], 'First')
+        self.assertEqual(self.scan('7')['city_name'], 'First')
+
+    def test_ids_that_cannot_be_indexed_are_rejected(self):
+        for geoname_id in ('0', '-5', '12a'):
+            with self.subTest(geoname_id=geoname_id), self.assertRaisesMessage(ValueError, 'line 3'):
+                self.compile([['1', 'Fine', 'AA', ''], [geoname_id, 'Broken', 'BB', '']])
+        self.assertFalse(os.path.exists(self.db_path))
+        with self.assertRaisesMessage(CommandError, 'is not a positive integer'):
+            call_command('compile_citydb', csv=self.csv_path, output=self.db_path, stdout=io.StringIO())
+
+    def test_other_files_are_refused(self):
+        with open(self.db_path, 'wb') as dbfile:
+            dbfile.write(b'NOTCITY!' + bytes(64))
+        with self.assertRaises(ValueError):
+            geodata.CityDatabase(self.db_path)
+
+
+class IPRangeIndexTests(SimpleTestCase):
+    """The range index answers like a scan of blocks.csv, for both address families."""
+
+    BLOCKS = [
+        ('1.0.4.0/22', '104'),  # out of order on purpose
+        ('1.0.0.0/24', '100'),
+        ('1.0.1.0/24', '101'),
+        ('10.0.0.0/8', ''),  # anonymous network without a geoname_id
+        ('255.255.255.0/24', '255'),
+        ('2001:db8::/32', '600'),
+        ('2a00::/12', '700'),
+    ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'blocks.csv')
+        with open(self.path, 'w', encoding='utf-8', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['network', 'geoname_id', 'registered_country_geoname_id'])
+            writer.writerows([network, geoname_id, ''] for network, geoname_id in self.BLOCKS)
+        self.index = geodata.IPRangeIndex.from_csv(self.path)
+
+    def test_lookup(self):
+        cases = [
+            ('0.255.255.255', None),  # below the first range
+            ('1.0.0.0', '100'), ('1.0.0.255', '100'), ('1.0.1.0', '101'), ('1.0.1.255', '101'),
+            ('1.0.2.0', None), ('1.0.3.255', None),  # gap between two ranges
+            ('1.0.4.0', '104'), ('1.0.7.255', '104'), ('1.0.8.0', None),
+            ('10.1.2.3', None),
+            ('255.255.255.255', '255'),
+            ('2001:db8::', '600'), ('2001:db8:ffff:ffff:ffff:ffff:ffff:ffff', '600'), ('2001:db9::', None),
+            ('2a0f:ffff::1', '700'), ('::1', None),
+            ('::ffff:1.0.0.1', None),  # IPv4-mapped addresses are IPv6, as in the CSV scan
+        ]
+        for ip, expected in cases:
+            with self.subTest(ip=ip):
+                self.assertEqual(self.index.lookup(ip), expected)
+                # Networks without a geoname_id are not indexed: None where the scan gave ''.
+                self.assertEqual(scan_blocks_csv(self.path, ip) or None, expected)
+        self.assertEqual(len(self.index), 6)
+
+    def test_invalid_addresses(self):
+        for ip in ('', 'not-an-ip', '1.0.0.256', None):
+            with self.subTest(ip=ip):
+                self.assertIsNone(self.index.lookup(ip))
+
+    def bench(self, **options):
+        out = io.StringIO()
+        call_command('bench_geoip', path=self.path, stdout=out, **options)
+        return out.getvalue()
+
+    def test_bench_requires_positive_lookup_counts(self):
+        # Regression: a count of 0 divided by zero when averaging the timings.
+        for options in ({'lookups': 0}, {'scan_lookups': 0}, {'lookups': -5}):
+            with self.subTest(**options), self.assertRaisesMessage(CommandError, 'must be a positive number'):
+                self.bench(**options)
+        self.assertIn('Both methods returned the same geoname_ids', self.bench(lookups=50, scan_lookups=50))
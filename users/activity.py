@@ -0,0 +1,183 @@
+# users/activity.py
+"""
+Write-behind buffer for per-request user activity (last IP, last visit).
+
+Requests record into an in-memory dict keyed by user id, so repeated hits from
+the same user collapse into one pending row holding only the latest values.
+A background thread flushes the dict with a single bulk_update every
+``USER_ACTIVITY_FLUSH_INTERVAL`` seconds; the buffer is also flushed when it
+reaches ``USER_ACTIVITY_MAX_PENDING`` users and when the process exits.
+bulk_update bypasses CustomUser.save(), so the flush itself re-resolves the
+preferred currency and timezone of users whose IP changed, off the request path.
+"""
+import abc
+import atexit
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundFlusher(abc.ABC):
+    """
+    Base for per-process write-behind buffers.
+
+    Subclasses must implement ``flush()``; a daemon thread calls it every
+    ``flush_interval`` seconds and once more at interpreter exit.
+    """
+    flush_interval = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.shutdown)
+
+    @abc.abstractmethod
+    def flush(self):
+        """Write whatever is pending and return how much was written."""
+
+    def reset_after_fork(self):
+        """Drop state inherited from the parent process, which still owns it."""
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so (re)start the flusher in each worker process.
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            if self._pid is not None:
+                self.reset_after_fork()
+                self._flush_lock = threading.Lock()
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name=f'{type(self).__name__}-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("%s flush failed", type(self).__name__)
+            finally:
+                connections.close_all()
+
+    def shutdown(self):
+        self._stop.set()
+        self.flush()
+
+
+class UserActivityBuffer(BackgroundFlusher):
+    def __init__(self, flush_interval=None, max_pending=None, last_visit_resolution=None):
+        super().__init__()
+        self.flush_interval = flush_interval or getattr(settings, 'USER_ACTIVITY_FLUSH_INTERVAL', 10)
+        self.max_pending = max_pending or getattr(settings, 'USER_ACTIVITY_MAX_PENDING', 5000)
+        # last_visit is only rewritten when the stored value is older than this.
+        self.last_visit_resolution = timedelta(
+            seconds=last_visit_resolution or getattr(settings, 'USER_ACTIVITY_LAST_VISIT_RESOLUTION', 60)
+        )
+        self.stats = {'recorded': 0, 'skipped': 0, 'flushed': 0, 'geo_resolved': 0}
+        # user id -> (ip, last_visit, ip stored in the database when the user was first queued)
+        self._pending = {}
+
+    def record(self, user, ip=None, visited_at=None):
+        """
+        Queue the latest IP / visit time for ``user``.
+
+        Nothing is queued when the IP is unchanged and the stored last_visit is
+        recent enough, so most requests from an active session cost a dict lookup.
+        """
+        visited_at = visited_at or timezone.now()
+        self._ensure_worker()
+        with self._lock:
+            pending = self._pending.get(user.pk)
+            current_ip, current_visit, stored_ip = pending if pending else (
+                user.last_known_ip, user.last_visit, user.last_known_ip
+            )
+            new_ip = ip or current_ip
+            visit_is_fresh = current_visit is not None and visited_at - current_visit < self.last_visit_resolution
+            if new_ip == current_ip and visit_is_fresh:
+                self.stats['skipped'] += 1
+                return False
+            new_visit = current_visit if visit_is_fresh else visited_at
+            self._pending[user.pk] = (new_ip, new_visit, stored_ip)
+            self.stats['recorded'] += 1
+            is_full = len(self._pending) >= self.max_pending
+
+        # Keep the in-memory user consistent with what will be written.
+        user.last_known_ip, user.last_visit = new_ip, new_visit
+        if is_full:
+            self.flush()
+        return True
+
+    def flush(self):
+        """
+        Write every pending user with bulk_update, plus one query to re-resolve
+        geo data when some IPs changed. Returns the number of rows written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            CustomUser = apps.get_model('users', 'CustomUser')
+            users = {
+                pk: CustomUser(pk=pk, last_known_ip=ip, last_visit=last_visit)
+                for pk, (ip, last_visit, _) in pending.items()
+            }
+            moved = [pk for pk, (ip, _, stored_ip) in pending.items() if ip and ip != stored_ip]
+            try:
+                located = self._resolve_geo([users[pk] for pk in moved])
+                located_ids = {user.pk for user in located}
+                with transaction.atomic():
+                    CustomUser.objects.bulk_update(
+                        [user for pk, user in users.items() if pk not in located_ids],
+                        ['last_known_ip', 'last_visit'], batch_size=1000,
+                    )
+                    CustomUser.objects.bulk_update(
+                        located, ['last_known_ip', 'last_visit', 'preferred_currency', 'preferred_timezone'],
+                        batch_size=1000,
+                    )
+            except Exception:
+                logger.exception("Dropped %d buffered user activity updates", len(users))
+                return 0
+            self.stats['flushed'] += len(users)
+            self.stats['geo_resolved'] += len(located)
+            return len(users)
+
+    def _resolve_geo(self, users):
+        """Set currency and timezone from the new IP, as CustomUser.save() does; returns the users it found."""
+        if not users:
+            return []
+        CustomUser = apps.get_model('users', 'CustomUser')
+        # Start from the stored values, so a lookup that finds only one of the two keeps the other.
+        stored = {
+            pk: (currency_id, timezone_id)
+            for pk, currency_id, timezone_id in CustomUser.objects.filter(pk__in=[user.pk for user in users])
+            .values_list('pk', 'preferred_currency_id', 'preferred_timezone_id')
+        }
+        located = []
+        for user in users:
+            if user.pk not in stored:
+                continue  # deleted since the request
+            user.preferred_currency_id, user.preferred_timezone_id = stored[user.pk]
+            if user.resolve_geo_info(user.last_known_ip):
+                located.append(user)
+        return located
+
+    def reset_after_fork(self):
+        self._pending = {}
+
+
+activity_buffer = UserActivityBuffer()
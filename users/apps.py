@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from . import audience, funnels, permissions, refdata
+        refdata.connect_signals()
+        funnels.connect_signals()
+        audience.connect_signals()
+        permissions.connect_signals()
@@ -0,0 +1,370 @@
+# users/audience.py
+"""
+Bitmap index for audience targeting.
+
+For every indexed (attribute, value) pair - country, gender, income level,
+housing status, lifestyle, segment, each behavior tag, each marketing
+preference and each privacy flag - AudienceBitmap stores a zlib-compressed
+bitmap of the matching user ids. In memory a bitmap is a plain Python int, so
+AND / OR / NOT and popcount run in C over whole machine words.
+
+Saves of indexed fields queue the user id in AudienceChange;
+``refresh_audience_index`` patches only the bitmaps those users touch and bumps
+a version in the shared cache. Each process keeps its own copy and reloads the
+rows changed since its last load when the version moves (checked at most every
+``AUDIENCE_VERSION_CHECK_INTERVAL`` seconds).
+
+Queries are JSON-style dicts::
+
+    {"segment": "Champions", "country": "IN",
+     "marketing_preference": "interests=Sports", "can_target_ads": true}
+
+Keys in one dict are ANDed, a list value ORs its items, and ``and`` / ``or``
+/ ``not`` nest expressions.
+"""
+import threading
+import time
+import zlib
+from array import array
+from collections import defaultdict
+from datetime import timedelta
+from functools import reduce
+from operator import and_, or_
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from .refdata import reference_data
+
+VERSION_KEY = 'users:audience:version'
+
+# Attribute name -> CustomUser.values() column.
+USER_ATTRIBUTES = {
+    'country': 'country_id',
+    'gender': 'gender',
+    'income_level': 'income_level_id',
+    'housing_status': 'housing_status_id',
+    'lifestyle': 'lifestyle',
+    'segment': 'segment',
+}
+PRIVACY_FLAGS = ('can_sell_data', 'can_target_ads', 'can_share_data')
+ATTRIBUTES = frozenset(USER_ATTRIBUTES) | {'behavior_tag', 'marketing_preference'} | frozenset(PRIVACY_FLAGS)
+INDEXED_FIELDS = frozenset(USER_ATTRIBUTES) | {'behavior_tags', 'marketing_preferences'}
+
+UNIVERSE = ('_all', '')
+VALUE_LENGTH = 255
+
+_BYTE_BITS = tuple(tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256))
+
+
+class AudienceQueryError(ValueError):
+    pass
+
+
+def encode_bitmap(bits):
+    return zlib.compress(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'))
+
+
+def decode_bitmap(blob):
+    return int.from_bytes(zlib.decompress(bytes(blob)), 'little')
+
+
+def bitmap_from_ids(ids):
+    """Build a bitmap in one pass over a bytearray (OR-ing ints one id at a time is quadratic)."""
+    if not ids:
+        return 0
+    buffer = bytearray((max(ids) >> 3) + 1)
+    for user_id in ids:
+        buffer[user_id >> 3] |= 1 << (user_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def iter_ids(bits):
+    """Yield the user ids set in ``bits`` in ascending order."""
+    for offset, byte in enumerate(bits.to_bytes((bits.bit_length() + 7) // 8, 'little')):
+        if byte:
+            base = offset << 3
+            for bit in _BYTE_BITS[byte]:
+                yield base + bit
+
+
+def _tag_values(tags):
+    if isinstance(tags, str):
+        return [tags]
+    if isinstance(tags, dict):
+        return [str(tag) for tag, enabled in tags.items() if enabled]
+    if isinstance(tags, list):
+        return [str(tag) for tag in tags if isinstance(tag, (str, int))]
+    return []
+
+
+def _preference_values(preferences):
+    """``{"email": true, "interests": ["Sports"], "tier": "gold"}`` -> email, interests=Sports, tier=gold."""
+    if not isinstance(preferences, dict):
+        return []
+    values = []
+    for key, value in preferences.items():
+        if value is True:
+            values.append(str(key))
+        elif isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            values.append(f"{key}={value}")
+        elif isinstance(value, list):
+            values.extend(f"{key}={item}" for item in value if isinstance(item, (str, int, float)))
+    return values
+
+
+def _user_rows(queryset, chunk_size=10000):
+    columns = ['pk', 'behavior_tags', 'marketing_preferences', *USER_ATTRIBUTES.values()]
+    columns += [f'userprivacysettings__{flag}' for flag in PRIVACY_FLAGS]
+    return queryset.values(*columns).iterator(chunk_size=chunk_size)
+
+
+def user_keys(row):
+    """Every (attribute, value) bitmap key the user described by ``row`` belongs to."""
+    keys = {UNIVERSE}
+    for attribute, column in USER_ATTRIBUTES.items():
+        if row[column] not in (None, ''):
+            keys.add((attribute, str(row[column])[:VALUE_LENGTH]))
+    keys.update(('behavior_tag', tag[:VALUE_LENGTH]) for tag in _tag_values(row['behavior_tags']))
+    keys.update(('marketing_preference', pref[:VALUE_LENGTH]) for pref in _preference_values(row['marketing_preferences']))
+    keys.update((flag, 'true') for flag in PRIVACY_FLAGS if row[f'userprivacysettings__{flag}'])
+    return keys
+
+
+def bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        if not cache.add(VERSION_KEY, 1, timeout=None):
+            cache.incr(VERSION_KEY)
+
+
+def queue_audience_refresh(user_ids):
+    """Mark users whose indexed attributes changed outside of model save() (e.g. queryset.update())."""
+    AudienceChange = apps.get_model('users', 'AudienceChange')
+    AudienceChange.objects.bulk_create([AudienceChange(user_id=user_id) for user_id in user_ids], batch_size=1000)
+
+
+def rebuild_audience_index(chunk_size=10000):
+    """Recompute every bitmap from CustomUser. Returns the number of users indexed."""
+    CustomUser = apps.get_model('users', 'CustomUser')
+    AudienceBitmap = apps.get_model('users', 'AudienceBitmap')
+    AudienceChange = apps.get_model('users', 'AudienceChange')
+
+    # Changes queued while we scan stay in the queue for the next refresh.
+    queued_upto = AudienceChange.objects.aggregate(upper=Max('pk'))['upper'] or 0
+    ids_by_key = defaultdict(lambda: array('q'))
+    total = 0
+    for row in _user_rows(CustomUser.objects.order_by('pk'), chunk_size):
+        for key in user_keys(row):
+            ids_by_key[key].append(row['pk'])
+        total += 1
+
+    with transaction.atomic():
+        AudienceBitmap.objects.all().delete()
+        AudienceBitmap.objects.bulk_create(
+            (
+                AudienceBitmap(attribute=attribute, value=value, bitmap=encode_bitmap(bitmap_from_ids(ids)))
+                for (attribute, value), ids in ids_by_key.items()
+            ),
+            batch_size=100,
+        )
+        AudienceChange.objects.filter(pk__lte=queued_upto).delete()
+    bump_version()
+    return total
+
+
+def refresh_audience_index(batch_size=10000):
+    """
+    Apply queued user changes to the stored bitmaps.
+
+    Each batch clears the changed users from every bitmap with one mask and
+    sets their current keys, writing back only the bitmaps that differ.
+    Returns the number of distinct users refreshed.
+    """
+    CustomUser = apps.get_model('users', 'CustomUser')
+    AudienceBitmap = apps.get_model('users', 'AudienceBitmap')
+    AudienceChange = apps.get_model('users', 'AudienceChange')
+
+    refreshed = 0
+    while True:
+        changes = list(AudienceChange.objects.order_by('pk').values_list('pk', 'user_id')[:batch_size])
+        if not changes:
+            break
+        user_ids = {user_id for _, user_id in changes}
+        mask = bitmap_from_ids(user_ids)
+        ids_by_key = defaultdict(list)
+        for row in _user_rows(CustomUser.objects.filter(pk__in=user_ids)):
+            for key in user_keys(row):
+                ids_by_key[key].append(row['pk'])
+
+        now = timezone.now()
+        with transaction.atomic():
+            to_update = []
+            for stored in AudienceBitmap.objects.select_for_update().order_by('pk'):
+                added = bitmap_from_ids(ids_by_key.pop((stored.attribute, stored.value), ()))
+                old = decode_bitmap(stored.bitmap)
+                if not (old & mask) and not added:
+                    continue
+                new = (old & ~mask) | added
+                if new != old:
+                    stored.bitmap, stored.updated_at = encode_bitmap(new), now
+                    to_update.append(stored)
+            AudienceBitmap.objects.bulk_update(to_update, ['bitmap', 'updated_at'], batch_size=100)
+            AudienceBitmap.objects.bulk_create(
+                [
+                    AudienceBitmap(attribute=attribute, value=value, bitmap=encode_bitmap(bitmap_from_ids(ids)))
+                    for (attribute, value), ids in ids_by_key.items()
+                ],
+                batch_size=100,
+            )
+            AudienceChange.objects.filter(pk__lte=changes[-1][0]).delete()
+        if to_update or ids_by_key:
+            bump_version()
+        refreshed += len(user_ids)
+    return refreshed
+
+
+class AudienceIndex:
+    # Reload rows updated this long before the last load too, in case a slower refresh committed late.
+    reload_overlap = timedelta(minutes=5)
+
+    def __init__(self, check_interval=None):
+        self.check_interval = check_interval if check_interval is not None else getattr(
+            settings, 'AUDIENCE_VERSION_CHECK_INTERVAL', 5
+        )
+        self._lock = threading.Lock()
+        self._bitmaps = None
+        self._loaded_at = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self._bitmaps = None
+            self._checked_at = 0.0
+
+    def _load(self, bitmaps, since):
+        AudienceBitmap = apps.get_model('users', 'AudienceBitmap')
+        bitmaps = dict(bitmaps or {})
+        loaded_at = timezone.now()
+        rows = AudienceBitmap.objects.all()
+        if since is not None:
+            rows = rows.filter(updated_at__gte=since - self.reload_overlap)
+            # Drop values that no longer exist anywhere (e.g. after a rebuild).
+            current = set(AudienceBitmap.objects.values_list('attribute', 'value'))
+            bitmaps = {key: bits for key, bits in bitmaps.items() if key in current}
+        for attribute, value, blob in rows.values_list('attribute', 'value', 'bitmap'):
+            bitmaps[attribute, value] = decode_bitmap(blob)
+        return bitmaps, loaded_at
+
+    def _get(self):
+        now = time.monotonic()
+        bitmaps = self._bitmaps
+        if bitmaps is not None and now - self._checked_at < self.check_interval:
+            return bitmaps
+        with self._lock:
+            version = cache.get(VERSION_KEY)
+            if self._bitmaps is None or version != self._version:
+                since = self._loaded_at if self._bitmaps is not None else None
+                self._bitmaps, self._loaded_at = self._load(self._bitmaps, since)
+                self._version = version
+            self._checked_at = now
+            return self._bitmaps
+
+    def _leaf_value(self, attribute, value):
+        if attribute == 'country' and not str(value).isdigit():
+            country = reference_data.get_country(code=value) or reference_data.get_country(name=value)
+            return str(country.pk) if country else None
+        return str(value)[:VALUE_LENGTH]
+
+    def _leaf(self, bitmaps, attribute, value):
+        if attribute not in ATTRIBUTES:
+            raise AudienceQueryError(f"Unknown audience attribute {attribute!r}.")
+        universe = bitmaps.get(UNIVERSE, 0)
+        if attribute in PRIVACY_FLAGS:
+            if not isinstance(value, bool):
+                raise AudienceQueryError(f"{attribute} must be true or false.")
+            flagged = bitmaps.get((attribute, 'true'), 0)
+            return flagged if value else universe & ~flagged
+        result = 0
+        for item in value if isinstance(value, list) else [value]:
+            if item is None or isinstance(item, (dict, list)):
+                raise AudienceQueryError(f"Invalid value for {attribute}: {item!r}.")
+            result |= bitmaps.get((attribute, self._leaf_value(attribute, item)), 0)
+        return result
+
+    def _evaluate(self, bitmaps, expression):
+        if not isinstance(expression, dict) or not expression:
+            raise AudienceQueryError("An audience expression must be a non-empty object.")
+        universe = bitmaps.get(UNIVERSE, 0)
+        parts = []
+        for key, value in expression.items():
+            if key in ('and', 'or'):
+                if not isinstance(value, list) or not value:
+                    raise AudienceQueryError(f"'{key}' takes a non-empty list of expressions.")
+                operands = [self._evaluate(bitmaps, item) for item in value]
+                parts.append(reduce(and_ if key == 'and' else or_, operands))
+            elif key == 'not':
+                parts.append(universe & ~self._evaluate(bitmaps, value))
+            else:
+                parts.append(self._leaf(bitmaps, key, value))
+        return reduce(and_, parts)
+
+    def evaluate(self, expression):
+        """Return the bitmap (a Python int) of users matching ``expression``."""
+        return self._evaluate(self._get(), expression)
+
+    def count(self, expression):
+        return self.evaluate(expression).bit_count()
+
+    def user_ids(self, expression):
+        return iter_ids(self.evaluate(expression))
+
+
+audience_index = AudienceIndex()
+
+
+def _indexed_fields_changing(instance, update_fields):
+    if instance._state.adding:
+        return True
+    if update_fields is not None:
+        return bool(INDEXED_FIELDS.intersection(update_fields))
+    if instance._snapshot is not None:
+        # A full save of a loaded instance: only the fields that differ from the load matter.
+        return any(instance.has_changed(name) for name in INDEXED_FIELDS)
+    return True  # nothing to compare with
+
+
+def _note_user_change(sender, instance, update_fields=None, raw=False, **kwargs):
+    instance._audience_changed = not raw and _indexed_fields_changing(instance, update_fields)
+
+
+def _queue_user(sender, instance, **kwargs):
+    if getattr(instance, '_audience_changed', True):
+        queue_audience_refresh([instance.pk])
+
+
+def _queue_deleted_user(sender, instance, **kwargs):
+    queue_audience_refresh([instance.pk])
+
+
+def _queue_privacy_owner(sender, instance, raw=False, **kwargs):
+    if not raw:
+        queue_audience_refresh([instance.user_id])
+
+
+def connect_signals():
+    for model_name in ('CustomUser', 'Vendor'):
+        model = apps.get_model('users', model_name)
+        pre_save.connect(_note_user_change, sender=model, dispatch_uid=f'users_audience_pre_save_{model_name}')
+        post_save.connect(_queue_user, sender=model, dispatch_uid=f'users_audience_save_{model_name}')
+        post_delete.connect(_queue_deleted_user, sender=model, dispatch_uid=f'users_audience_delete_{model_name}')
+    privacy = apps.get_model('users', 'UserPrivacySettings')
+    post_save.connect(_queue_privacy_owner, sender=privacy, dispatch_uid='users_audience_privacy_save')
+    post_delete.connect(_queue_privacy_owner, sender=privacy, dispatch_uid='users_audience_privacy_delete')
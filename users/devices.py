@@ -0,0 +1,171 @@
+# users/devices.py
+"""
+User-agent classification and write-behind UserDevice upserts.
+
+``classify_user_agent`` is memoized on the raw UA string; a handful of UA
+strings cover most traffic, so the regexes run once per distinct browser build.
+
+``device_buffer`` coalesces sightings per (user, device_type, browser, OS) and
+writes each device at most once per ``USER_DEVICE_LAST_SEEN_INTERVAL``
+seconds. A flush resolves all pending devices with one SELECT, then issues one
+bulk_update for known devices and one bulk_create for new ones.
+"""
+import logging
+import re
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .activity import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+UserAgentInfo = namedtuple('UserAgentInfo', ['device_type', 'browser', 'operating_system'])
+
+_BOT_RE = re.compile(r'bot|crawl|spider|slurp|headless|preview', re.I)
+
+# First match wins, so more specific tokens come first (Edge and Opera also send "Chrome/").
+_BROWSERS = (
+    ('Edge', re.compile(r'Edg(e|A|iOS)?/', re.I)),
+    ('Opera', re.compile(r'OPR/|Opera', re.I)),
+    ('Samsung Internet', re.compile(r'SamsungBrowser/', re.I)),
+    ('Chrome', re.compile(r'Chrome/|CriOS/', re.I)),
+    ('Firefox', re.compile(r'Firefox/|FxiOS/', re.I)),
+    ('Safari', re.compile(r'Safari/', re.I)),
+    ('Internet Explorer', re.compile(r'MSIE |Trident/', re.I)),
+)
+
+_OPERATING_SYSTEMS = (
+    ('Windows', re.compile(r'Windows', re.I)),
+    ('iOS', re.compile(r'iPhone|iPad|iPod', re.I)),
+    ('macOS', re.compile(r'Mac OS X|Macintosh', re.I)),
+    ('Android', re.compile(r'Android', re.I)),
+    ('Chrome OS', re.compile(r'CrOS', re.I)),
+    ('Linux', re.compile(r'Linux', re.I)),
+)
+
+_TABLET_RE = re.compile(r'iPad|Tablet|Kindle|Silk/|PlayBook', re.I)
+_MOBILE_RE = re.compile(r'Mobi|iPhone|iPod|Android|Windows Phone', re.I)
+
+
+def _first_match(patterns, user_agent):
+    for name, pattern in patterns:
+        if pattern.search(user_agent):
+            return name
+    return 'Other'
+
+
+@lru_cache(maxsize=getattr(settings, 'USER_AGENT_CACHE_SIZE', 1024))
+def classify_user_agent(user_agent):
+    """
+    Map a raw User-Agent header to a UserAgentInfo, or None for bots and empty headers.
+
+    ``device_type`` is one of the DEVICE_TYPE_CHOICES keys.
+    """
+    if not user_agent or _BOT_RE.search(user_agent):
+        return None
+    if _TABLET_RE.search(user_agent) or ('Android' in user_agent and 'Mobile' not in user_agent):
+        device_type = 'Tablet'
+    elif _MOBILE_RE.search(user_agent):
+        device_type = 'Mobile'
+    else:
+        device_type = 'Desktop'
+    return UserAgentInfo(device_type, _first_match(_BROWSERS, user_agent), _first_match(_OPERATING_SYSTEMS, user_agent))
+
+
+class DeviceActivityBuffer(BackgroundFlusher):
+    def __init__(self, flush_interval=None, last_seen_interval=None):
+        super().__init__()
+        self.flush_interval = flush_interval or getattr(settings, 'USER_DEVICE_FLUSH_INTERVAL', 10)
+        # A device's last_seen is only rewritten when the stored value is older than this.
+        self.last_seen_interval = timedelta(
+            seconds=last_seen_interval or getattr(settings, 'USER_DEVICE_LAST_SEEN_INTERVAL', 300)
+        )
+        self.stats = {'recorded': 0, 'throttled': 0, 'updated': 0, 'created': 0}
+        self._pending = {}
+        self._written = {}
+
+    def record(self, user, user_agent, seen_at=None):
+        """Queue a sighting of the device behind ``user_agent``. Returns False when throttled or ignored."""
+        info = classify_user_agent((user_agent or '')[:512])
+        if info is None:
+            return False
+        seen_at = seen_at or timezone.now()
+        key = (user.pk,) + tuple(info)
+        self._ensure_worker()
+        with self._lock:
+            if key in self._pending:
+                # Coalesced: the flush writes the latest sighting of the window.
+                self._pending[key] = max(self._pending[key], seen_at)
+                self.stats['throttled'] += 1
+                return False
+            last_written = self._written.get(key)
+            if last_written and seen_at - last_written < self.last_seen_interval:
+                self.stats['throttled'] += 1
+                return False
+            self._pending[key] = seen_at
+            self.stats['recorded'] += 1
+        return True
+
+    def flush(self):
+        """Upsert every pending device. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                updated, created = self._write(pending)
+            except Exception:
+                logger.exception("Dropped %d buffered device updates", len(pending))
+                return 0
+            with self._lock:
+                self._written.update(pending)
+                # Entries older than the interval no longer throttle anything.
+                horizon = timezone.now() - self.last_seen_interval
+                self._written = {key: at for key, at in self._written.items() if at >= horizon}
+            self.stats['updated'] += updated
+            self.stats['created'] += created
+            return updated + created
+
+    def _write(self, pending):
+        UserDevice = apps.get_model('users', 'UserDevice')
+        existing = {}
+        devices = UserDevice.objects.filter(user_id__in={key[0] for key in pending}).order_by('last_seen')
+        for device in devices.only('pk', 'user_id', 'device_type', 'browser', 'operating_system', 'last_seen'):
+            # Duplicate rows collapse onto the most recently seen one.
+            existing[(device.user_id, device.device_type, device.browser, device.operating_system)] = device
+
+        to_update, to_create = [], []
+        for key, seen_at in pending.items():
+            device = existing.get(key)
+            if device is None:
+                user_id, device_type, browser, operating_system = key
+                to_create.append(UserDevice(
+                    user_id=user_id, device_type=device_type, browser=browser,
+                    operating_system=operating_system, last_seen=seen_at,
+                ))
+            elif device.last_seen is None or seen_at - device.last_seen >= self.last_seen_interval:
+                device.last_seen = seen_at
+                to_update.append(device)
+            else:
+                # Another process wrote this device recently.
+                self.stats['throttled'] += 1
+        with transaction.atomic():
+            if to_update:
+                UserDevice.objects.bulk_update(to_update, ['last_seen'], batch_size=1000)
+            if to_create:
+                UserDevice.objects.bulk_create(to_create, batch_size=1000)
+        return len(to_update), len(to_create)
+
+    def reset_after_fork(self):
+        self._pending = {}
+        self._written = {}
+
+
+device_buffer = DeviceActivityBuffer()
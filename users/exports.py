@@ -0,0 +1,103 @@
+# users/exports.py
+"""
+Streaming user exports for marketing partners.
+
+The consent rules are part of the query: the privacy flag for the export's
+purpose is an inner join on UserPrivacySettings, and every required consent
+type is an EXISTS semi-join on the user's latest UserConsent row of that type,
+which must be granted and not withdrawn. Changes are recorded as new rows, so
+a later withdrawal overrides an earlier grant. Rows
+are read through ``iterator(chunk_size)``, which uses a server-side cursor on
+PostgreSQL, and encoded in batches, so memory stays flat however many users
+match.
+"""
+import csv
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef, Subquery
+
+# Column name -> CustomUser lookup.
+EXPORT_COLUMNS = (
+    ('id', 'pk'),
+    ('username', 'username'),
+    ('email', 'email'),
+    ('first_name', 'first_name'),
+    ('last_name', 'last_name'),
+    ('country', 'country__name'),
+    ('state', 'state__name'),
+    ('city', 'city__name'),
+    ('gender', 'gender'),
+    ('age', 'age'),
+    ('lifestyle', 'lifestyle'),
+    ('segment', 'segment'),
+    ('date_joined', 'date_joined'),
+)
+
+# Export purpose -> UserPrivacySettings flag that must be set.
+PURPOSE_FLAGS = {
+    'share': 'can_share_data',
+    'sell': 'can_sell_data',
+}
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+
+def exportable_users(purpose='share', consent_types=()):
+    """Active users who allowed ``purpose`` and hold every consent named in ``consent_types``."""
+    CustomUser = apps.get_model('users', 'CustomUser')
+    UserConsent = apps.get_model('users', 'UserConsent')
+    if purpose not in PURPOSE_FLAGS:
+        raise ValueError(f"Unknown export purpose {purpose!r}.")
+
+    users = CustomUser.objects.filter(is_active=True, **{f'userprivacysettings__{PURPOSE_FLAGS[purpose]}': True})
+    for consent_type in consent_types:
+        # UserConsent has no creation time; the highest pk is the most recently recorded decision.
+        latest = UserConsent.objects.filter(
+            user=OuterRef(OuterRef('pk')),
+            consent_type__name=consent_type,
+        ).order_by('-pk').values('pk')[:1]
+        granted = UserConsent.objects.filter(pk=Subquery(latest), consented=True, date_withdrawn__isnull=True)
+        users = users.filter(Exists(granted))
+    return users.order_by('pk')
+
+
+def export_rows(queryset, chunk_size=None):
+    chunk_size = chunk_size or getattr(settings, 'USER_EXPORT_CHUNK_SIZE', 2000)
+    return queryset.values_list(*(lookup for _, lookup in EXPORT_COLUMNS)).iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    """File-like object whose write() hands the encoded line back to csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def _batched(lines, batch_size):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def stream_csv(rows, batch_size=500):
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow([name for name, _ in EXPORT_COLUMNS])
+        for row in rows:
+            yield writer.writerow(row)
+
+    return _batched(lines(), batch_size)
+
+
+def stream_ndjson(rows, batch_size=500):
+    names = [name for name, _ in EXPORT_COLUMNS]
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    return _batched((encoder.encode(dict(zip(names, row))) + '\n' for row in rows), batch_size)
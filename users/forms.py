@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django.apps import apps
 from django.forms.models import modelform_factory
+from .refdata import use_cached_country_choices
 
 class UserProfileForm(forms.ModelForm):
     class Meta:
@@ -35,6 +36,7 @@ class CustomUserForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['country'].queryset = apps.get_model('users', 'Country').objects.all()
+        use_cached_country_choices(self.fields['country'])
         for field in self.fields:
             self.fields[field].widget.attrs.update({'class': 'form-control'})
 
@@ -0,0 +1,236 @@
+# users/funnels.py
+"""
+Funnel analytics over UserJourney / JourneyStage.
+
+Two daily rollups are kept up to date as journeys are created or deleted:
+
+* FunnelStageDaily: users entering each stage per day.
+* FunnelTransitionDaily: per day, users entering ``to_stage`` who had already
+  entered ``from_stage`` (a full stage-to-stage conversion matrix).
+
+Each journey change costs one indexed read of that user's other journeys
+plus a few counter UPDATEs, and ``funnel()`` answers a date range by summing
+at most (days x stages^2) small rows instead of scanning UserJourney.
+``rebuild_funnels()`` recomputes both tables in a single ordered pass, and
+``reconcile_funnels()`` reports (and optionally repairs) rows that drifted.
+"""
+from collections import Counter
+from itertools import groupby
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_save, pre_delete
+from django.utils import timezone
+
+
+def _day(value):
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def _increment(model, field, amount, **key):
+    rows = model.objects.filter(**key)
+    if amount < 0:
+        rows.filter(**{f'{field}__gte': -amount}).update(**{field: F(field) + amount})
+        return
+    if rows.update(**{field: F(field) + amount}):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **{field: amount})
+    except IntegrityError:
+        # Created concurrently by another writer.
+        rows.update(**{field: F(field) + amount})
+
+
+def apply_journey(journey, sign=1, exclude=()):
+    """
+    Add (sign=1) or remove (sign=-1) one UserJourney from the rollups.
+
+    Transitions with the journeys in ``exclude`` (pks) are left alone.
+    """
+    FunnelStageDaily = apps.get_model('users', 'FunnelStageDaily')
+    FunnelTransitionDaily = apps.get_model('users', 'FunnelTransitionDaily')
+    UserJourney = apps.get_model('users', 'UserJourney')
+    day = _day(journey.date_entered)
+    position = (journey.date_entered, journey.pk)
+    with transaction.atomic():
+        _increment(FunnelStageDaily, 'entries', sign, day=day, stage_id=journey.stage_id)
+        others = (
+            UserJourney.objects.filter(user_id=journey.user_id)
+            .exclude(pk__in=[journey.pk, *exclude])
+            .values_list('pk', 'stage_id', 'date_entered')
+        )
+        for pk, stage_id, date_entered in others:
+            if (date_entered, pk) < position:
+                _increment(FunnelTransitionDaily, 'users', sign, day=day, from_stage_id=stage_id, to_stage_id=journey.stage_id)
+            else:
+                _increment(
+                    FunnelTransitionDaily, 'users', sign,
+                    day=_day(date_entered), from_stage_id=journey.stage_id, to_stage_id=stage_id,
+                )
+
+
+def _on_journey_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        apply_journey(instance, 1)
+
+
+def _on_journey_deleting(sender, instance, origin=None, **kwargs):
+    # Cascade and queryset deletes send pre_delete for every row before removing any, so the
+    # user's other journeys are still readable here. A pair deleted together is one transition:
+    # it is taken off with whichever journey goes first, tracked on the delete's origin.
+    removed = getattr(origin, '_funnel_removed_journeys', None)
+    if removed is None:
+        removed = set()
+        if origin is not None:
+            origin._funnel_removed_journeys = removed
+    apply_journey(instance, -1, exclude=removed)
+    removed.add(instance.pk)
+
+
+def connect_signals():
+    UserJourney = apps.get_model('users', 'UserJourney')
+    post_save.connect(_on_journey_saved, sender=UserJourney, dispatch_uid='users_funnel_journey_save')
+    pre_delete.connect(_on_journey_deleting, sender=UserJourney, dispatch_uid='users_funnel_journey_delete')
+
+
+def funnel_totals(chunk_size=10000):
+    """
+    Count stage entries {(day, stage_id)} and transitions {(day, from_id, to_id)} from UserJourney.
+
+    Journeys are streamed in (user, date_entered) order, so each user's
+    transitions are counted from one small group. Returns
+    (entries, transitions, number of journeys read).
+    """
+    UserJourney = apps.get_model('users', 'UserJourney')
+
+    entries, transitions = Counter(), Counter()
+    journeys = (
+        UserJourney.objects.order_by('user_id', 'date_entered', 'pk')
+        .values_list('user_id', 'stage_id', 'date_entered')
+        .iterator(chunk_size=chunk_size)
+    )
+    total = 0
+    for _, rows in groupby(journeys, key=lambda row: row[0]):
+        seen = []
+        for _, stage_id, date_entered in rows:
+            day = _day(date_entered)
+            entries[day, stage_id] += 1
+            for previous in seen:
+                transitions[day, previous, stage_id] += 1
+            seen.append(stage_id)
+            total += 1
+    return entries, transitions, total
+
+
+def rebuild_funnels(chunk_size=10000):
+    """Recompute both rollup tables from UserJourney. Returns the number of journeys read."""
+    FunnelStageDaily = apps.get_model('users', 'FunnelStageDaily')
+    FunnelTransitionDaily = apps.get_model('users', 'FunnelTransitionDaily')
+
+    entries, transitions, total = funnel_totals(chunk_size)
+    with transaction.atomic():
+        FunnelStageDaily.objects.all().delete()
+        FunnelTransitionDaily.objects.all().delete()
+        FunnelStageDaily.objects.bulk_create(
+            [FunnelStageDaily(day=day, stage_id=stage_id, entries=count) for (day, stage_id), count in entries.items()],
+            batch_size=1000,
+        )
+        FunnelTransitionDaily.objects.bulk_create(
+            [
+                FunnelTransitionDaily(day=day, from_stage_id=from_id, to_stage_id=to_id, users=count)
+                for (day, from_id, to_id), count in transitions.items()
+            ],
+            batch_size=1000,
+        )
+    return total
+
+
+# Rollup table -> (key fields, counter field).
+_ROLLUPS = (
+    ('FunnelStageDaily', ('day', 'stage_id'), 'entries'),
+    ('FunnelTransitionDaily', ('day', 'from_stage_id', 'to_stage_id'), 'users'),
+)
+
+
+def reconcile_funnels(fix=False, chunk_size=10000):
+    """
+    Compare both rollup tables with UserJourney.
+
+    Returns a list of (table, key, stored count, expected count) for the rows
+    that drifted; with ``fix`` those rows are rewritten, created or deleted.
+    """
+    entries, transitions, _ = funnel_totals(chunk_size)
+    drifted = []
+    with transaction.atomic():
+        for (model_name, key_fields, field), expected in zip(_ROLLUPS, (entries, transitions)):
+            model = apps.get_model('users', model_name)
+            stored = {
+                tuple(row[:-2]): row[-2:]
+                for row in model.objects.values_list(*key_fields, 'pk', field).iterator(chunk_size=chunk_size)
+            }
+            changed, missing, extra = [], [], []
+            for key, (pk, count) in stored.items():
+                if expected.get(key, 0) != count:
+                    drifted.append((model_name, key, count, expected.get(key, 0)))
+                    if expected.get(key, 0):
+                        changed.append(model(pk=pk, **{field: expected[key]}))
+                    else:
+                        extra.append(pk)
+            for key, count in expected.items():
+                if key not in stored:
+                    drifted.append((model_name, key, 0, count))
+                    missing.append(model(**dict(zip(key_fields, key)), **{field: count}))
+            if fix:
+                model.objects.filter(pk__in=extra).delete()
+                model.objects.bulk_update(changed, [field], batch_size=1000)
+                model.objects.bulk_create(missing, batch_size=1000)
+    return drifted
+
+
+def funnel(start, end):
+    """
+    Funnel for journeys entered between ``start`` and ``end`` (inclusive dates).
+
+    Stages are listed in ``order``; each carries its entry count and the
+    conversion from the previous stage (users entering this stage in the range
+    who had reached the previous one, over the previous stage's entries).
+    ``transitions`` is the full from/to matrix for the range.
+    """
+    JourneyStage = apps.get_model('users', 'JourneyStage')
+    FunnelStageDaily = apps.get_model('users', 'FunnelStageDaily')
+    FunnelTransitionDaily = apps.get_model('users', 'FunnelTransitionDaily')
+
+    entries = dict(
+        FunnelStageDaily.objects.filter(day__range=(start, end))
+        .values_list('stage_id').annotate(total=Sum('entries')).order_by()
+    )
+    transitions = {
+        (from_id, to_id): total
+        for from_id, to_id, total in FunnelTransitionDaily.objects.filter(day__range=(start, end))
+        .values_list('from_stage_id', 'to_stage_id').annotate(total=Sum('users')).order_by()
+    }
+
+    stages, previous = [], None
+    for stage in JourneyStage.objects.order_by('order', 'pk').values('id', 'name', 'order'):
+        stage['entries'] = entries.get(stage['id'], 0)
+        if previous is None:
+            stage['converted'] = stage['conversion_rate'] = None
+        else:
+            stage['converted'] = transitions.get((previous['id'], stage['id']), 0)
+            stage['conversion_rate'] = (
+                round(stage['converted'] / previous['entries'], 4) if previous['entries'] else None
+            )
+        stages.append(stage)
+        previous = stage
+
+    return {
+        'start': start,
+        'end': end,
+        'stages': stages,
+        'transitions': [
+            {'from_stage': from_id, 'to_stage': to_id, 'users': total}
+            for (from_id, to_id), total in sorted(transitions.items())
+        ],
+    }
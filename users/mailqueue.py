@@ -0,0 +1,60 @@
+# users/mailqueue.py
+"""
+Outgoing mail queue.
+
+Requests enqueue messages and return immediately; a background thread sends
+everything pending over a single backend connection every
+``MAIL_QUEUE_FLUSH_INTERVAL`` seconds (and once more at exit). Messages stay
+in memory only, so secrets such as temporary passwords are never written to
+the database.
+"""
+import logging
+from collections import deque
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from .activity import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+
+class MailQueue(BackgroundFlusher):
+    def __init__(self, flush_interval=None, batch_size=None):
+        super().__init__()
+        self.flush_interval = flush_interval or getattr(settings, 'MAIL_QUEUE_FLUSH_INTERVAL', 5)
+        self.batch_size = batch_size or getattr(settings, 'MAIL_QUEUE_BATCH_SIZE', 100)
+        self.stats = {'queued': 0, 'sent': 0, 'failed': 0}
+        self._messages = deque()
+
+    def enqueue(self, subject, message, recipient_list, from_email=None):
+        self._ensure_worker()
+        email = EmailMessage(subject, message, from_email or settings.DEFAULT_FROM_EMAIL, recipient_list)
+        with self._lock:
+            self._messages.append(email)
+            self.stats['queued'] += 1
+
+    def flush(self):
+        """Send every queued message. Returns the number sent."""
+        sent = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._messages.popleft() for _ in range(min(self.batch_size, len(self._messages)))]
+                if not batch:
+                    return sent
+                try:
+                    with get_connection() as connection:
+                        count = connection.send_messages(batch) or 0
+                except Exception:
+                    logger.exception("Failed to send %d queued emails", len(batch))
+                    self.stats['failed'] += len(batch)
+                    continue
+                sent += count
+                self.stats['sent'] += count
+
+    def reset_after_fork(self):
+        self._messages = deque()
+
+
+mail_queue = MailQueue()
@@ -0,0 +1,129 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shared.geodata import get_city_data, get_city_database, get_geoname_id_for_ip, get_ip_index
+from users.models import CustomUser
+from users.refdata import reference_data
+
+
+def resolve_ips(rows):
+    """Worker: map (pk, ip) pairs to (pk, city row). Runs in a pool process."""
+    results = []
+    for pk, ip in rows:
+        geoname_id = get_geoname_id_for_ip(ip)
+        city_info = get_city_data(geoname_id) if geoname_id else {}
+        results.append((pk, city_info))
+    return results
+
+
+def split(rows, parts):
+    size = max(1, -(-len(rows) // parts))
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-resolve preferred_currency, preferred_timezone and geolocation for every user "
+        "with a last_known_ip, e.g. after loading a new GeoLite dump. Resumable."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--batch-size', type=int, default=5000, help="Users resolved and written per bulk_update")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per server-side cursor round trip")
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.BASE_DIR, '.backfill_geo.checkpoint'),
+            help="File recording the last user id written",
+        )
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint and start from the first user")
+        parser.add_argument('--dry-run', action='store_true', help="Resolve but do not write users or the checkpoint")
+
+    def handle(self, *args, **options):
+        checkpoint_path = options['checkpoint']
+        last_pk = 0 if options['restart'] else self.read_checkpoint(checkpoint_path)
+        if last_pk:
+            self.stdout.write(f"Resuming after user id {last_pk}")
+
+        # Load the lookup structures before forking so pool workers share them copy-on-write.
+        get_ip_index()
+        get_city_database()
+        reference_data.warm()
+
+        rows = (
+            CustomUser.objects.filter(pk__gt=last_pk, last_known_ip__isnull=False)
+            .order_by('pk')
+            .values_list('pk', 'last_known_ip', 'preferred_currency_id', 'preferred_timezone_id')
+            .iterator(chunk_size=options['chunk_size'])
+        )
+
+        processed = updated = 0
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= options['batch_size']:
+                    updated += self.process_batch(executor, batch, options)
+                    processed += len(batch)
+                    self.report(processed, updated, started)
+                    batch = []
+            if batch:
+                updated += self.process_batch(executor, batch, options)
+                processed += len(batch)
+                self.report(processed, updated, started)
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {processed} users resolved, {updated} updated"))
+
+    def process_batch(self, executor, batch, options):
+        # Keep the current currency/timezone when the new dump cannot resolve one.
+        current = {pk: (currency_id, timezone_id) for pk, _, currency_id, timezone_id in batch}
+        ips = [(pk, ip) for pk, ip, _, _ in batch]
+        users = []
+        for results in executor.map(resolve_ips, split(ips, options['workers'])):
+            for pk, city_info in results:
+                if not city_info:
+                    continue
+                currency_id, timezone_id = current[pk]
+                user = CustomUser(
+                    pk=pk, geolocation=city_info,
+                    preferred_currency_id=currency_id, preferred_timezone_id=timezone_id,
+                )
+                country = reference_data.get_country(code=city_info.get('country_iso_code'))
+                if country and country.currency:
+                    user.preferred_currency = reference_data.get_or_create_currency(country.currency)
+                timezone_name = city_info.get('time_zone')
+                if timezone_name:
+                    user.preferred_timezone = reference_data.get_or_create_timezone(timezone_name)
+                users.append(user)
+
+        if options['dry_run']:
+            return len(users)
+        # bulk_update writes the columns directly: no save(), no per-user signals.
+        CustomUser.objects.bulk_update(
+            users, ['preferred_currency', 'preferred_timezone', 'geolocation'], batch_size=1000
+        )
+        self.write_checkpoint(options['checkpoint'], batch[-1][0])
+        return len(users)
+
+    def report(self, processed, updated, started):
+        rate = processed / max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(f"{processed} users resolved, {updated} updated ({rate:.0f} users/s)")
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as checkpoint:
+                return json.load(checkpoint)['last_pk']
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def write_checkpoint(self, path, last_pk):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as checkpoint:
+            json.dump({'last_pk': last_pk}, checkpoint)
+        os.replace(tmp_path, path)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.mailqueue import mail_queue
+from users.models import CustomUser
+from users.provisioning import parse_csv, parse_json, provision_users
+
+
+class Command(BaseCommand):
+    help = "Create many users at once from a CSV or JSON file (same columns as the add-user form)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSON file; model_permissions is ';'-separated in CSV.")
+        parser.add_argument('--format', choices=['csv', 'json'], help="Defaults to the file extension.")
+        parser.add_argument('--created-by', help="Username to notify about the new accounts.")
+        parser.add_argument('--no-email', action='store_true', help="Do not send welcome emails.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('json' if path.lower().endswith('.json') else 'csv')
+        try:
+            with open(path, 'rb') as handle:
+                rows = parse_json(handle) if file_format == 'json' else parse_csv(handle)
+        except (OSError, ValueError) as exc:
+            raise CommandError(exc)
+
+        created_by = None
+        if options['created_by']:
+            created_by = CustomUser.objects.filter(username=options['created_by']).first()
+            if created_by is None:
+                raise CommandError(f"No user named {options['created_by']!r}")
+
+        result = provision_users(
+            rows, created_by=created_by, send_emails=not options['no_email'], batch_size=options['batch_size'],
+        )
+        for error in result['errors']:
+            self.stderr.write(f"Row {error['row']} ({error['username'] or '-'}): {' '.join(error['errors'])}")
+        sent = mail_queue.flush()
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(result['created'])} users, skipped {len(result['errors'])}, sent {sent} emails"
+        ))
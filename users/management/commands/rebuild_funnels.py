@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from users.funnels import rebuild_funnels
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily funnel rollups (stage entries and transitions) from UserJourney."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        total = rebuild_funnels(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt funnel rollups from {total} journeys"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from users.models import PurchaseRecord
+from users.purchases import rebuild_purchase_summary
+
+
+class Command(BaseCommand):
+    help = "Recompute CustomUser.purchase_summary from PurchaseRecord for every user with history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        user_ids = (
+            PurchaseRecord.objects.order_by('user_id')
+            .values_list('user_id', flat=True)
+            .distinct()
+            .iterator(chunk_size=options['chunk_size'])
+        )
+        rebuilt = 0
+        for user_id in user_ids:
+            rebuild_purchase_summary(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt purchase summaries for {rebuilt} users"))
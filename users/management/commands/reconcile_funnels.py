@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from users.funnels import reconcile_funnels
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the daily funnel rollups from UserJourney and report "
+        "(or fix with --fix) the rows that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Rewrite the drifted rollup rows")
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--show', type=int, default=20, help="Number of drifted rows to print")
+
+    def handle(self, *args, **options):
+        drifted = reconcile_funnels(fix=options['fix'], chunk_size=options['chunk_size'])
+        for table, key, stored, expected in drifted[:options['show']]:
+            self.stdout.write(f"{table} {key}: {stored} -> {expected}")
+
+        summary = f"{len(drifted)} rollup rows drifted"
+        if options['fix']:
+            summary += ", all fixed"
+        self.stdout.write(self.style.SUCCESS(summary) if not drifted or options['fix'] else self.style.WARNING(summary))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from users.audience import rebuild_audience_index, refresh_audience_index
+
+
+class Command(BaseCommand):
+    help = "Apply queued user changes to the audience bitmaps, or rebuild them from scratch with --rebuild."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Recompute every bitmap from CustomUser.")
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            total = rebuild_audience_index(chunk_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt the audience index over {total} users"))
+        else:
+            total = refresh_audience_index(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Refreshed {total} users in the audience index"))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.tracking import rollup_behavior_events
+
+
+class Command(BaseCommand):
+    help = "Roll buffered page views up into CustomUser.visit_count, last_visit and last_page_visited."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50000, help="Events consumed per transaction")
+        parser.add_argument('--settle-seconds', type=int, default=None, help="Ignore events ingested more recently than this")
+        parser.add_argument('--interval', type=int, default=0, help="Keep running, rolling up every N seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            consumed = rollup_behavior_events(batch_size=options['batch_size'], settle_seconds=options['settle_seconds'])
+            self.stdout.write(f"Rolled up {consumed} events in {time.perf_counter() - started:.2f}s")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.segmentation import segment_users
+
+
+class Command(BaseCommand):
+    help = "Recompute RFM segments (CustomUser.segment) for all users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=50000, help="Rows fetched per server-side cursor round trip")
+        parser.add_argument('--write-batch-size', type=int, default=10000, help="Ids per UPDATE statement")
+        parser.add_argument('--dry-run', action='store_true', help="Score users without writing segments")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = segment_users(
+            chunk_size=options['chunk_size'],
+            write_batch_size=options['write_batch_size'],
+            dry_run=options['dry_run'],
+        )
+        elapsed = time.perf_counter() - started
+
+        for segment, count in result['segments'].most_common():
+            self.stdout.write(f"{segment or 'No purchases':<20} {count}")
+        verb = "would change" if options['dry_run'] else "changed"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {result['scored']} users in {elapsed:.1f}s, {verb} {result['changed']}"
+        ))
@@ -1,6 +1,9 @@
 # In a new file like middleware.py
 
 from ipware import get_client_ip
+from .activity import activity_buffer
+from .devices import device_buffer
+from .tracking import track_event
 
 class UpdateUserIPMiddleware:
     def __init__(self, get_response):
@@ -10,7 +13,35 @@ class UpdateUserIPMiddleware:
         response = self.get_response(request)
         if hasattr(request, 'user') and request.user.is_authenticated:
             ip, _ = get_client_ip(request)
-            if ip:
-                request.user.last_known_ip = ip
-                request.user.save(update_fields=['last_known_ip'])
-        return response
\ No newline at end of file
+            # Buffered and coalesced per user; written by activity_buffer.flush()
+            activity_buffer.record(request.user, ip=ip)
+        return response
+
+
+class TrackPageViewMiddleware:
+    """Queue a page_view event for successful GET requests of authenticated users."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            request.method == 'GET'
+            and 200 <= response.status_code < 300
+            and hasattr(request, 'user')
+            and request.user.is_authenticated
+        ):
+            track_event(request.user, 'page_view', request.get_full_path())
+        return response
+
+
+class TrackUserDeviceMiddleware:
+    """Record the requesting device; throttled and coalesced by device_buffer."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if hasattr(request, 'user') and request.user.is_authenticated:
+            device_buffer.record(request.user, request.META.get('HTTP_USER_AGENT', ''))
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_appmodule_remove_customuser_interests_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='country',
+            name='code',
+            field=models.CharField(blank=True, help_text='ISO 3166-1 alpha-2 code, e.g., IN, US', max_length=2, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,151 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:54
+
+import itertools
+import logging
+from operator import itemgetter
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+CENTS = Decimal('0.01')
+# Largest value PurchaseRecord.amount (max_digits=10, decimal_places=2) can hold.
+MAX_AMOUNT = Decimal('99999999.99')
+
+
+def _parse_entry(entry, user_id):
+    """
+    Best-effort read of one legacy purchase_history entry; the raw entry is kept in details.
+
+    Values that cannot be read are logged and left as None, so the caller's
+    defaults apply instead of the migration failing on one bad entry.
+    """
+    if not isinstance(entry, dict):
+        logger.warning("User %s: purchase_history entry is not an object, kept as details only: %r", user_id, entry)
+        return None, None, None
+    amount = None
+    for key in ('amount', 'total', 'price'):
+        if entry.get(key) is not None:
+            try:
+                amount = Decimal(str(entry[key]))
+                if not amount.is_finite():
+                    raise InvalidOperation
+            except InvalidOperation:
+                amount = None
+                logger.warning("User %s: unreadable purchase %s %r, recorded as 0.00", user_id, key, entry[key])
+            else:
+                if abs(amount) > MAX_AMOUNT:
+                    amount = MAX_AMOUNT.copy_sign(amount)
+                    logger.warning("User %s: purchase %s %r is too large, recorded as %s", user_id, key, entry[key], amount)
+                amount = amount.quantize(CENTS, rounding=ROUND_HALF_UP)
+            break
+    purchased_at = None
+    for key in ('purchased_at', 'date', 'timestamp'):
+        if isinstance(entry.get(key), str):
+            try:
+                purchased_at = parse_datetime(entry[key])
+            except ValueError:
+                pass  # well-formed but impossible, e.g. month 13
+            if purchased_at is None:
+                logger.warning("User %s: unreadable purchase %s %r, dated date_joined instead", user_id, key, entry[key])
+            elif django.utils.timezone.is_naive(purchased_at):
+                purchased_at = django.utils.timezone.make_aware(purchased_at)
+            break
+    category = entry.get('category')
+    return amount, purchased_at, str(category)[:100] if category else None
+
+
+def move_purchase_history(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    PurchaseRecord = apps.get_model('users', 'PurchaseRecord')
+    users = CustomUser.objects.exclude(purchase_history=None).values_list('pk', 'purchase_history', 'date_joined')
+    batch = []
+    for pk, history, date_joined in users.iterator(chunk_size=2000):
+        entries = history if isinstance(history, list) else [history]
+        for entry in entries:
+            amount, purchased_at, category = _parse_entry(entry, pk)
+            batch.append(PurchaseRecord(
+                user_id=pk,
+                amount=amount if amount is not None else Decimal('0.00'),
+                purchased_at=purchased_at or date_joined,
+                category=category,
+                details=entry,
+            ))
+        if len(batch) >= 5000:
+            PurchaseRecord.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        PurchaseRecord.objects.bulk_create(batch)
+    build_purchase_summaries(apps)
+
+
+def build_purchase_summaries(apps):
+    """
+    Fill purchase_summary from the copied records, in the format users.purchases
+    maintains: newest records first, and per-category totals.
+    """
+    CustomUser = apps.get_model('users', 'CustomUser')
+    PurchaseRecord = apps.get_model('users', 'PurchaseRecord')
+    recent_limit = getattr(settings, 'PURCHASE_SUMMARY_RECENT', 5)
+    records = PurchaseRecord.objects.order_by('user_id', '-purchased_at', '-pk').values_list(
+        'user_id', 'pk', 'purchased_at', 'category', 'amount',
+    )
+    batch = []
+    for user_id, rows in itertools.groupby(records.iterator(chunk_size=2000), key=itemgetter(0)):
+        recent, totals = [], {}
+        for _, pk, purchased_at, category, amount in rows:
+            if len(recent) < recent_limit:
+                recent.append({
+                    'id': pk, 'purchased_at': purchased_at.isoformat(), 'category': category,
+                    'amount': str(amount.quantize(CENTS)),
+                })
+            key = category or 'Uncategorized'
+            totals[key] = totals.get(key, Decimal('0')) + amount
+        summary = {'recent': recent, 'category_totals': {key: str(total.quantize(CENTS)) for key, total in totals.items()}}
+        batch.append(CustomUser(pk=user_id, purchase_summary=summary))
+        if len(batch) >= 1000:
+            CustomUser.objects.bulk_update(batch, ['purchase_summary'])
+            batch = []
+    if batch:
+        CustomUser.objects.bulk_update(batch, ['purchase_summary'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0003_remove_rolepermission_role_and_more'),
+        ('users', '0004_country_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='purchase_summary',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='PurchaseRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purchased_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('category', models.CharField(blank=True, max_length=100, null=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('details', models.JSONField(blank=True, null=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='purchase_records', to='shared.order')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='purchase_records', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'purchased_at'], name='purchase_user_date_idx')],
+            },
+        ),
+        migrations.RunPython(move_purchase_history, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='purchase_history',
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:56
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_purchase_history_records'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BehaviorRollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BehaviorEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('page_view', 'Page view'), ('click', 'Click')], max_length=20)),
+                ('url', models.CharField(blank=True, max_length=2048)),
+                ('occurred_at', models.DateTimeField()),
+                ('ingested_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('metadata', models.JSONField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='behavior_events', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
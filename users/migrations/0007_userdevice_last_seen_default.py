@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:59
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_behavior_events'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userdevice',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
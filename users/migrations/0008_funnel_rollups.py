@@ -0,0 +1,39 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_userdevice_last_seen_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FunnelStageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('entries', models.PositiveIntegerField(default=0)),
+                ('stage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_entries', to='users.journeystage')),
+            ],
+            options={
+                'unique_together': {('day', 'stage')},
+            },
+        ),
+        migrations.CreateModel(
+            name='FunnelTransitionDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('users', models.PositiveIntegerField(default=0)),
+                ('from_stage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.journeystage')),
+                ('to_stage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.journeystage')),
+            ],
+            options={
+                'unique_together': {('day', 'from_stage', 'to_stage')},
+            },
+        ),
+    ]
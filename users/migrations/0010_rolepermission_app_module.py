@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_audience_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rolepermission',
+            name='app_module',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='users.appmodule'),
+        ),
+    ]
@@ -9,7 +9,9 @@ from django.conf import settings
 import os
 import csv
 from ipware import get_client_ip
-from shared.geodata import get_city_data
+from shared.geodata import get_city_data, get_geoname_id_for_ip
+from .refdata import reference_data
+from .fieldtracking import DirtyFieldsMixin, save_stats
 
 # Constants for choices
 GENDER_CHOICES = (
@@ -47,6 +49,7 @@ HOUSING_CHOICES = (
 
 class Country(models.Model):
     name = models.CharField(max_length=100, unique=True)
+    code = models.CharField(max_length=2, unique=True, null=True, blank=True, help_text="ISO 3166-1 alpha-2 code, e.g., IN, US")
     currency = models.CharField(max_length=3)  # e.g., USD, INR
     default_timezone = models.CharField(max_length=100, help_text="Default timezone for this country")
     
@@ -136,7 +139,7 @@ class CustomUserManager(BaseUserManager):
         extra_fields.setdefault('is_superuser', True)
         return self.create_user(username, password, **extra_fields)
 
-class CustomUser(AbstractUser):
+class CustomUser(DirtyFieldsMixin, AbstractUser):
     USER_TYPE_CHOICES = (
         ('admin', 'Admin'),
         ('vendor', 'Vendor'),
@@ -165,7 +168,8 @@ class CustomUser(AbstractUser):
     last_page_visited = models.URLField(null=True, blank=True)
     visit_count = models.IntegerField(default=0)
     last_visit = models.DateTimeField(null=True, blank=True)
-    purchase_history = models.JSONField(null=True, blank=True)
+    # Rolling summary only (recent purchases, per-category totals); full history lives in PurchaseRecord
+    purchase_summary = models.JSONField(null=True, blank=True)
 
     # RFM Metrics for Segmentation
     last_purchase_date = models.DateTimeField(null=True, blank=True)
@@ -185,12 +189,15 @@ class CustomUser(AbstractUser):
     
     objects = CustomUserManager()
 
-    def update_geo_info(self, ip):
+    # IP whose geo data has already been applied to this instance.
+    _geo_resolved_ip = None
+
+    def resolve_geo_info(self, ip):
         """
-        Update user's currency and timezone based on their IP address using CSV data.
+        Set user's currency and timezone from their IP address, without saving.
         """
         try:
-            geoname_id = self.get_geoname_id_from_ip(ip)  # You need to implement this method
+            geoname_id = self.get_geoname_id_from_ip(ip)
             city_info = get_city_data(geoname_id)
             
             if city_info:
@@ -198,16 +205,12 @@ class CustomUser(AbstractUser):
                 timezone_name = city_info.get('time_zone')
                 
                 if country_code:
-                    country, created = Country.objects.get_or_create(code=country_code)
-                    currency, created = Currency.objects.get_or_create(code=country.currency)
-                    self.preferred_currency = currency
+                    country = reference_data.get_country(code=country_code)
+                    if country and country.currency:
+                        self.preferred_currency = reference_data.get_or_create_currency(country.currency)
                 
                 if timezone_name:
-                    timezone_obj, created = Timezone.objects.get_or_create(name=timezone_name)
-                    self.preferred_timezone = timezone_obj
-                
-                self.last_known_ip = ip
-                self.save()
+                    self.preferred_timezone = reference_data.get_or_create_timezone(timezone_name)
                 return True
             else:
                 print(f"No location data found for IP: {ip}")
@@ -216,9 +219,29 @@ class CustomUser(AbstractUser):
             print(f"Error updating geo info: {e}")
             return False
 
+    def update_geo_info(self, ip):
+        """
+        Update user's currency and timezone based on their IP address and save.
+        """
+        if not self.resolve_geo_info(ip):
+            return False
+        self.last_known_ip = ip
+        self._geo_resolved_ip = ip
+        self.save()
+        return True
+
     def save(self, *args, **kwargs):
-        if self.last_known_ip and self.last_known_ip != self.get_client_ip():
-            self.update_geo_info(self.get_client_ip())
+        # Geo data only depends on the IP, so re-resolve it only when the IP changed.
+        ip = self.last_known_ip
+        if ip and ip != self._geo_resolved_ip and self.has_changed('last_known_ip'):
+            self.resolve_geo_info(ip)
+            save_stats[self._meta.label]['geo_resolved'] += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'last_known_ip' in update_fields:
+                kwargs['update_fields'] = {*update_fields, 'preferred_currency', 'preferred_timezone'}
+        elif ip:
+            save_stats[self._meta.label]['geo_skipped'] += 1
+        self._geo_resolved_ip = ip
         super().save(*args, **kwargs)
 
     def get_client_ip(self):
@@ -228,25 +251,84 @@ class CustomUser(AbstractUser):
         return ip
 
     def get_geoname_id_from_ip(self, ip):
-        blocks_csv_path = os.path.join(settings.BASE_DIR, 'shared', 'Geocity', 'blocks.csv')  # Assuming you have this CSV
-        with open(blocks_csv_path, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if self.ip_in_range(ip, row['network']):
-                    return row['geoname_id']
-        return None
+        # Binary search over the in-memory range index built from blocks.csv
+        return get_geoname_id_for_ip(ip)
 
     def ip_in_range(self, ip, network):
         import ipaddress
         return ipaddress.ip_address(ip) in ipaddress.ip_network(network)
 
 
+class PurchaseRecord(models.Model):
+    """Append-only purchase history, one row per purchase (or per category of an order)."""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='purchase_records')
+    order = models.ForeignKey('shared.Order', on_delete=models.SET_NULL, null=True, blank=True, related_name='purchase_records')
+    purchased_at = models.DateTimeField(default=timezone.now)
+    category = models.CharField(max_length=100, null=True, blank=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    details = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'purchased_at'], name='purchase_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.amount} on {self.purchased_at:%Y-%m-%d}"
+
+class BehaviorEvent(models.Model):
+    """Raw page views / clicks, written in batches by users.tracking and rolled up into CustomUser."""
+    EVENT_TYPE_CHOICES = (
+        ('page_view', 'Page view'),
+        ('click', 'Click'),
+    )
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='behavior_events')
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPE_CHOICES)
+    url = models.CharField(max_length=2048, blank=True)
+    occurred_at = models.DateTimeField()
+    ingested_at = models.DateTimeField(default=timezone.now)
+    metadata = models.JSONField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id} {self.event_type} {self.url}"
+
+class BehaviorRollupState(models.Model):
+    """High-water mark of BehaviorEvent ids already rolled up into CustomUser."""
+    name = models.CharField(max_length=50, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_event_id}"
+
+class AudienceBitmap(models.Model):
+    """Compressed bitmap of the user ids having ``attribute == value``. Maintained by users.audience."""
+    attribute = models.CharField(max_length=50)
+    value = models.CharField(max_length=255)
+    bitmap = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        unique_together = ('attribute', 'value')
+
+    def __str__(self):
+        return f"{self.attribute}={self.value}"
+
+class AudienceChange(models.Model):
+    """User ids whose audience attributes changed since the last index refresh."""
+    user_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return str(self.user_id)
+
 class UserDevice(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     device_type = models.CharField(max_length=20, choices=DEVICE_TYPE_CHOICES)
     browser = models.CharField(max_length=50, null=True, blank=True)
     operating_system = models.CharField(max_length=50, null=True, blank=True)
-    last_seen = models.DateTimeField(auto_now=True)
+    # Written by users.devices.device_buffer, throttled per device.
+    last_seen = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return f"{self.user.username}'s {self.device_type}"
@@ -271,6 +353,31 @@ class UserJourney(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.stage.name}"
 
+class FunnelStageDaily(models.Model):
+    """Number of users who entered ``stage`` on ``day``. Maintained by users.funnels."""
+    day = models.DateField()
+    stage = models.ForeignKey(JourneyStage, on_delete=models.CASCADE, related_name='daily_entries')
+    entries = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'stage')
+
+    def __str__(self):
+        return f"{self.day} {self.stage_id}: {self.entries}"
+
+class FunnelTransitionDaily(models.Model):
+    """Users who entered ``to_stage`` on ``day`` after having entered ``from_stage``."""
+    day = models.DateField()
+    from_stage = models.ForeignKey(JourneyStage, on_delete=models.CASCADE, related_name='+')
+    to_stage = models.ForeignKey(JourneyStage, on_delete=models.CASCADE, related_name='+')
+    users = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'from_stage', 'to_stage')
+
+    def __str__(self):
+        return f"{self.day} {self.from_stage_id}->{self.to_stage_id}: {self.users}"
+
 class VendorManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset().filter(user_type='vendor')
@@ -345,6 +452,11 @@ class AppModule(models.Model):
     def __str__(self):
         return self.name
 
+    def get_permissions(self):
+        if self.is_full_app:
+            return Permission.objects.filter(content_type__app_label=self.app_label)
+        return Permission.objects.filter(appmodulepermission__module=self)
+
 class AppModulePermission(models.Model):
     module = models.ForeignKey(AppModule, on_delete=models.CASCADE, related_name='permissions')
     permission = models.ForeignKey(Permission, on_delete=models.CASCADE)
@@ -363,6 +475,8 @@ class Role(models.Model):
 class RolePermission(models.Model):
     role = models.ForeignKey(Role, on_delete=models.CASCADE)
     permission = models.ForeignKey(Permission, on_delete=models.CASCADE)
+    # Set when the permission was granted through an app module; full-app grants also cover permissions added later.
+    app_module = models.ForeignKey(AppModule, on_delete=models.CASCADE, null=True, blank=True)
 
     def __str__(self):
         return f"{self.role.name} - {self.permission.name}"
@@ -0,0 +1,243 @@
+# users/permissions.py
+"""
+Compiled role permissions.
+
+A user's effective permissions at a vendor are the permissions of every Role
+assigned to them there through UserRole, where a role granted a full-app
+AppModule holds every permission of that app. ``effective_permissions``
+compiles them into a frozenset of ``"app_label.codename"`` strings and
+caches it both per process and in the shared cache.
+
+Entries are keyed by a version counter in the shared cache, bumped whenever a
+Role, RolePermission, UserRole, AppModule or AppModulePermission changes.
+Processes read the counter at most every ``PERMISSION_VERSION_CHECK_INTERVAL``
+seconds, so in the common case ``has_perm`` is a dict lookup and a set probe,
+and a revocation reaches every worker within that interval. This relies on the
+default cache being shared between processes (see shared/checks.py).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from rest_framework.permissions import BasePermission
+
+VERSION_KEY = 'users:permissions:version'
+CACHE_KEY = 'users:permissions:{version}:{user_id}:{vendor_id}'
+
+# Changes to any of these can change someone's effective permissions.
+WATCHED_MODELS = ('Role', 'RolePermission', 'UserRole', 'AppModule', 'AppModulePermission')
+
+
+def bump_version():
+    """Invalidate every compiled permission set, in every process."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        if not cache.add(VERSION_KEY, 1, timeout=None):
+            cache.incr(VERSION_KEY)
+    permission_cache.invalidate()
+
+
+def compile_permissions(user_id, vendor_id):
+    """Read a user's effective permissions at a vendor from the database (at most two queries)."""
+    RolePermission = apps.get_model('users', 'RolePermission')
+    Permission = apps.get_model('auth', 'Permission')
+
+    # One filter() call, so both conditions apply to the same UserRole row.
+    grants = RolePermission.objects.filter(role__userrole__user_id=user_id, role__userrole__vendor_id=vendor_id)
+    permissions, full_apps = set(), set()
+    rows = grants.values_list(
+        'permission__content_type__app_label', 'permission__codename',
+        'app_module__is_full_app', 'app_module__app_label',
+    ).distinct()
+    for app_label, codename, is_full_app, module_app_label in rows:
+        permissions.add(f'{app_label}.{codename}')
+        if is_full_app:
+            full_apps.add(module_app_label)
+    if full_apps:
+        permissions.update(
+            f'{app_label}.{codename}'
+            for app_label, codename in Permission.objects.filter(content_type__app_label__in=full_apps)
+            .values_list('content_type__app_label', 'codename')
+        )
+    return frozenset(permissions)
+
+
+class PermissionCache:
+    def __init__(self, max_entries=None, check_interval=None, timeout=None):
+        self.max_entries = max_entries or getattr(settings, 'PERMISSION_CACHE_SIZE', 10000)
+        self.check_interval = check_interval if check_interval is not None else getattr(
+            settings, 'PERMISSION_VERSION_CHECK_INTERVAL', 5
+        )
+        self.timeout = timeout or getattr(settings, 'PERMISSION_CACHE_TIMEOUT', 3600)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self._checked_at = 0.0
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'compiled': 0}
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._checked_at = 0.0
+
+    def _current_version(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return self._version
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, 1, timeout=None)
+            version = cache.get(VERSION_KEY, 1)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._checked_at = now
+        return version
+
+    def get(self, user_id, vendor_id):
+        version = self._current_version()
+        key = (user_id, vendor_id)
+        with self._lock:
+            permissions = self._entries.get(key)
+            if permissions is not None:
+                self._entries.move_to_end(key)
+                self.stats['local_hits'] += 1
+                return permissions
+
+        shared_key = CACHE_KEY.format(version=version, user_id=user_id, vendor_id=vendor_id)
+        permissions = cache.get(shared_key)
+        if permissions is None:
+            permissions = compile_permissions(user_id, vendor_id)
+            cache.set(shared_key, permissions, self.timeout)
+            self.stats['compiled'] += 1
+        else:
+            self.stats['shared_hits'] += 1
+
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = permissions
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return permissions
+
+
+permission_cache = PermissionCache()
+
+
+def effective_permissions(user_id, vendor_id):
+    """A user's permissions at ``vendor_id``; none at all when the vendor is unknown."""
+    if vendor_id is None:
+        return frozenset()
+    return permission_cache.get(user_id, vendor_id)
+
+
+def vendor_id_for(obj):
+    """The vendor an object belongs to, for object-level checks."""
+    if obj is None:
+        return None
+    if isinstance(obj, apps.get_model('users', 'Vendor')):
+        return obj.pk
+    return getattr(obj, 'vendor_id', None)
+
+
+class RolePermissionBackend:
+    """
+    Auth backend answering has_perm() from the compiled role permissions.
+
+    Pass the vendor (or any object with ``vendor_id``) as ``obj`` to check
+    permissions at that vendor. Roles only grant anything at their own vendor,
+    so checks without one (admin, DjangoModelPermissions) get nothing from here.
+    """
+
+    def authenticate(self, request, **credentials):
+        return None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous:
+            return set()
+        return effective_permissions(user_obj.pk, vendor_id_for(obj))
+
+    def has_perm(self, user_obj, perm, obj=None):
+        return perm in self.get_all_permissions(user_obj, obj)
+
+    def has_module_perms(self, user_obj, app_label):
+        prefix = f'{app_label}.'
+        return any(perm.startswith(prefix) for perm in self.get_all_permissions(user_obj))
+
+
+class HasRolePermission(BasePermission):
+    """
+    DRF permission requiring every codename in ``view.required_permissions``.
+
+    The vendor comes from ``view.get_permission_vendor_id()`` when defined,
+    else from a ``vendor_id`` / ``vendor_pk`` URL kwarg; object checks use the
+    object's vendor. Without a vendor only superusers pass.
+    """
+
+    def _required(self, view):
+        return getattr(view, 'required_permissions', ())
+
+    def _allowed(self, user, view, vendor_id):
+        if not user or not user.is_authenticated or not user.is_active:
+            return False
+        if user.is_superuser:
+            return True
+        return vendor_id is not None and effective_permissions(user.pk, vendor_id).issuperset(self._required(view))
+
+    def has_permission(self, request, view):
+        getter = getattr(view, 'get_permission_vendor_id', None)
+        vendor_id = getter() if getter else view.kwargs.get('vendor_id', view.kwargs.get('vendor_pk'))
+        return self._allowed(request.user, view, vendor_id)
+
+    def has_object_permission(self, request, view, obj):
+        return self._allowed(request.user, view, vendor_id_for(obj))
+
+
+# Per thread and database alias: the bump shared by the callbacks of the open transaction.
+_pending = threading.local()
+
+
+def schedule_version_bump(using=None):
+    """Bump the version once the current transaction commits, or right away in autocommit mode."""
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        bump_version()
+        return
+    # Every call registers its own callback, so a rollback can't swallow a later transaction's
+    # bump; the callbacks of one commit share a token and only the first of them bumps.
+    token = getattr(_pending, connection.alias, None)
+    if token is None:
+        token = {'done': False}
+        setattr(_pending, connection.alias, token)
+
+    def bump():
+        if getattr(_pending, connection.alias, None) is token:
+            delattr(_pending, connection.alias)
+        if not token['done']:
+            token['done'] = True
+            bump_version()
+
+    transaction.on_commit(bump, using=using)
+
+
+def _bump_on_commit(sender, **kwargs):
+    # Bulk deletes send one signal per row; they still cause a single bump.
+    schedule_version_bump(kwargs.get('using'))
+
+
+def connect_signals():
+    for model_name in WATCHED_MODELS:
+        model = apps.get_model('users', model_name)
+        post_save.connect(_bump_on_commit, sender=model, dispatch_uid=f'users_permissions_save_{model_name}')
+        post_delete.connect(_bump_on_commit, sender=model, dispatch_uid=f'users_permissions_delete_{model_name}')
+    # Full-app modules expand by app label, so new Permission rows matter too.
+    Permission = apps.get_model('auth', 'Permission')
+    post_save.connect(_bump_on_commit, sender=Permission, dispatch_uid='users_permissions_save_Permission')
+    post_delete.connect(_bump_on_commit, sender=Permission, dispatch_uid='users_permissions_delete_Permission')
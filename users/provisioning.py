@@ -0,0 +1,274 @@
+# users/provisioning.py
+"""
+Bulk staff provisioning.
+
+``provision_users`` takes rows shaped like the AddUserView form (username,
+email, names, country/state/city names and model names for permissions) and
+creates every valid row in one pass:
+
+* countries, states, cities, permissions and location groups are resolved
+  with one query each for the whole batch;
+* temporary passwords are hashed in a thread pool (the hashers release the
+  GIL), then users, permission links and group links are written with
+  bulk_create in a single transaction;
+* welcome emails go to the mail queue instead of being sent inline.
+
+Invalid rows are skipped and reported with their errors.
+"""
+import csv
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, transaction
+from django.db.models.functions import Lower
+from django.utils.crypto import get_random_string
+
+from .audience import queue_audience_refresh
+from .mailqueue import mail_queue
+from .refdata import reference_data
+
+FIELDS = ('username', 'email', 'first_name', 'last_name', 'phone', 'user_type', 'country', 'state', 'city', 'model_permissions')
+
+# Cleaned with the model field, as AddUserView's form did: username characters and every max_length.
+VALIDATED_FIELDS = ('username', 'email', 'first_name', 'last_name', 'phone')
+
+
+def parse_csv(data):
+    """Rows from CSV text or a binary/text file. ``model_permissions`` is ';'-separated."""
+    if hasattr(data, 'read'):
+        data = data.read()
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    return [dict(row) for row in csv.DictReader(io.StringIO(data))]
+
+
+def parse_json(data):
+    """Rows from a JSON list, or an object with a ``users`` list."""
+    if hasattr(data, 'read'):
+        data = data.read()
+    rows = json.loads(data) if isinstance(data, (str, bytes)) else data
+    if isinstance(rows, dict):
+        rows = rows.get('users', [])
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError("Expected a list of user objects.")
+    return rows
+
+
+def _clean(value):
+    return value.strip() if isinstance(value, str) else value
+
+
+def _model_names(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(';')
+    return [name.strip().lower() for name in value if name and name.strip()]
+
+
+def _field_errors(row):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    errors = []
+    for name in VALIDATED_FIELDS:
+        if row[name]:
+            try:
+                CustomUser._meta.get_field(name).clean(row[name], None)
+            except ValidationError as exc:
+                errors += [f"{name}: {message}" for message in exc.messages]
+    return errors
+
+
+def _hash_passwords(passwords):
+    workers = getattr(settings, 'PROVISIONING_HASH_WORKERS', None) or os.cpu_count() or 1
+    if len(passwords) < 2 or workers < 2:
+        return [make_password(password) for password in passwords]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(make_password, passwords))
+
+
+class _Lookups:
+    """Everything the batch refers to by name, fetched with one query per table."""
+
+    def __init__(self, rows):
+        State = apps.get_model('users', 'State')
+        City = apps.get_model('users', 'City')
+
+        self.countries = {}
+        for row in rows:
+            name = row.get('country')
+            if name and name.lower() not in self.countries:
+                self.countries[name.lower()] = reference_data.get_country(name=name)
+
+        # Names match case-insensitively, like countries: rows and stored names are both lowercased.
+        state_names = {row['state'].lower() for row in rows if row.get('state')}
+        country_ids = {country.pk for country in self.countries.values() if country}
+        self.states = {
+            (state.country_id, state.name.lower()): state
+            for state in State.objects.annotate(lower_name=Lower('name'))
+            .filter(country_id__in=country_ids, lower_name__in=state_names)
+        }
+        city_names = {row['city'].lower() for row in rows if row.get('city')}
+        self.cities = {
+            (city.state_id, city.name.lower()): city
+            for city in City.objects.annotate(lower_name=Lower('name'))
+            .filter(state__in=list(self.states.values()), lower_name__in=city_names)
+        }
+
+        models = {name for row in rows for name in _model_names(row.get('model_permissions'))}
+        self.permissions = {}
+        for pk, model in Permission.objects.filter(content_type__model__in=models).values_list('pk', 'content_type__model'):
+            self.permissions.setdefault(model, []).append(pk)
+
+    def location(self, row):
+        """(country, state, city, errors) for a row, mirroring AddUserView's name lookups."""
+        errors = []
+        country = state = city = None
+        if row.get('country'):
+            country = self.countries.get(row['country'].lower())
+            if country is None:
+                errors.append(f"Unknown country {row['country']!r}.")
+        if row.get('state') and not errors:
+            state = self.states.get((country.pk if country else None, row['state'].lower()))
+            if state is None:
+                errors.append(f"Unknown state {row['state']!r}.")
+        if row.get('city') and not errors:
+            city = self.cities.get((state.pk if state else None, row['city'].lower()))
+            if city is None:
+                errors.append(f"Unknown city {row['city']!r}.")
+        return country, state, city, errors
+
+
+def provision_users(rows, created_by=None, send_emails=True, batch_size=500):
+    """
+    Create users from ``rows``. Returns {'created': [usernames], 'errors': [{'row', 'username', 'errors'}]}.
+    """
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Notification = apps.get_model('shared', 'Notification')
+
+    rows = [{key: _clean(row.get(key)) for key in FIELDS} for row in rows]
+    lookups = _Lookups(rows)
+    existing = set(
+        CustomUser.objects.filter(username__in=[row['username'] for row in rows if row['username']])
+        .values_list('username', flat=True)
+    )
+
+    user_types = dict(CustomUser.USER_TYPE_CHOICES)
+    errors, pending, row_numbers, seen = [], [], [], set()
+    for index, row in enumerate(rows, start=1):
+        row_errors = []
+        username, email = row['username'], row['email']
+        if not username:
+            row_errors.append("username is required.")
+        elif username in existing or username in seen:
+            row_errors.append(f"username {username!r} is already taken.")
+        if not email:
+            row_errors.append("email is required.")
+        row_errors += _field_errors(row)
+        if row['user_type'] and row['user_type'] not in user_types:
+            row_errors.append(f"Unknown user_type {row['user_type']!r}.")
+        country, state, city, location_errors = lookups.location(row)
+        row_errors += location_errors
+        models = _model_names(row['model_permissions'])
+        unknown = [model for model in models if model not in lookups.permissions]
+        if unknown:
+            row_errors.append(f"Unknown models for permissions: {', '.join(unknown)}.")
+        if row_errors:
+            errors.append({'row': index, 'username': username, 'errors': row_errors})
+            continue
+        seen.add(username)
+        pending.append((row, country, state, city, models))
+        row_numbers.append(index)
+
+    created = []
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        try:
+            created += _create_batch(batch, lookups, created_by, send_emails)
+        except (IntegrityError, DataError):
+            # Someone took a username after validation; insert one by one to report just those rows.
+            for index, item in zip(row_numbers[start:start + batch_size], batch):
+                try:
+                    created += _create_batch([item], lookups, created_by, send_emails)
+                except (IntegrityError, DataError) as exc:
+                    username = item[0]['username']
+                    message = (
+                        f"username {username!r} is already taken."
+                        if CustomUser.objects.filter(username=username).exists() else f"Could not be created: {exc}"
+                    )
+                    errors.append({'row': index, 'username': username, 'errors': [message]})
+    errors.sort(key=lambda error: error['row'])
+
+    if created and created_by is not None:
+        Notification.objects.create(user=created_by, message=f"{len(created)} new users added.")
+    return {'created': [user.username for user in created], 'errors': errors}
+
+
+def _create_batch(pending, lookups, created_by, send_emails):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Notification = apps.get_model('shared', 'Notification')
+
+    temp_passwords = [get_random_string(length=10) for _ in pending]
+    hashed = _hash_passwords(temp_passwords)
+    users = [
+        CustomUser(
+            username=row['username'], email=row['email'],
+            first_name=row['first_name'] or '', last_name=row['last_name'] or '',
+            phone=row['phone'] or None, user_type=row['user_type'] or 'vendor',
+            country=country, state=state, city=city, password=password,
+        )
+        for (row, country, state, city, _), password in zip(pending, hashed)
+    ]
+
+    with transaction.atomic():
+        users = CustomUser.objects.bulk_create(users)
+        if any(user.pk is None for user in users):
+            # Backends that cannot return ids from a bulk insert.
+            ids = dict(CustomUser.objects.filter(username__in=[user.username for user in users]).values_list('username', 'pk'))
+            for user in users:
+                user.pk = ids[user.username]
+
+        group_names = {_location_group_name(country, state) for _, country, state, _, _ in pending if country}
+        Group.objects.bulk_create([Group(name=name) for name in group_names], ignore_conflicts=True)
+        groups = dict(Group.objects.filter(name__in=group_names).values_list('name', 'pk'))
+
+        PermissionLink = CustomUser.user_permissions.through
+        GroupLink = CustomUser.groups.through
+        permission_links, group_links = [], []
+        for user, (_, country, state, _, models) in zip(users, pending):
+            permission_ids = {pk for model in models for pk in lookups.permissions[model]}
+            permission_links += [PermissionLink(customuser_id=user.pk, permission_id=pk) for pk in permission_ids]
+            if country:
+                group_links.append(GroupLink(customuser_id=user.pk, group_id=groups[_location_group_name(country, state)]))
+        PermissionLink.objects.bulk_create(permission_links, batch_size=1000)
+        GroupLink.objects.bulk_create(group_links, batch_size=1000)
+
+        Notification.objects.bulk_create([
+            Notification(user=user, message='Your vendor account has been created. Use the temporary password to login.')
+            for user in users
+        ])
+        # bulk_create skips the save() signals that keep the audience index current.
+        queue_audience_refresh([user.pk for user in users])
+
+        if send_emails:
+            transaction.on_commit(lambda: _queue_welcome_emails(users, temp_passwords))
+    return users
+
+
+def _queue_welcome_emails(users, temp_passwords):
+    for user, temp_password in zip(users, temp_passwords):
+        mail_queue.enqueue(
+            subject='Your Temporary Password',
+            message=f'Your temporary password is: {temp_password}. Please change it upon first login.',
+            recipient_list=[user.email],
+        )
+
+
+def _location_group_name(country, state):
+    return f"{country.name}_{state.name}" if state else country.name
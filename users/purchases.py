@@ -0,0 +1,146 @@
+# users/purchases.py
+"""
+Purchase history helpers.
+
+Every purchase is appended to PurchaseRecord (indexed on user + purchased_at).
+CustomUser.purchase_summary keeps only a small rolling view of it:
+
+    {"recent": [{"id", "purchased_at", "category", "amount"}, ...],   # newest first
+     "category_totals": {"<category>": "<decimal>"}}
+
+Amounts are what the user paid, tax and commission included: the same basis as
+CustomUser.total_spent, so an order's records add up to its total_amount. An
+order's total is split across its item categories in proportion to their item
+subtotals (``split_amount``). Records migrated from the legacy purchase_history
+JSON keep the amounts stored there.
+"""
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+UNCATEGORIZED = 'Uncategorized'
+CENTS = Decimal('0.01')
+
+
+def _money(value):
+    return Decimal(str(value or 0)).quantize(CENTS)
+
+
+def split_amount(total, weights):
+    """
+    Split ``total`` in proportion to ``weights``, to the cent, so the parts add up
+    to ``total`` exactly; the leftover cents go to the largest remainders.
+    """
+    weights = [Decimal(str(weight or 0)) for weight in weights]
+    whole = sum(weights)
+    if not weights or whole <= 0 or any(weight < 0 for weight in weights):
+        raise ValueError("weights must be non-negative and add up to more than zero.")
+    total = _money(total)
+    cents = int(abs(total) / CENTS)
+    shares = [cents * weight / whole for weight in weights]
+    parts = [int(share) for share in shares]
+    by_remainder = sorted(range(len(shares)), key=lambda index: shares[index] - parts[index], reverse=True)
+    for index in by_remainder[:cents - sum(parts)]:
+        parts[index] += 1
+    return [(part * CENTS).copy_sign(total) for part in parts]
+
+
+def recent_purchase_limit():
+    return getattr(settings, 'PURCHASE_SUMMARY_RECENT', 5)
+
+
+def _summary_entry(record):
+    return {
+        'id': record.pk,
+        'purchased_at': record.purchased_at.isoformat(),
+        'category': record.category,
+        'amount': str(_money(record.amount)),
+    }
+
+
+def _apply_to_summary(summary, records):
+    summary = dict(summary or {})
+    recent = [_summary_entry(record) for record in records] + list(summary.get('recent', []))
+    recent.sort(key=lambda entry: entry['purchased_at'], reverse=True)
+    summary['recent'] = recent[:recent_purchase_limit()]
+
+    totals = dict(summary.get('category_totals', {}))
+    for record in records:
+        key = record.category or UNCATEGORIZED
+        totals[key] = str(_money(totals.get(key)) + _money(record.amount))
+    summary['category_totals'] = totals
+    return summary
+
+
+def record_purchases(user_id, purchases, order=None):
+    """
+    Append purchases for one user and fold them into the rolling summary.
+
+    ``purchases`` is an iterable of dicts with ``amount`` and optionally
+    ``category``, ``purchased_at`` and ``details``. The user row is locked only
+    for the summary update, inside the same transaction as the inserts.
+    """
+    PurchaseRecord = apps.get_model('users', 'PurchaseRecord')
+    CustomUser = apps.get_model('users', 'CustomUser')
+    now = timezone.now()
+    records = [
+        PurchaseRecord(
+            user_id=user_id,
+            order=order,
+            amount=purchase['amount'],
+            category=purchase.get('category'),
+            purchased_at=purchase.get('purchased_at') or now,
+            details=purchase.get('details'),
+        )
+        for purchase in purchases
+    ]
+    if not records:
+        return []
+    with transaction.atomic():
+        PurchaseRecord.objects.bulk_create(records)
+        summary = (
+            CustomUser.objects.select_for_update()
+            .filter(pk=user_id)
+            .values_list('purchase_summary', flat=True)
+            .first()
+        )
+        CustomUser.objects.filter(pk=user_id).update(purchase_summary=_apply_to_summary(summary, records))
+    return records
+
+
+def record_purchase(user, amount, category=None, purchased_at=None, details=None, order=None):
+    return record_purchases(
+        user.pk,
+        [{'amount': amount, 'category': category, 'purchased_at': purchased_at, 'details': details}],
+        order=order,
+    )[0]
+
+
+def rebuild_purchase_summary(user_id):
+    """Recompute the summary from PurchaseRecord (two indexed queries)."""
+    PurchaseRecord = apps.get_model('users', 'PurchaseRecord')
+    CustomUser = apps.get_model('users', 'CustomUser')
+    history = PurchaseRecord.objects.filter(user_id=user_id)
+    recent = history.order_by('-purchased_at', '-pk')[:recent_purchase_limit()]
+    totals = history.values_list('category').annotate(total=Sum('amount')).order_by()
+    summary = {
+        'recent': [_summary_entry(record) for record in recent],
+        'category_totals': {category or UNCATEGORIZED: str(_money(total)) for category, total in totals},
+    }
+    CustomUser.objects.filter(pk=user_id).update(purchase_summary=summary)
+    return summary
+
+
+def purchase_history(user_id, start=None, end=None):
+    """History for one user, newest first, as an index range scan on (user, purchased_at)."""
+    PurchaseRecord = apps.get_model('users', 'PurchaseRecord')
+    history = PurchaseRecord.objects.filter(user_id=user_id)
+    if start is not None:
+        history = history.filter(purchased_at__gte=start)
+    if end is not None:
+        history = history.filter(purchased_at__lt=end)
+    return history.order_by('-purchased_at', '-pk')
@@ -0,0 +1,157 @@
+# users/refdata.py
+"""
+Process-local cache for the small reference tables: Country, Currency, Timezone.
+
+Each worker loads the three tables once and serves lookups from dicts keyed by
+code and name. Saves and deletes bump a version number in the shared Django
+cache; workers compare against it at most every ``REFDATA_VERSION_CHECK_INTERVAL``
+seconds and reload when it moved, so every node converges without polling the
+database. Cached instances are shared between requests - treat them as read-only.
+"""
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+VERSION_KEY = 'users:refdata:version'
+
+
+def bump_version():
+    """Invalidate the reference data cache in every process."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        if not cache.add(VERSION_KEY, 1, timeout=None):
+            cache.incr(VERSION_KEY)
+    reference_data.invalidate()
+
+
+class ReferenceDataCache:
+    def __init__(self, check_interval=None):
+        self.check_interval = check_interval if check_interval is not None else getattr(
+            settings, 'REFDATA_VERSION_CHECK_INTERVAL', 5
+        )
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+            self._checked_at = 0.0
+
+    def _shared_version(self):
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, 1, timeout=None)
+            version = cache.get(VERSION_KEY, 1)
+        return version
+
+    def _load(self):
+        Country = apps.get_model('users', 'Country')
+        Currency = apps.get_model('users', 'Currency')
+        Timezone = apps.get_model('users', 'Timezone')
+
+        countries = list(Country.objects.order_by('name'))
+        currencies = list(Currency.objects.order_by('code'))
+        timezones = list(Timezone.objects.order_by('name'))
+        return {
+            'countries': countries,
+            'countries_by_id': {country.pk: country for country in countries},
+            'countries_by_code': {country.code.upper(): country for country in countries if country.code},
+            'countries_by_name': {country.name.lower(): country for country in countries},
+            'currencies_by_code': {currency.code.upper(): currency for currency in currencies},
+            'timezones_by_name': {tz.name: tz for tz in timezones},
+        }
+
+    def _get(self):
+        now = time.monotonic()
+        data = self._data
+        if data is not None and now - self._checked_at < self.check_interval:
+            return data
+        with self._lock:
+            version = self._shared_version()
+            if self._data is None or version != self._version:
+                # Read the version before the rows so a concurrent bump forces another reload.
+                self._data = self._load()
+                self._version = version
+            self._checked_at = now
+            return self._data
+
+    def warm(self):
+        self._get()
+
+    def countries(self):
+        return self._get()['countries']
+
+    def get_country(self, code=None, name=None, pk=None):
+        data = self._get()
+        if pk is not None:
+            return data['countries_by_id'].get(pk)
+        if code:
+            return data['countries_by_code'].get(code.upper())
+        if name:
+            return data['countries_by_name'].get(name.lower())
+        return None
+
+    def get_currency(self, code):
+        return self._get()['currencies_by_code'].get((code or '').upper())
+
+    def get_timezone(self, name):
+        return self._get()['timezones_by_name'].get(name)
+
+    def get_or_create_currency(self, code):
+        currency = self.get_currency(code)
+        if currency is None:
+            Currency = apps.get_model('users', 'Currency')
+            currency, _ = Currency.objects.get_or_create(code=code)
+        return currency
+
+    def get_or_create_timezone(self, name):
+        timezone_obj = self.get_timezone(name)
+        if timezone_obj is None:
+            Timezone = apps.get_model('users', 'Timezone')
+            timezone_obj, _ = Timezone.objects.get_or_create(name=name)
+        return timezone_obj
+
+    def country_choices(self, empty_label='---------'):
+        """Choices for a Country ModelChoiceField, built without a query."""
+        choices = [('', empty_label)] if empty_label is not None else []
+        choices.extend((country.pk, str(country)) for country in self.countries())
+        return choices
+
+
+reference_data = ReferenceDataCache()
+
+
+def use_cached_country_choices(field):
+    """
+    Render a Country ModelChoiceField from the reference cache.
+
+    The queryset is left in place, so validation on POST still checks the database.
+    """
+    field.choices = reference_data.country_choices(field.empty_label)
+
+
+def _invalidate_on_change(sender, **kwargs):
+    transaction.on_commit(bump_version)
+
+
+def _warm_on_first_request(sender, **kwargs):
+    request_started.disconnect(_warm_on_first_request, dispatch_uid='users_refdata_warm')
+    reference_data.warm()
+
+
+def connect_signals():
+    for model_name in ('Country', 'Currency', 'Timezone'):
+        model = apps.get_model('users', model_name)
+        post_save.connect(_invalidate_on_change, sender=model, dispatch_uid=f'users_refdata_save_{model_name}')
+        post_delete.connect(_invalidate_on_change, sender=model, dispatch_uid=f'users_refdata_delete_{model_name}')
+    # Warm each worker before its first request rather than touching the DB in ready().
+    request_started.connect(_warm_on_first_request, dispatch_uid='users_refdata_warm')
@@ -0,0 +1,154 @@
+# users/segmentation.py
+"""
+RFM (recency, frequency, monetary) segmentation for CustomUser.segment.
+
+The three RFM columns are streamed into NumPy arrays, scored into quintiles
+(1-5) with vectorized rank arithmetic and mapped to named segments through a
+5x5 recency/frequency grid. Only rows whose segment actually changed are
+written back, one UPDATE per segment per batch of ids.
+"""
+from collections import Counter
+
+from django.apps import apps
+from django.utils import timezone
+
+from .audience import queue_audience_refresh
+
+# Segment names stored in CustomUser.segment. Code 0 means "no purchases yet" (segment NULL).
+SEGMENTS = (
+    'Hibernating',
+    'At Risk',
+    "Can't Lose Them",
+    'About to Sleep',
+    'Need Attention',
+    'Loyal Customers',
+    'Promising',
+    'Potential Loyalists',
+    'New Customers',
+    'Champions',
+)
+
+# Rows: recency score 1-5, columns: combined frequency/monetary score 1-5.
+SEGMENT_GRID = (
+    ('Hibernating', 'Hibernating', 'At Risk', 'At Risk', "Can't Lose Them"),
+    ('Hibernating', 'Hibernating', 'At Risk', 'At Risk', "Can't Lose Them"),
+    ('About to Sleep', 'About to Sleep', 'Need Attention', 'Loyal Customers', 'Loyal Customers'),
+    ('Promising', 'Potential Loyalists', 'Potential Loyalists', 'Loyal Customers', 'Loyal Customers'),
+    ('New Customers', 'Potential Loyalists', 'Potential Loyalists', 'Champions', 'Champions'),
+)
+
+_SEGMENT_CODES = {name: code for code, name in enumerate(SEGMENTS, start=1)}
+
+
+def quintile_scores(values, higher_is_better=True):
+    """
+    Score each value 1-5 by the share of values it is at least as good as, so
+    tied values always share a score.
+    """
+    import numpy as np
+
+    values = np.asarray(values)
+    if not higher_is_better:
+        values = -values
+    if not len(values):
+        return np.ones(0, dtype=np.int8)
+    ranks = np.searchsorted(np.sort(values), values, side='right')
+    return np.clip(np.ceil(ranks * 5 / len(values)), 1, 5).astype(np.int8)
+
+
+def load_rfm_arrays(queryset, chunk_size=50000, now=None):
+    """
+    Stream the RFM columns into arrays.
+
+    Returns (pks, recency_days, frequency, monetary, current_codes). Users who
+    never purchased get an infinite recency; segments not in SEGMENTS get -1 so
+    they are always rewritten.
+    """
+    import numpy as np
+
+    now = (now or timezone.now()).timestamp()
+    columns = ([], [], [], [], [])
+    chunk = ([], [], [], [], [])
+
+    def flush_chunk():
+        columns[0].append(np.array(chunk[0], dtype=np.int64))
+        columns[1].append(np.array(chunk[1], dtype=np.float64))
+        columns[2].append(np.array(chunk[2], dtype=np.int64))
+        columns[3].append(np.array(chunk[3], dtype=np.float64))
+        columns[4].append(np.array(chunk[4], dtype=np.int8))
+        for values in chunk:
+            values.clear()
+
+    rows = queryset.values_list(
+        'pk', 'last_purchase_date', 'purchase_count', 'total_spent', 'segment'
+    ).iterator(chunk_size=chunk_size)
+    for pk, last_purchase_date, purchase_count, total_spent, segment in rows:
+        chunk[0].append(pk)
+        chunk[1].append((now - last_purchase_date.timestamp()) / 86400 if last_purchase_date else np.inf)
+        chunk[2].append(purchase_count or 0)
+        chunk[3].append(float(total_spent or 0))
+        chunk[4].append(0 if segment is None else _SEGMENT_CODES.get(segment, -1))
+        if len(chunk[0]) >= chunk_size:
+            flush_chunk()
+    flush_chunk()
+    return tuple(np.concatenate(column) for column in columns)
+
+
+def combined_scores(frequency_scores, monetary_scores):
+    """Mean of the frequency and monetary scores, halves rounded up (np.rint would send 2.5 down but 3.5 up)."""
+    import numpy as np
+
+    total = np.asarray(frequency_scores, dtype=np.float64) + monetary_scores
+    return np.floor(total / 2 + 0.5).astype(np.int8)
+
+
+def score_segments(recency_days, frequency, monetary):
+    """Vectorized RFM scoring. Returns an int8 array of segment codes (0 = no purchases)."""
+    import numpy as np
+
+    codes = np.zeros(len(recency_days), dtype=np.int8)
+    buyers = (frequency > 0) | np.isfinite(recency_days)
+    if not buyers.any():
+        return codes
+
+    recency = quintile_scores(recency_days[buyers], higher_is_better=False)
+    frequency_score = quintile_scores(frequency[buyers])
+    monetary_score = quintile_scores(monetary[buyers])
+    fm = combined_scores(frequency_score, monetary_score)
+
+    grid = np.array(
+        [[_SEGMENT_CODES[name] for name in row] for row in SEGMENT_GRID], dtype=np.int8
+    )
+    codes[buyers] = grid[recency - 1, fm - 1]
+    return codes
+
+
+def segment_users(chunk_size=50000, write_batch_size=10000, dry_run=False, now=None):
+    """
+    Recompute CustomUser.segment for every user.
+
+    Returns a dict with the number of users scored, the number changed and a
+    Counter of users per segment.
+    """
+    import numpy as np
+
+    CustomUser = apps.get_model('users', 'CustomUser')
+    pks, recency_days, frequency, monetary, current = load_rfm_arrays(
+        CustomUser.objects.all(), chunk_size=chunk_size, now=now
+    )
+    codes = score_segments(recency_days, frequency, monetary)
+    changed = np.nonzero(codes != current)[0]
+
+    if not dry_run:
+        for code in np.unique(codes[changed]):
+            segment = SEGMENTS[code - 1] if code else None
+            ids = pks[changed[codes[changed] == code]]
+            for start in range(0, len(ids), write_batch_size):
+                batch = ids[start:start + write_batch_size].tolist()
+                CustomUser.objects.filter(pk__in=batch).update(segment=segment)
+                queue_audience_refresh(batch)
+
+    counts = Counter()
+    for code, total in zip(*np.unique(codes, return_counts=True)):
+        counts[SEGMENTS[code - 1] if code else None] = int(total)
+    return {'scored': len(pks), 'changed': len(changed), 'segments': counts}
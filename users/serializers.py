@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import Permission
-from .models import CustomUser, Vendor, Country, State, City, Timezone, AppModule, Role, UserRole, AppModulePermission
+from .models import CustomUser, Vendor, Country, State, City, Timezone, AppModule, Role, UserRole, AppModulePermission, BehaviorEvent
 
 class PermissionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -29,7 +29,7 @@ class UserRoleSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'role', 'vendor']
 
 class CustomUserSerializer(serializers.ModelSerializer):
-    roles = UserRoleSerializer(many=True, read_only=True)
+    roles = UserRoleSerializer(source='userrole_set', many=True, read_only=True)
     user_type = serializers.CharField(source='get_user_type_display')
 
     class Meta:
@@ -55,7 +55,7 @@ class VendorSerializer(CustomUserSerializer):
 class CountrySerializer(serializers.ModelSerializer):
     class Meta:
         model = Country
-        fields = ['id', 'name', 'currency', 'default_timezone']
+        fields = ['id', 'name', 'code', 'currency', 'default_timezone']
 
 class StateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -78,4 +78,30 @@ class AppModulePermissionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = AppModulePermission
-        fields = ['id', 'module', 'permission']
\ No newline at end of file
+        fields = ['id', 'module', 'permission']
+
+class BehaviorEventSerializer(serializers.ModelSerializer):
+    occurred_at = serializers.DateTimeField(required=False)
+
+    class Meta:
+        model = BehaviorEvent
+        fields = ['event_type', 'url', 'occurred_at', 'metadata']
+
+class AudienceQuerySerializer(serializers.Serializer):
+    """Body of the audience endpoints: {"query": {...}} (see users.audience for the expression format)."""
+    query = serializers.DictField()
+
+class PermissionTemplateSerializer(serializers.Serializer):
+    """Apply a set of permissions to many roles: listed ``roles``, every role of the listed ``vendors``, or both."""
+    roles = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    vendors = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    permissions = serializers.ListField(child=serializers.CharField(), required=False)
+    template_role = serializers.PrimaryKeyRelatedField(queryset=Role.objects.all(), required=False)
+    mode = serializers.ChoiceField(choices=['replace', 'add', 'remove'], default='replace')
+
+    def validate(self, attrs):
+        if not attrs['roles'] and not attrs['vendors']:
+            raise serializers.ValidationError("Give roles and/or vendors to apply the template to.")
+        if ('permissions' in attrs) == ('template_role' in attrs):
+            raise serializers.ValidationError("Give either permissions or template_role.")
+        return attrs
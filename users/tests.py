@@ -1,3 +1,1135 @@
-from django.test import TestCase
+import csv
+import importlib
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from django.apps import apps as django_apps
+from django.contrib.auth.models import Permission
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.signals import pre_save
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import permissions, provisioning
+from .activity import BackgroundFlusher, UserActivityBuffer
+from .management.commands import backfill_geo
+from .devices import DeviceActivityBuffer, UserAgentInfo, classify_user_agent
+from .exports import EXPORT_COLUMNS, exportable_users
+from .fieldtracking import save_stats
+from .funnels import reconcile_funnels
+from .models import (
+    AudienceChange, BehaviorEvent, BehaviorRollupState, City, ConsentType, Country, Currency, CustomUser,
+    FunnelTransitionDaily, JourneyStage, PurchaseRecord, Role, RolePermission, State, Timezone, UserConsent, UserJourney,
+    UserDevice, UserPrivacySettings, UserRole, Vendor,
+)
+from .permissions import HasRolePermission, compile_permissions, permission_cache
+from .purchases import purchase_history, rebuild_purchase_summary, record_purchase, record_purchases, split_amount
+from .refdata import VERSION_KEY as REFDATA_VERSION_KEY, ReferenceDataCache, reference_data
+from .segmentation import SEGMENTS, combined_scores, quintile_scores, score_segments
+from .tracking import ROLLUP_NAME, BehaviorEventBuffer, rollup_behavior_events, write_events
+
+
+class UserListQueryBudgetTests(TestCase):
+    """A list page must cost the same number of queries for 1 row as for many."""
+
+    # Main SELECT (with country/state/city joined) + roles prefetch + permissions prefetch.
+    QUERY_BUDGET = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        timezone = Timezone.objects.create(name='Asia/Kolkata')
+        cls.country = Country.objects.create(name='India', code='IN')
+        cls.state = State.objects.create(name='Karnataka', country=cls.country, timezone=timezone)
+        cls.city = City.objects.create(name='Bengaluru', state=cls.state)
+        cls.permissions = list(Permission.objects.order_by('pk')[:2])
+        cls.vendor = Vendor.objects.create(username='vendor0', email='vendor0@example.com', company_name='Vendor 0', user_type='vendor')
+        cls.role = Role.objects.create(name='Manager', vendor=cls.vendor)
+        cls.viewer = CustomUser.objects.create_user('viewer', 'pw', email='viewer@example.com')
+
+    def setUp(self):
+        # Reference data is loaded once per process, not per request; keep it out of the budget.
+        reference_data.warm()
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def add_users(self, count, prefix='user'):
+        for index in range(count):
+            user = CustomUser.objects.create(
+                username=f'{prefix}{index}', email=f'{prefix}{index}@example.com',
+                country=self.country, state=self.state, city=self.city,
+            )
+            user.user_permissions.add(*self.permissions)
+            UserRole.objects.create(user=user, role=self.role, vendor=self.vendor)
+
+    def add_vendors(self, count, prefix='shop'):
+        for index in range(count):
+            vendor = Vendor.objects.create(
+                username=f'{prefix}{index}', email=f'{prefix}{index}@example.com', company_name=f'{prefix} {index}',
+                user_type='vendor', country=self.country, state=self.state, city=self.city,
+            )
+            vendor.user_permissions.add(*self.permissions)
+            UserRole.objects.create(user=vendor, role=self.role, vendor=self.vendor)
+
+    def get_page(self, name, **params):
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            response = self.client.get(reverse(f'users:{name}'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get_list(self, name):
+        return self.get_page(name)['results']
+
+    def test_user_list_query_budget(self):
+        self.add_users(1)
+        small = self.get_list('user-list')
+        self.add_users(20, prefix='more')
+        large = self.get_list('user-list')
+        self.assertEqual(len(large) - len(small), 20)
+
+    def test_user_list_includes_roles_and_permissions(self):
+        self.add_users(1)
+        row = next(item for item in self.get_list('user-list') if item['username'] == 'user0')
+        self.assertEqual(row['roles'], [{'id': row['roles'][0]['id'], 'user': 'user0', 'role': 'Manager', 'vendor': 'Vendor 0'}])
+        self.assertEqual(sorted(row['permissions']), sorted(p.codename for p in self.permissions))
+        self.assertEqual(row['city'], self.city.pk)
+
+    def test_vendor_list_query_budget(self):
+        self.add_vendors(1)
+        small = self.get_list('vendor-list')
+        self.add_vendors(15, prefix='more')
+        large = self.get_list('vendor-list')
+        self.assertEqual(len(large) - len(small), 15)
+
+    def test_user_list_cursor_pages(self):
+        self.add_users(12)
+        expected = list(CustomUser.objects.order_by('pk').values_list('username', flat=True))
+        seen, cursor, pages = [], None, []
+        while True:
+            page = self.get_page('user-list', page_size=5, **({'cursor': cursor} if cursor else {}))
+            pages.append(page)
+            seen += [row['username'] for row in page['results']]
+            if not page['next']:
+                break
+            cursor = page['next'].split('cursor=')[1].split('&')[0]
+        self.assertEqual(seen, expected)
+        self.assertIsNone(pages[0]['previous'])
+
+        previous = pages[-1]['previous'].split('cursor=')[1].split('&')[0]
+        back = self.get_page('user-list', page_size=5, cursor=previous)
+        self.assertEqual(back['results'], pages[-2]['results'])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('users:user-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class RolePermissionBackendTests(TestCase):
+    """Role permissions only count at the vendor where the user holds the role."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor_a = Vendor.objects.create(username='vendor_a', email='a@example.com', company_name='A', user_type='vendor')
+        cls.vendor_b = Vendor.objects.create(username='vendor_b', email='b@example.com', company_name='B', user_type='vendor')
+        cls.role = Role.objects.create(name='Editor', vendor=cls.vendor_a)
+        cls.permission = Permission.objects.get(content_type__app_label='admin', codename='add_logentry')
+        RolePermission.objects.create(role=cls.role, permission=cls.permission)
+        cls.user = CustomUser.objects.create_user('editor', 'pw', email='editor@example.com')
+        cls.other = CustomUser.objects.create_user('other', 'pw', email='other@example.com')
+        UserRole.objects.create(user=cls.user, role=cls.role, vendor=cls.vendor_a)
+        UserRole.objects.create(user=cls.other, role=cls.role, vendor=cls.vendor_b)
+
+    def setUp(self):
+        # Version bumps run on commit, which TestCase never reaches.
+        cache.clear()
+        permission_cache.invalidate()
+
+    def test_role_counts_only_at_its_vendor(self):
+        self.assertEqual(compile_permissions(self.user.pk, self.vendor_a.pk), {'admin.add_logentry'})
+        self.assertEqual(compile_permissions(self.user.pk, self.vendor_b.pk), set())
+
+    def test_has_perm_at_vendor(self):
+        user = CustomUser.objects.get(pk=self.user.pk)
+        self.assertTrue(user.has_perm('admin.add_logentry', self.vendor_a))
+        self.assertFalse(user.has_perm('admin.add_logentry', self.vendor_b))
+
+    def test_role_grants_nothing_for_objects_of_another_vendor(self):
+        user = CustomUser.objects.get(pk=self.user.pk)
+        self.assertTrue(user.has_perm('admin.add_logentry', Role(name='Own', vendor=self.vendor_a)))
+        self.assertFalse(user.has_perm('admin.add_logentry', Role(name='Foreign', vendor=self.vendor_b)))
+
+    def test_role_grants_nothing_without_a_vendor(self):
+        user = CustomUser.objects.get(pk=self.user.pk)
+        self.assertFalse(user.has_perm('admin.add_logentry'))
+        self.assertFalse(user.has_module_perms('admin'))
+        self.assertEqual(user.get_all_permissions(), set())
+
+    def test_drf_permission_needs_a_vendor(self):
+        view = SimpleNamespace(required_permissions=['admin.add_logentry'], kwargs={})
+        request = SimpleNamespace(user=CustomUser.objects.get(pk=self.user.pk))
+        self.assertFalse(HasRolePermission().has_permission(request, view))
+        view.kwargs = {'vendor_id': self.vendor_a.pk}
+        self.assertTrue(HasRolePermission().has_permission(request, view))
+        view.kwargs = {'vendor_id': self.vendor_b.pk}
+        self.assertFalse(HasRolePermission().has_permission(request, view))
+
+
+class PermissionVersionTests(TestCase):
+    """Role changes bump the shared permission version once per commit, and every worker sees it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = Vendor.objects.create(username='vendor', email='vendor@example.com', company_name='V', user_type='vendor')
+        cls.role = Role.objects.create(name='Editor', vendor=cls.vendor)
+        cls.permission = Permission.objects.get(content_type__app_label='admin', codename='add_logentry')
+        RolePermission.objects.create(role=cls.role, permission=cls.permission)
+        cls.user = CustomUser.objects.create_user('editor', 'pw', email='editor@example.com')
+        cls.assignment = UserRole.objects.create(user=cls.user, role=cls.role, vendor=cls.vendor)
+
+    def setUp(self):
+        cache.clear()
+        cache.set(permissions.VERSION_KEY, 1, timeout=None)
+        permission_cache.invalidate()
+
+    def version(self):
+        return cache.get(permissions.VERSION_KEY)
+
+    def test_revocation_reaches_another_worker(self):
+        worker = permissions.PermissionCache(check_interval=0)
+        self.assertIn('admin.add_logentry', worker.get(self.user.pk, self.vendor.pk))
+        self.assertIn('admin.add_logentry', worker.get(self.user.pk, self.vendor.pk))  # served from its own entries
+        self.assertEqual(worker.stats['local_hits'], 1)
+
+        self.assignment.delete()
+        # The worker that handled the revocation bumps through its own client of the shared cache.
+        other_client = caches.create_connection('default')
+        other_client.incr(permissions.VERSION_KEY)
+        self.assertEqual(worker.get(self.user.pk, self.vendor.pk), frozenset())
+
+    def test_bulk_delete_bumps_once_on_commit(self):
+        RolePermission.objects.create(role=self.role, permission=Permission.objects.exclude(pk=self.permission.pk).first())
+        before = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            RolePermission.objects.filter(role=self.role).delete()
+            self.assertEqual(self.version(), before)
+        self.assertEqual(self.version(), before + 1)
+
+    def test_rolled_back_change_does_not_swallow_the_next_bump(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.role.save()
+                transaction.set_rollback(True)
+        before = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.role.save()
+        self.assertEqual(self.version(), before + 1)
+
+
+class FunnelRollupTests(TestCase):
+    """The daily funnel rollups always match UserJourney, however journeys are removed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stages = [JourneyStage.objects.create(name=name, description='', order=order)
+                      for order, name in enumerate(['Visit', 'Signup', 'Purchase'])]
+
+    def add_user(self, name, stage_count=3):
+        user = CustomUser.objects.create(username=name, email=f'{name}@example.com')
+        for stage in self.stages[:stage_count]:
+            UserJourney.objects.create(user=user, stage=stage)
+        return user
+
+    def transitions(self):
+        return sum(FunnelTransitionDaily.objects.values_list('users', flat=True))
+
+    def test_journeys_keep_rollups_in_step(self):
+        self.add_user('first')
+        self.add_user('second', stage_count=2)
+        self.assertEqual(self.transitions(), 3 + 1)
+        self.assertEqual(reconcile_funnels(), [])
+
+    def test_deleting_a_user_removes_their_transitions(self):
+        self.add_user('kept', stage_count=2)
+        self.add_user('gone').delete()
+        self.assertEqual(self.transitions(), 1)
+        self.assertEqual(reconcile_funnels(), [])
+
+    def test_queryset_delete_removes_each_transition_once(self):
+        user = self.add_user('partial')
+        UserJourney.objects.filter(user=user, stage__in=self.stages[1:]).delete()
+        self.assertEqual(self.transitions(), 0)
+        self.assertEqual(reconcile_funnels(), [])
+
+    def test_reconcile_fixes_drift(self):
+        self.add_user('drifted')
+        FunnelTransitionDaily.objects.update(users=7)
+        drifted = reconcile_funnels(fix=True)
+        self.assertEqual(len(drifted), 3)
+        self.assertEqual(reconcile_funnels(), [])
+        self.assertEqual(self.transitions(), 3)
+
+
+class AudienceChangeTests(TestCase):
+    """Only saves touching indexed fields queue an audience refresh."""
+
+    @classmethod
+    def setUpTestData(cls):
+        CustomUser.objects.create(username='member', email='member@example.com')
+        cls.admin = CustomUser.objects.create(username='admin', email='admin@example.com', is_staff=True)
+
+    def setUp(self):
+        AudienceChange.objects.all().delete()
+        self.user = CustomUser.objects.get(username='member')
+
+    def test_save_without_indexed_changes_is_not_queued(self):
+        self.user.save()
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        self.assertFalse(AudienceChange.objects.exists())
+
+    def test_indexed_change_is_queued(self):
+        self.user.segment = 'Champions'
+        self.user.save()
+        self.assertEqual(list(AudienceChange.objects.values_list('user_id', flat=True)), [self.user.pk])
+
+    def test_query_must_be_an_object(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        for body in ([1, 2], {'query': 'segment'}, {}):
+            response = client.post(reverse('users:audience-count'), body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+
+
+class ProvisioningTests(TestCase):
+    """Bulk provisioning reports bad rows instead of failing the batch."""
+
+    @classmethod
+    def setUpTestData(cls):
+        timezone = Timezone.objects.create(name='America/Los_Angeles')
+        country = Country.objects.create(name='United States', code='US', currency='USD', default_timezone=timezone.name)
+        cls.state = State.objects.create(name='California', country=country, timezone=timezone)
+        cls.city = City.objects.create(name='San Jose', state=cls.state)
+
+    def setUp(self):
+        # Reference data reloads on commit, which TestCase never reaches.
+        reference_data.invalidate()
+
+    def test_location_names_match_case_insensitively(self):
+        result = provisioning.provision_users(
+            [{'username': 'staff1', 'email': 'staff1@example.com', 'country': 'united states',
+              'state': 'california', 'city': 'SAN JOSE'}],
+            send_emails=False,
+        )
+        self.assertEqual(result, {'created': ['staff1'], 'errors': []})
+        user = CustomUser.objects.get(username='staff1')
+        self.assertEqual((user.state_id, user.city_id), (self.state.pk, self.city.pk))
+
+    def test_invalid_usernames_are_reported_per_row(self):
+        rows = [
+            {'username': 'has space!', 'email': 'space@example.com'},
+            {'username': 'u' * 151, 'email': 'long@example.com'},
+            {'username': 'fine', 'email': 'not-an-email'},
+            {'username': 'good.name+1', 'email': 'good@example.com', 'phone': '0' * 16},
+            {'username': 'u' * 150, 'email': 'max@example.com'},
+        ]
+        result = provisioning.provision_users(rows, send_emails=False)
+        self.assertEqual(result['created'], ['u' * 150])
+        errors = {error['row']: error['errors'] for error in result['errors']}
+        self.assertEqual(sorted(errors), [1, 2, 3, 4])
+        self.assertTrue(errors[1][0].startswith('username: Enter a valid username.'))
+        self.assertEqual(errors[2], ['username: Ensure this value has at most 150 characters (it has 151).'])
+        self.assertEqual(errors[3], ['email: Enter a valid email address.'])
+        self.assertEqual(errors[4], ['phone: Ensure this value has at most 15 characters (it has 16).'])
+
+    def test_username_taken_after_validation_is_reported_per_row(self):
+        hash_passwords = provisioning._hash_passwords
+
+        def taken_meanwhile(passwords):
+            if not CustomUser.objects.filter(username='late').exists():
+                CustomUser.objects.create(username='late', email='other@example.com')
+            return hash_passwords(passwords)
+
+        rows = [
+            {'username': 'early', 'email': 'early@example.com'},
+            {'username': 'late', 'email': 'late@example.com'},
+        ]
+        with mock.patch.object(provisioning, '_hash_passwords', taken_meanwhile):
+            result = provisioning.provision_users(rows, send_emails=False)
+        self.assertEqual(result['created'], ['early'])
+        self.assertEqual(result['errors'], [{'row': 2, 'username': 'late', 'errors': ["username 'late' is already taken."]}])
+
+
+class UserExportTests(TestCase):
+    """Exports only contain active users whose privacy flag and latest consent allow it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.marketing = ConsentType.objects.create(name='marketing')
+        now = timezone.now()
+        cls.admin = CustomUser.objects.create(username='admin', email='admin@example.com', is_staff=True)
+
+        def add_user(name, share=True, sell=False, consents=(), **fields):
+            user = CustomUser.objects.create(username=name, email=f'{name}@example.com', **fields)
+            UserPrivacySettings.objects.create(user=user, can_share_data=share, can_sell_data=sell)
+            for consented in consents:
+                UserConsent.objects.create(
+                    user=user, consent_type=cls.marketing, consented=consented,
+                    date_consented=now if consented else None, date_withdrawn=None if consented else now,
+                )
+            return user
+
+        add_user('sharer', consents=[True])
+        add_user('seller', share=False, sell=True, consents=[True])
+        add_user('silent')
+        add_user('withdrawn', consents=[True, False])
+        add_user('regranted', consents=[True, False, True])
+        add_user('inactive', consents=[True], is_active=False)
+
+    def usernames(self, purpose='share', consent_types=()):
+        return list(exportable_users(purpose, consent_types).values_list('username', flat=True))
+
+    def test_purpose_selects_the_privacy_flag(self):
+        self.assertEqual(self.usernames('share'), ['sharer', 'silent', 'withdrawn', 'regranted'])
+        self.assertEqual(self.usernames('sell'), ['seller'])
+        with self.assertRaises(ValueError):
+            self.usernames('rent')
+
+    def test_latest_consent_row_decides(self):
+        self.assertEqual(self.usernames('share', ['marketing']), ['sharer', 'regranted'])
+        self.assertEqual(self.usernames('share', ['marketing', 'newsletter']), [])
+
+    def export(self, user=None, **params):
+        client = APIClient()
+        client.force_authenticate(user or self.admin)
+        return client.get(reverse('users:user-export'), params)
+
+    def test_csv_export(self):
+        response = self.export(purpose='share', consent='marketing', output='csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="users-share.csv"')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], [name for name, _ in EXPORT_COLUMNS])
+        self.assertEqual([row[1] for row in rows[1:]], ['sharer', 'regranted'])
+
+    def test_ndjson_export(self):
+        response = self.export(purpose='sell', consent='marketing', output='ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['username'], row['email']) for row in rows], [('seller', 'seller@example.com')])
+
+    def test_bad_parameters_are_rejected(self):
+        self.assertEqual(self.export(output='xml').status_code, 400)
+        self.assertEqual(self.export(purpose='rent').status_code, 400)
+
+    def test_non_admins_are_denied(self):
+        self.assertEqual(self.export(user=CustomUser.objects.get(username='sharer')).status_code, 403)
+
+
+class DirtyFieldTests(TestCase):
+    """Saves of loaded users write only the changed columns, or nothing at all."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = CustomUser.objects.create(username='tracked', email='tracked@example.com', geolocation={'city': 'Pune', 'tags': ['a']})
+        CustomUser.objects.filter(pk=user.pk).update(last_known_ip='10.0.0.1')  # no geo lookup
+
+    def setUp(self):
+        save_stats.clear()
+        self.user = CustomUser.objects.get(username='tracked')
+
+    def saved_fields(self):
+        saved = []
+
+        def receiver(sender, update_fields=None, **kwargs):
+            saved.append(None if update_fields is None else set(update_fields))
+
+        pre_save.connect(receiver, sender=CustomUser, weak=False)
+        self.addCleanup(pre_save.disconnect, receiver, sender=CustomUser)
+        return saved
+
+    def test_clean_save_issues_no_query(self):
+        with self.assertNumQueries(0):
+            self.user.save()
+        self.assertEqual(save_stats['users.CustomUser']['skipped'], 1)
+
+    def test_only_dirty_columns_are_written(self):
+        saved = self.saved_fields()
+        self.user.first_name = 'Renamed'
+        self.user.geolocation['city'] = 'Mumbai'  # mutated in place
+        self.user.save()
+        self.assertEqual(saved, [{'first_name', 'geolocation'}])
+        self.assertEqual(save_stats['users.CustomUser']['partial'], 1)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.first_name, self.user.geolocation['city']), ('Renamed', 'Mumbai'))
+        self.assertEqual(self.user.get_dirty_fields(), [])
+
+    def test_reordered_json_keys_are_not_a_change(self):
+        self.user.geolocation = {'tags': ['a'], 'city': 'Pune'}
+        self.assertEqual(self.user.get_dirty_fields(), [])
+        self.user.geolocation['tags'].append('b')
+        self.assertEqual(self.user.get_dirty_fields(), ['geolocation'])
+
+    def test_explicit_update_fields_and_new_rows_are_full_saves(self):
+        saved = self.saved_fields()
+        self.user.save(update_fields=['email'])
+        CustomUser.objects.create(username='fresh', email='fresh@example.com')
+        self.assertEqual(saved, [{'email'}, None])
+        self.assertEqual(save_stats['users.CustomUser']['full'], 2)
+
+    def test_deferred_fields_are_left_alone(self):
+        user = CustomUser.objects.only('pk', 'first_name').get(pk=self.user.pk)
+        saved = self.saved_fields()
+        user.first_name = 'Deferred'
+        user.save()
+        self.assertEqual(saved, [{'first_name'}])
+
+    def test_geo_is_resolved_only_when_the_ip_changes(self):
+        with mock.patch.object(CustomUser, 'resolve_geo_info', return_value=True) as resolve:
+            self.user.first_name = 'Same IP'
+            self.user.save()
+            resolve.assert_not_called()
+            self.user.last_known_ip = '10.0.0.2'
+            self.user.save()
+            resolve.assert_called_once_with('10.0.0.2')
+            self.user.save(update_fields=['last_known_ip'])
+            self.assertEqual(resolve.call_count, 1)
+        self.assertEqual(save_stats['users.CustomUser']['geo_resolved'], 1)
+        self.assertEqual(save_stats['users.CustomUser']['geo_skipped'], 2)
+
+
+class UserActivityBufferTests(TestCase):
+    """Request activity is coalesced per user and written, with fresh geo data, by flush()."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.old_zone = Timezone.objects.create(name='Asia/Kolkata')
+        cls.new_zone = Timezone.objects.create(name='Europe/Paris')
+        cls.user = CustomUser.objects.create(username='visitor', email='visitor@example.com')
+        CustomUser.objects.filter(pk=cls.user.pk).update(last_known_ip='10.0.0.1', preferred_timezone=cls.old_zone)
+
+    def setUp(self):
+        self.buffer = UserActivityBuffer(flush_interval=3600, max_pending=100, last_visit_resolution=60)
+        self.buffer._ensure_worker = lambda: None  # flushed explicitly below
+        self.addCleanup(lambda: self.buffer._pending.clear())  # nothing left for the exit-time flush
+        self.now = timezone.now()
+
+    def load(self):
+        return CustomUser.objects.get(pk=self.user.pk)
+
+    def test_repeated_hits_collapse_into_one_row(self):
+        user = self.load()
+        self.assertTrue(self.buffer.record(user, ip='10.0.0.2', visited_at=self.now))
+        self.assertFalse(self.buffer.record(user, ip='10.0.0.2', visited_at=self.now + timedelta(seconds=5)))
+        self.assertTrue(self.buffer.record(user, ip='10.0.0.3', visited_at=self.now + timedelta(seconds=10)))
+        self.assertEqual(self.buffer._pending, {user.pk: ('10.0.0.3', self.now, '10.0.0.1')})
+        self.assertEqual((self.buffer.stats['recorded'], self.buffer.stats['skipped']), (2, 1))
+
+    def test_recent_visit_from_the_same_ip_is_not_queued(self):
+        user = self.load()
+        user.last_visit = self.now
+        self.assertFalse(self.buffer.record(user, ip='10.0.0.1', visited_at=self.now + timedelta(seconds=30)))
+        self.assertTrue(self.buffer.record(user, ip='10.0.0.1', visited_at=self.now + timedelta(seconds=90)))
+
+    def test_flush_writes_ip_and_visit(self):
+        with mock.patch.object(CustomUser, 'resolve_geo_info', return_value=False):
+            self.buffer.record(self.load(), ip='10.0.0.1', visited_at=self.now)
+            self.assertEqual(self.buffer.flush(), 1)
+        user = self.load()
+        self.assertEqual((user.last_known_ip, user.last_visit), ('10.0.0.1', self.now))
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_new_ip_re_resolves_geo(self):
+        def resolve(user, ip):
+            user.preferred_timezone = self.new_zone
+            return True
+
+        with mock.patch.object(CustomUser, 'resolve_geo_info', autospec=True, side_effect=resolve) as resolve_geo:
+            self.buffer.record(self.load(), ip='10.0.0.9', visited_at=self.now)
+            self.buffer.flush()
+        resolve_geo.assert_called_once()
+        self.assertEqual(resolve_geo.call_args.args[1], '10.0.0.9')
+        user = self.load()
+        self.assertEqual((user.last_known_ip, user.preferred_timezone_id), ('10.0.0.9', self.new_zone.pk))
+        self.assertEqual(self.buffer.stats['geo_resolved'], 1)
+
+    def test_unresolved_ip_keeps_stored_geo(self):
+        with mock.patch.object(CustomUser, 'resolve_geo_info', return_value=False):
+            self.buffer.record(self.load(), ip='10.0.0.9', visited_at=self.now)
+            self.buffer.flush()
+        user = self.load()
+        self.assertEqual((user.last_known_ip, user.preferred_timezone_id), ('10.0.0.9', self.old_zone.pk))
+
+    def test_full_buffer_flushes(self):
+        self.buffer.max_pending = 1
+        with mock.patch.object(CustomUser, 'resolve_geo_info', return_value=False):
+            self.buffer.record(self.load(), ip='10.0.0.4', visited_at=self.now)
+        self.assertEqual(self.buffer._pending, {})
+        self.assertEqual(self.load().last_known_ip, '10.0.0.4')
+
+
+class PurchaseHistoryTests(TestCase):
+    """Purchases are appended to PurchaseRecord and folded into a summary that matches a rebuild."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='buyer', email='buyer@example.com')
+
+    def summary(self):
+        return CustomUser.objects.get(pk=self.user.pk).purchase_summary
+
+    @override_settings(PURCHASE_SUMMARY_RECENT=2)
+    def test_summary_folds_purchases_and_matches_a_rebuild(self):
+        start = timezone.now() - timedelta(days=3)
+        record_purchases(self.user.pk, [
+            {'amount': '10', 'category': 'Food', 'purchased_at': start},
+            {'amount': 5, 'purchased_at': start + timedelta(days=1)},
+        ])
+        record_purchase(self.user, Decimal('2.50'), category='Food', purchased_at=start + timedelta(days=2))
+        summary = self.summary()
+        self.assertEqual([entry['amount'] for entry in summary['recent']], ['2.50', '5.00'])
+        self.assertEqual(summary['category_totals'], {'Food': '12.50', 'Uncategorized': '5.00'})
+        self.assertEqual(rebuild_purchase_summary(self.user.pk), summary)
+
+    def test_history_is_newest_first_within_the_range(self):
+        now = timezone.now()
+        for days in (1, 5, 10):
+            record_purchase(self.user, days, purchased_at=now - timedelta(days=days))
+        history = purchase_history(self.user.pk, start=now - timedelta(days=7), end=now)
+        self.assertEqual([record.amount for record in history], [Decimal('1.00'), Decimal('5.00')])
+
+    def test_split_amount_adds_up_to_the_total(self):
+        cases = [
+            (Decimal('10.00'), [1, 1, 1], ['3.34', '3.33', '3.33']),
+            (Decimal('115.00'), [Decimal('60'), Decimal('40')], ['69.00', '46.00']),
+            (Decimal('0.05'), [1] * 6, ['0.01'] * 5 + ['0.00']),
+            (Decimal('-1.00'), [1, 2], ['-0.33', '-0.67']),
+            (Decimal('7.00'), [0, 3], ['0.00', '7.00']),
+        ]
+        for total, weights, expected in cases:
+            with self.subTest(total=total, weights=weights):
+                parts = split_amount(total, weights)
+                self.assertEqual([str(part) for part in parts], expected)
+                self.assertEqual(sum(parts), total)
+        for weights in ([], [0, 0], [1, -1]):
+            with self.subTest(weights=weights), self.assertRaises(ValueError):
+                split_amount(Decimal('1.00'), weights)
+
+
+class PurchaseHistoryMigrationTests(TestCase):
+    """The 0005 data migration reads every legacy entry it can and fills the summaries."""
+
+    migration = importlib.import_module('users.migrations.0005_purchase_history_records')
+
+    def parse(self, entry):
+        return self.migration._parse_entry(entry, user_id=1)
+
+    def test_readable_entries(self):
+        amount, purchased_at, category = self.parse({'amount': '12.345', 'date': '2021-03-04T10:00:00', 'category': 'Food'})
+        self.assertEqual((amount, category), (Decimal('12.35'), 'Food'))
+        self.assertEqual(purchased_at, datetime(2021, 3, 4, 10, tzinfo=dt_timezone.utc))
+        self.assertEqual(self.parse({'total': 3, 'purchased_at': '2021-03-04T10:00:00+02:00'})[:2],
+                         (Decimal('3.00'), datetime(2021, 3, 4, 8, tzinfo=dt_timezone.utc)))
+
+    def test_unreadable_values_fall_back_to_defaults(self):
+        cases = [
+            ({'amount': 'abc'}, (None, None, None)),
+            ({'total': 'NaN'}, (None, None, None)),
+            ({'price': 'Infinity'}, (None, None, None)),
+            ({'amount': 1, 'date': '2021-13-01T00:00:00'}, (Decimal('1.00'), None, None)),  # regression: ValueError
+            ({'amount': 1, 'timestamp': 'yesterday'}, (Decimal('1.00'), None, None)),
+            (['not', 'an', 'object'], (None, None, None)),
+        ]
+        for entry, expected in cases:
+            with self.subTest(entry=entry), self.assertLogs(self.migration.logger, 'WARNING'):
+                self.assertEqual(self.parse(entry), expected)
+
+    def test_amounts_too_large_for_the_column_are_clamped(self):
+        for value, expected in (('123456789.50', '99999999.99'), ('1e30', '99999999.99'), (-1e9, '-99999999.99')):
+            with self.subTest(value=value), self.assertLogs(self.migration.logger, 'WARNING'):
+                self.assertEqual(str(self.parse({'amount': value})[0]), expected)
+
+    def test_summaries_match_a_rebuild(self):
+        users = [CustomUser.objects.create(username=name, email=f'{name}@example.com') for name in ('first', 'second')]
+        now = timezone.now()
+        PurchaseRecord.objects.bulk_create([
+            PurchaseRecord(user=user, amount=Decimal(days), category=category, purchased_at=now - timedelta(days=days))
+            for user in users for days, category in enumerate(['Food', None, 'Drinks', 'Food', None, 'Food', 'Food'], start=1)
+        ])
+        self.migration.build_purchase_summaries(django_apps)
+        for user in users:
+            migrated = CustomUser.objects.get(pk=user.pk).purchase_summary
+            self.assertEqual(len(migrated['recent']), 5)
+            self.assertEqual(migrated, rebuild_purchase_summary(user.pk))
+
+
+class SegmentationTests(SimpleTestCase):
+    """RFM scoring is a pure function of the three columns."""
+
+    def test_quintile_scores(self):
+        cases = [
+            ([10, 20, 30, 40, 50], True, [1, 2, 3, 4, 5]),
+            ([10, 20, 30, 40, 50], False, [5, 4, 3, 2, 1]),
+            ([5, 5, 5, 5, 5], True, [5, 5, 5, 5, 5]),
+            ([5, 5, 5, 5, 5], False, [5, 5, 5, 5, 5]),
+            ([1, 1, 2, 3], True, [3, 3, 4, 5]),
+            ([1, 1, 10, 20, 30], False, [5, 5, 3, 2, 1]),  # the two most recent tie for the best score
+            ([7, 3], True, [5, 3]),
+            ([7], True, [5]),
+            ([], True, []),
+        ]
+        for values, higher_is_better, expected in cases:
+            with self.subTest(values=values, higher_is_better=higher_is_better):
+                scores = quintile_scores(np.array(values, dtype=np.float64), higher_is_better)
+                self.assertEqual(scores.tolist(), expected)
+                self.assertEqual(scores.dtype, np.int8)
+
+    def test_combined_scores_round_halves_up(self):
+        cases = [
+            ((1, 1), 1), ((1, 2), 2), ((2, 3), 3), ((3, 4), 4), ((4, 5), 5), ((5, 5), 5), ((1, 4), 3), ((2, 5), 4),
+        ]
+        frequency, monetary = (np.array(scores, dtype=np.int8) for scores in zip(*(pair for pair, _ in cases)))
+        self.assertEqual(combined_scores(frequency, monetary).tolist(), [expected for _, expected in cases])
+
+    def test_score_segments(self):
+        cases = [
+            # (recency days, frequency, monetary) per user -> segments
+            (([np.inf], [0], [0.0]), [None]),
+            (([1.0], [1], [10.0]), ['Champions']),
+            (([1.0, 400.0], [5, 1], [500.0, 10.0]), ['Champions', 'Need Attention']),  # two users score 5 and 3
+            (([3.0, 3.0, np.inf], [2, 2, 0], [20.0, 20.0, 0.0]), ['Champions', 'Champions', None]),
+            (([1.0, 30.0, 60.0, 90.0, 365.0], [1, 1, 1, 1, 1], [5.0] * 5),
+             ['Champions', 'Loyal Customers', 'Loyal Customers', "Can't Lose Them", "Can't Lose Them"]),
+        ]
+        for (recency, frequency, monetary), expected in cases:
+            with self.subTest(recency=recency):
+                codes = score_segments(np.array(recency), np.array(frequency), np.array(monetary))
+                self.assertEqual([SEGMENTS[code - 1] if code else None for code in codes], expected)
+
+
+class BehaviorTrackingTests(TestCase):
+    """Behavior events go through a bounded buffer, one batched write and an incremental rollup."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='browser', email='browser@example.com')
+
+    def setUp(self):
+        self.buffer = BehaviorEventBuffer(capacity=3, flush_interval=3600)
+        self.buffer._ensure_worker = lambda: None  # flushed explicitly below
+        self.addCleanup(self.buffer._events.clear)
+        self.now = timezone.now()
+
+    def test_flushers_must_implement_flush(self):
+        class Incomplete(BackgroundFlusher):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_full_buffer_overwrites_the_oldest_events(self):
+        for page in range(5):
+            self.buffer.record(self.user.pk, 'page_view', f'/page/{page}/', self.now)
+        self.assertEqual([event[2] for event in self.buffer._events], ['/page/2/', '/page/3/', '/page/4/'])
+        self.assertEqual(self.buffer.stats, {'recorded': 5, 'dropped': 2, 'flushed': 0})
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.buffer.stats['flushed'], 3)
+        self.assertEqual(BehaviorEvent.objects.count(), 3)
+
+    def test_failed_write_drops_the_batch(self):
+        self.buffer.record(self.user.pk, 'click', '/buy/', self.now)
+        with mock.patch('users.tracking.write_events', side_effect=RuntimeError), self.assertLogs('users.tracking', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual((len(self.buffer._events), self.buffer.stats['flushed']), (0, 0))
+
+    def events(self):
+        return [
+            (self.user.pk, 'page_view', '', self.now, None),
+            (self.user.pk, 'click', '/a,"b"/', self.now - timedelta(seconds=1), {'button': 'buy', 'tags': [1, 2]}),
+        ]
+
+    def assertWritten(self):
+        self.assertEqual(
+            list(BehaviorEvent.objects.order_by('pk').values_list('user_id', 'event_type', 'url', 'occurred_at', 'metadata')),
+            self.events(),
+        )
+
+    def test_write_events_bulk_creates_elsewhere(self):
+        with mock.patch.object(connection, 'vendor', 'sqlite'):
+            write_events(self.events())
+        self.assertWritten()
+
+    def test_write_events_copies_on_postgresql(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('COPY is PostgreSQL only')
+        with mock.patch.object(BehaviorEvent.objects, 'bulk_create') as bulk_create:
+            write_events(self.events())
+        bulk_create.assert_not_called()
+        self.assertWritten()
+
+    def add_event(self, event_type, url, occurred_at, ingested_at=None):
+        return BehaviorEvent.objects.create(
+            user=self.user, event_type=event_type, url=url, occurred_at=occurred_at,
+            ingested_at=ingested_at or self.now - timedelta(minutes=5),
+        )
+
+    def visits(self):
+        return CustomUser.objects.filter(pk=self.user.pk).values_list('visit_count', 'last_visit', 'last_page_visited').get()
+
+    def test_rollup_consumes_settled_events_once(self):
+        self.add_event('page_view', 'https://example.com/a', self.now - timedelta(minutes=3))
+        self.add_event('click', 'https://example.com/buy', self.now - timedelta(minutes=2))
+        last = self.add_event('page_view', 'https://example.com/b', self.now - timedelta(minutes=1))
+        self.assertEqual(rollup_behavior_events(batch_size=2, settle_seconds=60), 3)
+        self.assertEqual(self.visits(), (2, self.now - timedelta(minutes=1), 'https://example.com/b'))
+        self.assertEqual(BehaviorRollupState.objects.get(name=ROLLUP_NAME).last_event_id, last.pk)
+        self.assertEqual(rollup_behavior_events(settle_seconds=60), 0)
+        self.assertEqual(self.visits()[0], 2)
+
+    def test_rollup_waits_for_unsettled_events(self):
+        settled = self.add_event('page_view', 'https://example.com/a', self.now)
+        self.add_event('page_view', 'https://example.com/b', self.now, ingested_at=timezone.now())
+        self.assertEqual(rollup_behavior_events(settle_seconds=60), 1)
+        self.assertEqual(BehaviorRollupState.objects.get(name=ROLLUP_NAME).last_event_id, settled.pk)
+        self.assertEqual(rollup_behavior_events(settle_seconds=0), 1)
+        self.assertEqual(self.visits()[:1], (2,))
+
+    def test_rollup_keeps_the_latest_visit(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(visit_count=4, last_visit=self.now)
+        self.add_event('page_view', 'https://example.com/old', self.now - timedelta(days=1))
+        rollup_behavior_events(settle_seconds=60)
+        self.assertEqual(self.visits()[:2], (5, self.now))
+
+    def post(self, body, user=None):
+        client = APIClient()
+        if user is not False:
+            client.force_authenticate(user or self.user)
+        with mock.patch('users.tracking.event_buffer', self.buffer):
+            return client.post(reverse('users:track-events'), body, format='json')
+
+    def test_view_queues_one_or_many_events(self):
+        response = self.post({'event_type': 'page_view', 'url': '/home/'})
+        self.assertEqual((response.status_code, response.data), (202, {'queued': 1}))
+        response = self.post([{'event_type': 'click', 'metadata': {'x': 1}}, {'event_type': 'page_view', 'url': '/cart/'}])
+        self.assertEqual((response.status_code, response.data), (202, {'queued': 2}))
+        self.assertEqual(
+            [(user_id, event_type, url, metadata) for user_id, event_type, url, _, metadata in self.buffer._events],
+            [(self.user.pk, 'page_view', '/home/', None), (self.user.pk, 'click', '', {'x': 1}), (self.user.pk, 'page_view', '/cart/', None)],
+        )
+
+    def test_view_rejects_invalid_events(self):
+        self.assertEqual(self.post({'event_type': 'scroll'}).status_code, 400)
+        self.assertEqual(self.post([{'event_type': 'click'}, {'url': '/no-type/'}]).status_code, 400)
+        self.assertEqual(self.post({'event_type': 'click', 'occurred_at': 'yesterday'}).status_code, 400)
+        self.assertIn(self.post({'event_type': 'click'}, user=False).status_code, (401, 403))
+        self.assertEqual(len(self.buffer._events), 0)
+
+
+class ReferenceDataCacheTests(TestCase):
+    """Reference tables are served from memory and reloaded when the shared version moves."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.india = Country.objects.create(name='India', code='IN')
+        cls.france = Country.objects.create(name='France', code='FR')
+        Country.objects.create(name='Atlantis')
+        cls.rupee = Currency.objects.create(code='INR')
+        cls.zone = Timezone.objects.create(name='Asia/Kolkata')
+
+    def setUp(self):
+        cache.set(REFDATA_VERSION_KEY, 1)
+        self.refdata = ReferenceDataCache(check_interval=60)
+
+    def test_lookups(self):
+        self.assertEqual(self.refdata.get_country(code='in'), self.india)
+        self.assertEqual(self.refdata.get_country(name='FRANCE'), self.france)
+        self.assertEqual(self.refdata.get_country(pk=self.india.pk), self.india)
+        self.assertIsNone(self.refdata.get_country(code='XX'))
+        self.assertIsNone(self.refdata.get_country())
+        self.assertEqual(self.refdata.get_currency('inr'), self.rupee)
+        self.assertIsNone(self.refdata.get_currency(None))
+        self.assertEqual(self.refdata.get_timezone('Asia/Kolkata'), self.zone)
+        self.assertEqual(
+            [label for _, label in self.refdata.country_choices()], ['---------', 'Atlantis', 'France', 'India'],
+        )
+
+    def test_lookups_are_served_from_memory(self):
+        self.refdata.warm()
+        with self.assertNumQueries(0):
+            self.refdata.get_country(code='IN')
+            self.refdata.get_currency('INR')
+            self.refdata.countries()
+
+    def test_get_or_create_adds_missing_rows(self):
+        self.assertEqual(self.refdata.get_or_create_currency('INR'), self.rupee)
+        euro = self.refdata.get_or_create_currency('EUR')
+        self.assertEqual(Currency.objects.get(code='EUR'), euro)
+        self.assertEqual(self.refdata.get_or_create_timezone('Europe/Paris'), Timezone.objects.get(name='Europe/Paris'))
+
+    def test_change_committed_elsewhere_reloads_after_the_check_interval(self):
+        self.assertIsNone(self.refdata.get_country(code='DE'))
+        Country.objects.create(name='Germany', code='DE')
+        caches.create_connection('default').incr(REFDATA_VERSION_KEY)  # another worker's bump
+        self.assertIsNone(self.refdata.get_country(code='DE'))  # version not checked again yet
+        with mock.patch('users.refdata.time.monotonic', return_value=10 ** 9):
+            self.assertEqual(self.refdata.get_country(code='DE').name, 'Germany')
+
+    def test_saves_bump_the_version_on_commit(self):
+        self.refdata.warm()
+        with self.captureOnCommitCallbacks(execute=True):
+            Country.objects.filter(pk=self.india.pk).update(name='Bharat')
+            self.india.refresh_from_db()
+            self.india.save()
+        self.assertEqual(cache.get(REFDATA_VERSION_KEY), 2)
+        self.refdata._checked_at = 0.0
+        self.assertEqual(self.refdata.get_country(code='IN').name, 'Bharat')
+
+    def test_unchanged_version_keeps_the_loaded_data(self):
+        self.refdata.warm()
+        self.refdata._checked_at = 0.0
+        with mock.patch.object(self.refdata, '_load') as load:
+            self.assertEqual(self.refdata.get_country(code='IN'), self.india)
+        load.assert_not_called()
+
+
+class CountryCodeMigrationTests(TransactionTestCase):
+    """0004 adds Country.code as a nullable unique column without touching existing rows."""
+
+    before = [('users', '0003_appmodule_remove_customuser_interests_and_more')]
+    after = [('users', '0004_country_code')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_existing_countries_get_an_empty_code(self):
+        old_apps = self.migrate(self.before)
+        old_apps.get_model('users', 'Country').objects.create(name='India')
+
+        Country = self.migrate(self.after).get_model('users', 'Country')
+        india = Country.objects.get(name='India')
+        self.assertIsNone(india.code)
+        Country.objects.create(name='Atlantis')  # several countries may have no code
+        Country.objects.filter(pk=india.pk).update(code='IN')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Country.objects.create(name='Republic of India', code='IN')
+
+
+CHROME_WINDOWS = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+SAFARI_IPHONE = (
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/17.0 Mobile/15E148 Safari/604.1'
+)
+
+
+class UserAgentClassificationTests(SimpleTestCase):
+    def test_classify_user_agent(self):
+        cases = [
+            (CHROME_WINDOWS, ('Desktop', 'Chrome', 'Windows')),
+            (CHROME_WINDOWS + ' Edg/120.0', ('Desktop', 'Edge', 'Windows')),
+            ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
+             'Chrome/120.0 Safari/537.36 OPR/106.0', ('Desktop', 'Opera', 'macOS')),
+            (SAFARI_IPHONE, ('Mobile', 'Safari', 'iOS')),
+            ('Mozilla/5.0 (iPad; CPU OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+             'CriOS/120.0 Mobile/15E148 Safari/604.1', ('Tablet', 'Chrome', 'iOS')),
+            ('Mozilla/5.0 (Linux; Android 13; SM-S901B) AppleWebKit/537.36 (KHTML, like Gecko) '
+             'SamsungBrowser/23.0 Chrome/115.0 Mobile Safari/537.36', ('Mobile', 'Samsung Internet', 'Android')),
+            ('Mozilla/5.0 (Android 13; Tablet; rv:120.0) Gecko/120.0 Firefox/120.0', ('Tablet', 'Firefox', 'Android')),
+            ('Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0', ('Desktop', 'Firefox', 'Linux')),
+            ('Mozilla/5.0 (Windows NT 10.0; Trident/7.0; rv:11.0) like Gecko', ('Desktop', 'Internet Explorer', 'Windows')),
+            ('curl/8.4.0', ('Desktop', 'Other', 'Other')),
+            ('Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)', None),
+            ('', None),
+            (None, None),
+        ]
+        for user_agent, expected in cases:
+            with self.subTest(user_agent=user_agent):
+                info = classify_user_agent(user_agent)
+                self.assertEqual(info, expected and UserAgentInfo(*expected))
+
+
+class DeviceActivityBufferTests(TestCase):
+    """Device sightings are coalesced, throttled and upserted in one flush."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='gadgets', email='gadgets@example.com')
+
+    def setUp(self):
+        self.buffer = DeviceActivityBuffer(flush_interval=3600, last_seen_interval=300)
+        self.buffer._ensure_worker = lambda: None  # flushed explicitly below
+        self.addCleanup(self.buffer._pending.clear)
+        self.now = timezone.now()
+
+    def devices(self):
+        return list(UserDevice.objects.filter(user=self.user).order_by('pk').values_list('device_type', 'browser', 'last_seen'))
+
+    def test_bots_are_ignored(self):
+        self.assertFalse(self.buffer.record(self.user, 'Googlebot/2.1', self.now))
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_latest_sighting_in_the_window_is_written(self):
+        # Regression: the first sighting used to win.
+        self.assertTrue(self.buffer.record(self.user, CHROME_WINDOWS, self.now))
+        self.assertFalse(self.buffer.record(self.user, CHROME_WINDOWS, self.now + timedelta(seconds=30)))
+        self.assertFalse(self.buffer.record(self.user, CHROME_WINDOWS, self.now + timedelta(seconds=10)))
+        self.assertTrue(self.buffer.record(self.user, SAFARI_IPHONE, self.now))
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.devices(), [
+            ('Desktop', 'Chrome', self.now + timedelta(seconds=30)), ('Mobile', 'Safari', self.now),
+        ])
+        self.assertEqual(self.buffer.stats, {'recorded': 2, 'throttled': 2, 'updated': 0, 'created': 2})
+
+    def test_written_devices_are_throttled_for_the_interval(self):
+        self.buffer.record(self.user, CHROME_WINDOWS, self.now)
+        self.buffer.flush()
+        self.assertFalse(self.buffer.record(self.user, CHROME_WINDOWS, self.now + timedelta(seconds=299)))
+        self.assertTrue(self.buffer.record(self.user, CHROME_WINDOWS, self.now + timedelta(seconds=300)))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.buffer.flush(), 1)
+        statements = [query['sql'].split()[0] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(statements, ['SELECT', 'UPDATE'])
+        self.assertEqual(self.devices(), [('Desktop', 'Chrome', self.now + timedelta(seconds=300))])
+
+    def test_flush_respects_writes_from_other_processes(self):
+        UserDevice.objects.bulk_create([
+            UserDevice(user=self.user, device_type='Desktop', browser='Chrome', operating_system='Windows',
+                       last_seen=self.now - timedelta(days=2)),
+            UserDevice(user=self.user, device_type='Desktop', browser='Chrome', operating_system='Windows',
+                       last_seen=self.now - timedelta(seconds=60)),
+            UserDevice(user=self.user, device_type='Mobile', browser='Safari', operating_system='iOS',
+                       last_seen=self.now - timedelta(days=1)),
+        ])
+        self.buffer.record(self.user, CHROME_WINDOWS, self.now)
+        self.buffer.record(self.user, SAFARI_IPHONE, self.now)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.devices(), [
+            ('Desktop', 'Chrome', self.now - timedelta(days=2)),
+            ('Desktop', 'Chrome', self.now - timedelta(seconds=60)),  # the most recent duplicate, seen recently
+            ('Mobile', 'Safari', self.now),
+        ])
+        self.assertEqual((self.buffer.stats['updated'], self.buffer.stats['throttled']), (1, 1))
+
+
+class BackfillGeoTests(TestCase):
+    """backfill_geo resolves users in batches and checkpoints each written batch, so it can resume."""
+
+    CITIES = {
+        1: {'country_iso_code': 'FR', 'time_zone': 'Europe/Paris', 'city_name': 'Paris'},
+        2: {'country_iso_code': 'IN', 'time_zone': 'Asia/Kolkata', 'city_name': 'Mumbai'},
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        Country.objects.create(name='France', code='FR', currency='EUR', default_timezone='Europe/Paris')
+        Country.objects.create(name='India', code='IN', currency='INR', default_timezone='Asia/Kolkata')
+        cls.kept_currency = Currency.objects.create(code='USD')
+        cls.users = [CustomUser.objects.create(username=f'geo{n}', email=f'geo{n}@example.com') for n in range(5)]
+        for n, user in enumerate(cls.users):
+            # Users at 10.0.0.1 resolve to Paris, 10.0.0.2 to Mumbai, anything else to nothing.
+            CustomUser.objects.filter(pk=user.pk).update(last_known_ip=f'10.0.0.{n % 3 + 1}', preferred_currency=cls.kept_currency)
+        CustomUser.objects.create(username='no-ip', email='no-ip@example.com')
+
+    def setUp(self):
+        reference_data.invalidate()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, 'checkpoint')
+        for target, replacement in (
+            ('ProcessPoolExecutor', ThreadPoolExecutor),  # same map() contract, without forking the test process
+            ('get_ip_index', mock.DEFAULT),
+            ('get_city_database', mock.DEFAULT),
+            ('get_geoname_id_for_ip', lambda ip: {'10.0.0.1': 1, '10.0.0.2': 2}.get(ip)),
+            ('get_city_data', self.CITIES.get),
+        ):
+            patcher = mock.patch.object(backfill_geo, target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def backfill(self, *args):
+        out = io.StringIO()
+        call_command('backfill_geo', '--workers', '2', '--checkpoint', self.checkpoint, *args, stdout=out)
+        return out.getvalue()
+
+    def resolved(self):
+        return list(CustomUser.objects.filter(pk__in=[user.pk for user in self.users]).order_by('pk').values_list(
+            'preferred_currency__code', 'preferred_timezone__name', 'geolocation__city_name',
+        ))
+
+    def read_checkpoint(self):
+        with open(self.checkpoint, encoding='utf-8') as checkpoint:
+            return json.load(checkpoint)['last_pk']
+
+    def test_split(self):
+        self.assertEqual(backfill_geo.split([1, 2, 3, 4, 5], 2), [[1, 2, 3], [4, 5]])
+        self.assertEqual(backfill_geo.split([1], 4), [[1]])
+        self.assertEqual(backfill_geo.split([], 4), [])
+
+    def test_users_are_resolved_in_batches(self):
+        with mock.patch.object(backfill_geo.Command, 'write_checkpoint', autospec=True,
+                               side_effect=backfill_geo.Command.write_checkpoint) as write_checkpoint:
+            output = self.backfill('--batch-size', '2', '--chunk-size', '1')
+        self.assertEqual([call.args[2] for call in write_checkpoint.call_args_list],
+                         [self.users[1].pk, self.users[3].pk, self.users[4].pk])
+        self.assertEqual([line.split(' users')[0] for line in output.splitlines()[:3]], ['2', '4', '5'])
+        self.assertIn('Done: 5 users resolved, 4 updated', output)
+        self.assertEqual(self.resolved(), [
+            ('EUR', 'Europe/Paris', 'Paris'), ('INR', 'Asia/Kolkata', 'Mumbai'), ('USD', None, None),
+            ('EUR', 'Europe/Paris', 'Paris'), ('INR', 'Asia/Kolkata', 'Mumbai'),
+        ])
+        self.assertEqual(self.read_checkpoint(), self.users[4].pk)
+
+    def test_interrupted_run_resumes_after_the_last_written_batch(self):
+        update = CustomUser.objects.bulk_update
+        calls = []
+
+        def fail_second_batch(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return update(*args, **kwargs)
+
+        with mock.patch.object(CustomUser.objects, 'bulk_update', side_effect=fail_second_batch), \
+                self.assertRaises(KeyboardInterrupt):
+            self.backfill('--batch-size', '2')
+        self.assertEqual(self.read_checkpoint(), self.users[1].pk)
+        self.assertEqual(self.resolved()[2:], [('USD', None, None)] * 3)
+
+        with mock.patch.object(backfill_geo, 'resolve_ips', wraps=backfill_geo.resolve_ips) as resolve_ips:
+            output = self.backfill('--batch-size', '2')
+        self.assertIn(f'Resuming after user id {self.users[1].pk}', output)
+        self.assertEqual(sorted(pk for call in resolve_ips.call_args_list for pk, _ in call.args[0]),
+                         [user.pk for user in self.users[2:]])
+        self.assertEqual(self.resolved()[3:], [('EUR', 'Europe/Paris', 'Paris'), ('INR', 'Asia/Kolkata', 'Mumbai')])
+        self.assertIn('Done: 5 users resolved', self.backfill('--restart'))
+
+    def test_unreadable_checkpoint_starts_over(self):
+        with open(self.checkpoint, 'w', encoding='utf-8') as checkpoint:
+            checkpoint.write('{"last')
+        self.assertIn('Done: 5 users resolved', self.backfill())
+
+    def test_dry_run_writes_nothing(self):
+        self.assertIn('Done: 5 users resolved, 4 updated', self.backfill('--dry-run'))
+        self.assertEqual(self.resolved(), [('USD', None, None)] * 5)
+        self.assertFalse(os.path.exists(self.checkpoint))
@@ -0,0 +1,186 @@
+# users/tracking.py
+"""
+Behavioral event ingestion (page views, clicks).
+
+Requests append events to a per-worker ring buffer; a background thread
+writes the buffer to BehaviorEvent in one batch (COPY on PostgreSQL,
+bulk_create elsewhere). Nothing on the request path touches the user row.
+``rollup_behavior_events`` later folds new events into CustomUser's
+visit_count / last_visit / last_page_visited with a single bulk_update.
+"""
+import csv
+import io
+import json
+import logging
+from collections import deque
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Max, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .activity import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAME = 'customuser_visits'
+
+
+class BehaviorEventBuffer(BackgroundFlusher):
+    """
+    Bounded ring buffer of pending events.
+
+    When producers outrun the flusher the oldest events are overwritten (and
+    counted in ``stats['dropped']``) instead of blocking requests.
+    """
+
+    def __init__(self, capacity=None, flush_interval=None):
+        super().__init__()
+        self.capacity = capacity or getattr(settings, 'BEHAVIOR_EVENT_BUFFER_SIZE', 10000)
+        self.flush_interval = flush_interval or getattr(settings, 'BEHAVIOR_EVENT_FLUSH_INTERVAL', 5)
+        self.stats = {'recorded': 0, 'dropped': 0, 'flushed': 0}
+        self._events = deque(maxlen=self.capacity)
+
+    def record(self, user_id, event_type, url='', occurred_at=None, metadata=None):
+        self._ensure_worker()
+        with self._lock:
+            if len(self._events) == self.capacity:
+                self.stats['dropped'] += 1
+            self._events.append((user_id, event_type, (url or '')[:2048], occurred_at or timezone.now(), metadata))
+            self.stats['recorded'] += 1
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                events = list(self._events)
+                self._events.clear()
+            if not events:
+                return 0
+            try:
+                write_events(events)
+            except Exception:
+                logger.exception("Dropped %d buffered behavior events", len(events))
+                return 0
+            self.stats['flushed'] += len(events)
+            return len(events)
+
+    def reset_after_fork(self):
+        self._events.clear()
+
+
+def write_events(events, using='default'):
+    """Insert (user_id, event_type, url, occurred_at, metadata) tuples in one batch."""
+    BehaviorEvent = apps.get_model('users', 'BehaviorEvent')
+    connection = connections[using]
+    ingested_at = timezone.now()
+    if connection.vendor == 'postgresql':
+        _copy_events(connection, BehaviorEvent, events, ingested_at)
+        return
+    BehaviorEvent.objects.using(using).bulk_create(
+        [
+            BehaviorEvent(
+                user_id=user_id, event_type=event_type, url=url,
+                occurred_at=occurred_at, ingested_at=ingested_at, metadata=metadata,
+            )
+            for user_id, event_type, url, occurred_at, metadata in events
+        ],
+        batch_size=1000,
+    )
+
+
+def _copy_events(connection, model, events, ingested_at):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for user_id, event_type, url, occurred_at, metadata in events:
+        writer.writerow([
+            user_id, event_type, url, occurred_at.isoformat(), ingested_at.isoformat(),
+            '' if metadata is None else json.dumps(metadata),
+        ])
+    buffer.seek(0)
+
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in (
+        'user', 'event_type', 'url', 'occurred_at', 'ingested_at', 'metadata',
+    ))
+    # Empty unquoted CSV fields load as NULL; url must stay an empty string.
+    sql = (
+        f"COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN "
+        f"WITH (FORMAT csv, FORCE_NOT_NULL ({quote('url')}))"
+    )
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, 'copy_expert'):  # psycopg2
+            raw_cursor.copy_expert(sql, buffer)
+        else:  # psycopg 3
+            with raw_cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+
+event_buffer = BehaviorEventBuffer()
+
+
+def track_event(user, event_type, url='', occurred_at=None, metadata=None):
+    """Queue one behavioral event for ``user``. Never writes to the database directly."""
+    event_buffer.record(user.pk, event_type, url, occurred_at, metadata)
+
+
+def rollup_behavior_events(batch_size=50000, settle_seconds=None):
+    """
+    Fold page views recorded since the last run into CustomUser.
+
+    Events are consumed in id order behind a high-water mark stored in
+    BehaviorRollupState. Only events ingested more than ``settle_seconds`` ago
+    are considered, so in-flight batches with lower ids are not skipped.
+    Each batch updates the users and the mark in one transaction.
+
+    Returns the number of events consumed.
+    """
+    BehaviorEvent = apps.get_model('users', 'BehaviorEvent')
+    BehaviorRollupState = apps.get_model('users', 'BehaviorRollupState')
+    CustomUser = apps.get_model('users', 'CustomUser')
+    if settle_seconds is None:
+        settle_seconds = getattr(settings, 'BEHAVIOR_ROLLUP_SETTLE_SECONDS', 60)
+    cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+    url_length = CustomUser._meta.get_field('last_page_visited').max_length
+
+    consumed = 0
+    BehaviorRollupState.objects.get_or_create(name=ROLLUP_NAME)
+    while True:
+        with transaction.atomic():
+            state = BehaviorRollupState.objects.select_for_update().get(name=ROLLUP_NAME)
+            pending = BehaviorEvent.objects.filter(pk__gt=state.last_event_id, ingested_at__lt=cutoff)
+            upper = pending.order_by('pk').values_list('pk', flat=True)[batch_size - 1:batch_size].first()
+            if upper is None:
+                upper = pending.aggregate(upper=Max('pk'))['upper']
+            if upper is None:
+                return consumed
+
+            window = BehaviorEvent.objects.filter(pk__gt=state.last_event_id, pk__lte=upper)
+            views = (
+                window.filter(event_type='page_view')
+                .values('user_id')
+                .annotate(views=Count('pk'), last_at=Max('occurred_at'), last_id=Max('pk'))
+                .order_by()
+            )
+            views = list(views)
+            last_urls = dict(
+                BehaviorEvent.objects.filter(pk__in=[row['last_id'] for row in views]).values_list('user_id', 'url')
+            )
+            users = []
+            for row in views:
+                last_at = Value(row['last_at'], output_field=CustomUser._meta.get_field('last_visit'))
+                users.append(CustomUser(
+                    pk=row['user_id'],
+                    visit_count=F('visit_count') + row['views'],
+                    last_visit=Greatest(Coalesce(F('last_visit'), last_at), last_at),
+                    last_page_visited=last_urls.get(row['user_id'], '')[:url_length] or None,
+                ))
+            if users:
+                CustomUser.objects.bulk_update(users, ['visit_count', 'last_visit', 'last_page_visited'], batch_size=1000)
+
+            consumed += window.count()
+            state.last_event_id = upper
+            state.save(update_fields=['last_event_id', 'updated_at'])
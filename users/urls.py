@@ -50,10 +50,17 @@ urlpatterns = [
         # New endpoints for roles, user roles, and app modules
         path('roles/', views.RoleList.as_view(), name='role-list'),
         path('roles/<int:pk>/', views.RoleDetail.as_view(), name='role-detail'),
+        path('roles/apply-template/', views.ApplyPermissionTemplateView.as_view(), name='role-apply-template'),
         path('user_roles/', views.UserRoleList.as_view(), name='user_role-list'),
         path('user_roles/<int:pk>/', views.UserRoleDetail.as_view(), name='user_role-detail'),
         path('app_modules/', views.AppModuleList.as_view(), name='app_module-list'),
         path('app_modules/<int:pk>/', views.AppModuleDetail.as_view(), name='app_module-detail'),
+        path('events/', views.TrackEventsView.as_view(), name='track-events'),
+        path('funnel/', views.FunnelView.as_view(), name='funnel'),
+        path('audiences/count/', views.AudienceCountView.as_view(), name='audience-count'),
+        path('audiences/export/', views.AudienceExportView.as_view(), name='audience-export'),
+        path('users/export/', views.UserExportView.as_view(), name='user-export'),
+        path('users/provision/', views.ProvisionUsersView.as_view(), name='user-provision'),
     ])),
 ]
 
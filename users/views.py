@@ -12,16 +12,28 @@ from django.utils.crypto import get_random_string
 from django.core.mail import send_mail
 from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm, PasswordChangeForm
-from .models import CustomUser, Vendor, Country, State, City, Timezone, Role, UserRole, AppModule
+from .models import CustomUser, Vendor, Country, State, City, Timezone, Role, UserRole, AppModule, RolePermission
 from .forms import VendorSignupForm, VendorProfileForm, VendorUpdateForm, UserSignupForm, UserProfileForm
 from shared.models import Notification 
-from shared.services import create_notification
+from shared.services import apply_permission_template, create_notification
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework import generics
-from .serializers import CustomUserSerializer, VendorSerializer, CountrySerializer, StateSerializer, CitySerializer, TimezoneSerializer, RoleSerializer, UserRoleSerializer, AppModuleSerializer
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework import generics, status
+from rest_framework.response import Response
+from .serializers import CustomUserSerializer, VendorSerializer, CountrySerializer, StateSerializer, CitySerializer, TimezoneSerializer, RoleSerializer, UserRoleSerializer, AppModuleSerializer, BehaviorEventSerializer, PermissionTemplateSerializer, AudienceQuerySerializer
+from .tracking import track_event
+from .funnels import funnel
+from .audience import AudienceQueryError, audience_index, iter_ids
+from .provisioning import parse_csv, parse_json, provision_users
+from .mailqueue import mail_queue
+from .exports import EXPORT_FORMATS, PURPOSE_FLAGS, export_rows, exportable_users, stream_csv, stream_ndjson
 from django.contrib.auth.views import LoginView
 from django.urls import reverse_lazy
+from django.db.models import Prefetch, Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import timedelta
 # Vendor Signup
 class VendorSignupView(View):
     template_name = 'users/vendor_signup.html'
@@ -145,10 +157,9 @@ class AddUserView(LoginRequiredMixin, View):
             location_group, created = Group.objects.get_or_create(name=location_group_name)
             user.groups.add(location_group)
 
-            send_mail(
+            mail_queue.enqueue(
                 subject='Your Temporary Password',
                 message=f'Your temporary password is: {temp_password}. Please change it upon first login.',
-                from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[user.email],
             )
 
@@ -351,23 +362,31 @@ class TimezoneDetail(generics.RetrieveAPIView):
     serializer_class = TimezoneSerializer
     permission_classes = [AllowAny]
 
+def with_user_relations(queryset):
+    """Load everything CustomUserSerializer touches: a page costs three queries whatever its size."""
+    return queryset.select_related('country', 'state', 'city').prefetch_related(
+        # The prefetch fills in UserRole.user from the parent row, so only role and vendor are joined.
+        Prefetch('userrole_set', queryset=UserRole.objects.select_related('role', 'vendor')),
+        Prefetch('user_permissions', queryset=Permission.objects.only('id', 'codename').order_by('codename')),
+    )
+
 class CustomUserList(generics.ListAPIView):
-    queryset = CustomUser.objects.all()
+    queryset = with_user_relations(CustomUser.objects.order_by('pk'))
     serializer_class = CustomUserSerializer
     permission_classes = [IsAuthenticated]
 
 class CustomUserDetail(generics.RetrieveAPIView):
-    queryset = CustomUser.objects.all()
+    queryset = with_user_relations(CustomUser.objects.all())
     serializer_class = CustomUserSerializer
     permission_classes = [IsAuthenticated]
 
 class VendorList(generics.ListAPIView):
-    queryset = Vendor.objects.all()
+    queryset = with_user_relations(Vendor.objects.order_by('pk'))
     serializer_class = VendorSerializer
     permission_classes = [IsAuthenticated]
 
 class VendorDetail(generics.RetrieveAPIView):
-    queryset = Vendor.objects.all()
+    queryset = with_user_relations(Vendor.objects.all())
     serializer_class = VendorSerializer
     permission_classes = [IsAuthenticated]
 
@@ -399,4 +418,143 @@ class AppModuleList(generics.ListAPIView):
 class AppModuleDetail(generics.RetrieveAPIView):
     queryset = AppModule.objects.all()
     serializer_class = AppModuleSerializer
-    permission_classes = [IsAuthenticated]
\ No newline at end of file
+    permission_classes = [IsAuthenticated]
+
+class TrackEventsView(generics.GenericAPIView):
+    """Accept one event or a list of events (page views, clicks) for the current user."""
+    serializer_class = BehaviorEventSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        many = isinstance(request.data, list)
+        serializer = self.get_serializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        events = serializer.validated_data if many else [serializer.validated_data]
+        for event in events:
+            track_event(request.user, event['event_type'], event.get('url', ''), event.get('occurred_at'), event.get('metadata'))
+        return Response({'queued': len(events)}, status=status.HTTP_202_ACCEPTED)
+
+class FunnelView(generics.GenericAPIView):
+    """Stage entries and conversions between ?start= and ?end= (dates, default: last 7 days)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            end = parse_date(request.query_params['end']) if 'end' in request.query_params else timezone.localdate()
+            start = parse_date(request.query_params['start']) if 'start' in request.query_params else end - timedelta(days=6)
+        except (TypeError, ValueError):
+            start = end = None
+        if start is None or end is None:
+            return Response({'detail': 'start and end must be valid YYYY-MM-DD dates.'}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({'detail': 'start must not be after end.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(funnel(start, end))
+
+class AudienceCountView(generics.GenericAPIView):
+    """POST {"query": {...}} -> number of users in the audience (see users.audience for the query format)."""
+    serializer_class = AudienceQuerySerializer
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            count = audience_index.count(serializer.validated_data['query'])
+        except AudienceQueryError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'count': count})
+
+class AudienceExportView(generics.GenericAPIView):
+    """POST {"query": {...}} -> the matching user ids, one per line, streamed."""
+    serializer_class = AudienceQuerySerializer
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            bitmap = audience_index.evaluate(serializer.validated_data['query'])
+        except AudienceQueryError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        def lines(chunk_size=5000):
+            chunk = []
+            for user_id in iter_ids(bitmap):
+                chunk.append(f"{user_id}\n")
+                if len(chunk) == chunk_size:
+                    yield ''.join(chunk)
+                    chunk = []
+            yield ''.join(chunk)
+
+        return StreamingHttpResponse(lines(), content_type='text/plain')
+
+class UserExportView(generics.GenericAPIView):
+    """
+    Stream consenting users as CSV or NDJSON.
+
+    ?output=csv|ndjson, ?purpose=share|sell (the UserPrivacySettings flag that
+    must be set) and any number of ?consent=<ConsentType name> that must be granted.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        output = request.query_params.get('output', 'csv')
+        purpose = request.query_params.get('purpose', 'share')
+        if output not in EXPORT_FORMATS or purpose not in PURPOSE_FLAGS:
+            return Response(
+                {'detail': f"output must be one of {', '.join(EXPORT_FORMATS)}; purpose one of {', '.join(PURPOSE_FLAGS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        rows = export_rows(exportable_users(purpose, request.query_params.getlist('consent')))
+        if output == 'csv':
+            response = StreamingHttpResponse(stream_csv(rows), content_type='text/csv')
+        else:
+            response = StreamingHttpResponse(stream_ndjson(rows), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="users-{purpose}.{output}"'
+        return response
+
+class ApplyPermissionTemplateView(generics.GenericAPIView):
+    """Apply a permission template to many roles at once; only the differences are written."""
+    serializer_class = PermissionTemplateSerializer
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        role_ids = Role.objects.filter(Q(pk__in=data['roles']) | Q(vendor_id__in=data['vendors'])).values_list('pk', flat=True)
+        if 'template_role' in data:
+            permissions = RolePermission.objects.filter(
+                role=data['template_role'], app_module__isnull=True
+            ).values_list('permission_id', flat=True)
+        else:
+            permissions = data['permissions']
+        try:
+            result = apply_permission_template(role_ids, list(permissions), mode=data['mode'])
+        except Permission.DoesNotExist as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
+
+class ProvisionUsersView(generics.GenericAPIView):
+    """
+    Bulk version of AddUserView: POST a JSON list of users (or {"users": [...]}),
+    a CSV body (text/csv), or a CSV/JSON upload in ``file``.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            raise PermissionDenied
+        try:
+            if request.content_type.startswith('text/csv'):
+                rows = parse_csv(request.body)
+            elif 'file' in request.FILES:
+                upload = request.FILES['file']
+                rows = parse_json(upload) if upload.name.lower().endswith('.json') else parse_csv(upload)
+            else:
+                rows = parse_json(request.data)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        result = provision_users(rows, created_by=request.user)
+        code = status.HTTP_201_CREATED if result['created'] else status.HTTP_400_BAD_REQUEST
+        return Response(result, status=code)